@@ -0,0 +1,212 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Iterable, Optional, List, Sequence, Tuple
+
+from database import Database, USER_CHUNK_SIZE
+from records import LeaderboardEntry
+from write_batcher import WriteBatcher
+
+READ_POOL_SIZE = 4
+
+
+class AsyncDatabase:
+    """Awaitable facade over Database that keeps SQLite off the event loop.
+
+    Every write goes through one dedicated writer thread so writes never
+    contend for the SQLite write lock with each other, while reads are spread
+    over a small pool. Each worker thread gets its own connection from the
+    Database connection manager.
+
+    With ``batch_writes``, registrations and redemptions are group-committed
+    through a WriteBatcher instead of one transaction each. ``durability``
+    sets PRAGMA synchronous on the writer connection.
+    """
+
+    def __init__(self, database: Database, read_workers: int = READ_POOL_SIZE,
+                 batch_writes: bool = False, durability: Optional[str] = None, **batch_options):
+        self.database = database
+        self._writer = ThreadPoolExecutor(max_workers=1,
+                                          thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=read_workers,
+                                           thread_name_prefix='db-reader')
+        if durability:
+            self._writer.submit(database.set_durability, durability).result()
+        self.batcher = None
+        if batch_writes:
+            self.batcher = WriteBatcher(partial(self._write, database.apply_batch), **batch_options)
+
+    async def _read(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, partial(func, *args, **kwargs))
+
+    async def _write(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, partial(func, *args, **kwargs))
+
+    @property
+    def settings(self):
+        # Reads are in-memory; write through with set_setting
+        return self.database.settings
+
+    @property
+    def leaderboard(self):
+        # In-memory snapshot, safe to read directly from the event loop
+        return self.database.leaderboard
+
+    async def flush(self):
+        """Commit any batched writes still waiting for their group"""
+        if self.batcher:
+            await self.batcher.flush()
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.database.close()
+
+    # Writes
+
+    async def add_user(self, user_id: int, username: Optional[str], first_name: str, referred_by: Optional[int] = None) -> str:
+        registration = await self.register_user(user_id, username, first_name, referred_by)
+        return registration['referral_code'] if registration else None
+
+    async def register_user(self, user_id: int, username: Optional[str], first_name: str,
+                            referred_by: Optional[int] = None) -> Optional[dict]:
+        if self.batcher:
+            return await self.batcher.submit('register_user', user_id, username, first_name, referred_by)
+        return await self._write(self.database.register_user, user_id, username, first_name, referred_by)
+
+    async def redeem_credits(self, user_id: int, credits_required: int = 300) -> Optional[str]:
+        if self.batcher:
+            return await self.batcher.submit('redeem_credits', user_id, credits_required)
+        return await self._write(self.database.redeem_credits, user_id, credits_required)
+
+    async def import_reward_codes(self, codes: Iterable[str]) -> Tuple[int, int]:
+        return await self._write(self.database.import_reward_codes, list(codes))
+
+    async def add_channel(self, channel_id: str, channel_name: str, channel_link: str = None) -> bool:
+        return await self._write(self.database.add_channel, channel_id, channel_name, channel_link)
+
+    async def remove_channel(self, channel_id: str) -> bool:
+        return await self._write(self.database.remove_channel, channel_id)
+
+    async def create_broadcast(self, message: str, total: int, status_chat_id: int, status_message_id: int) -> int:
+        return await self._write(self.database.create_broadcast, message, total, status_chat_id, status_message_id)
+
+    async def record_broadcast_results(self, broadcast_id: int, results: List[Tuple[int, str, Optional[str]]],
+                                       new_cursor: Optional[int] = None):
+        return await self._write(self.database.record_broadcast_results, broadcast_id, results, new_cursor)
+
+    async def set_broadcast_status(self, broadcast_id: int, status: str):
+        return await self._write(self.database.set_broadcast_status, broadcast_id, status)
+
+    async def set_channel_member(self, channel_id: str, user_id: int, status: str):
+        return await self._write(self.database.set_channel_member, channel_id, user_id, status)
+
+    async def check_counters(self, repair: bool = False) -> dict:
+        return await self._write(self.database.check_counters, repair)
+
+    async def reload_rankings(self):
+        # On the writer so no local write lands between the rebuild and the swap
+        return await self._write(self.database.reload_rankings)
+
+    async def track_user_changes(self):
+        return await self._write(self.database.track_user_changes)
+
+    async def sync_user_cache(self) -> int:
+        return await self._write(self.database.sync_user_cache)
+
+    async def set_setting(self, key: str, value):
+        return await self._write(self.database.settings.set, key, value)
+
+    async def set_start_message(self, message: str):
+        return await self._write(self.database.set_start_message, message)
+
+    async def set_log_channel(self, channel_id: str):
+        return await self._write(self.database.set_log_channel, channel_id)
+
+    # Reads
+
+    async def get_user(self, user_id: int, columns: Optional[Sequence[str]] = None):
+        # Cache hits are answered on the event loop without a thread hop
+        if self.database.users.enabled:
+            record = self.database.users.get(user_id)
+            if record is not None:
+                return record
+        return await self._read(self.database.load_user, user_id, columns)
+
+    async def get_user_by_referral_code(self, referral_code: str) -> Optional[int]:
+        # Current codes decode in pure CPU and are confirmed against the
+        # (usually cached) user; only legacy ones need the table
+        user_id = self.database.referral_codes.decode(referral_code)
+        if user_id is not None:
+            user = await self.get_user(user_id, ('referral_code',))
+            if user and user.referral_code == referral_code:
+                return user_id
+        # Already decoded and checked above, so only the table is left
+        return await self._read(self.database._user_by_code_column, referral_code)
+
+    async def get_leaderboard(self, limit: int = 10) -> List[LeaderboardEntry]:
+        return await self._read(self.database.get_leaderboard, limit)
+
+    def rank_for(self, total_referrals: int) -> int:
+        """Rank of a user with this many referrals, from the in-memory index"""
+        return self.database.rank_index.rank(total_referrals)
+
+    async def get_user_rank(self, user_id: int) -> int:
+        # The rank itself comes from the in-memory index
+        user = await self.get_user(user_id, ('total_referrals',))
+        return self.database.rank_index.rank(user.total_referrals) if user else 1
+
+    async def get_all_users(self) -> List[int]:
+        return await self._read(self.database.get_all_users)
+
+    async def get_user_chunk(self, after_id: int, limit: int, columns: Sequence[str] = ('user_id',)) -> List[Tuple]:
+        return await self._read(self.database.get_user_chunk, after_id, limit, columns)
+
+    async def iter_user_chunks(self, columns: Sequence[str] = ('user_id',), chunk_size: int = USER_CHUNK_SIZE,
+                               after_id: int = 0) -> AsyncIterator[List[Tuple]]:
+        while True:
+            rows = await self.get_user_chunk(after_id, chunk_size, columns)
+            if not rows:
+                return
+            yield rows
+            after_id = rows[-1][0]
+
+    async def iter_users(self, columns: Sequence[str] = ('user_id',), chunk_size: int = USER_CHUNK_SIZE,
+                         after_id: int = 0) -> AsyncIterator[Tuple]:
+        async for rows in self.iter_user_chunks(columns, chunk_size, after_id):
+            for row in rows:
+                yield row
+
+    async def get_broadcast(self, broadcast_id: int) -> Optional[dict]:
+        return await self._read(self.database.get_broadcast, broadcast_id)
+
+    async def get_latest_broadcast_id(self, status: Optional[str] = None) -> Optional[int]:
+        return await self._read(self.database.get_latest_broadcast_id, status)
+
+    async def get_broadcast_done(self, broadcast_id: int, first_user_id: int, last_user_id: int) -> set:
+        return await self._read(self.database.get_broadcast_done, broadcast_id, first_user_id, last_user_id)
+
+    async def get_reward_code_stats(self) -> dict:
+        return await self._read(self.database.get_reward_code_stats)
+
+    async def get_stats(self) -> dict:
+        return await self._read(self.database.get_stats)
+
+    async def get_channels(self) -> List[Tuple[str, str, str]]:
+        return await self._read(self.database.get_channels)
+
+    async def get_channel_memberships(self, user_id: int) -> dict:
+        return await self._read(self.database.get_channel_memberships, user_id)
+
+    async def reload_settings(self):
+        return await self._read(self.database.settings.reload)
+
+    # Served from the in-memory settings store, no thread hop needed
+
+    async def get_start_message(self) -> str:
+        return self.database.get_start_message()
+
+    async def get_log_channel(self) -> Optional[str]:
+        return self.database.get_log_channel()
@@ -0,0 +1,323 @@
+"""Local fake Telegram Bot API server for end-to-end load tests.
+
+Serves the FakeBotApi methods over HTTP at ``/bot<token>/<method>``, the
+way api.telegram.org does, and drives a scripted population of users
+against the bot: each user registers (most through someone else's
+referral link, picked up from the bot's replies) and then repeatedly
+runs a session script, waiting for the bot's answer to every step.
+Updates are served to getUpdates, or POSTed to the webhook the bot
+registers with setWebhook.
+
+    python benchmarks/fake_bot_api_server.py --port 8081 --users 1000 --duration 60
+    BOT_TOKEN=123:fake BOT_API_BASE_URL=http://127.0.0.1:8081/bot python bot.py
+
+GET /stats returns the live counters; the final report is printed as JSON
+when ``--duration`` runs out.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_telegram import FakeBotApi, callback_update, command_update
+
+logger = logging.getLogger(__name__)
+
+# Raw string parameters that must not be JSON-decoded
+TEXT_PARAMETERS = ('text', 'url', 'secret_token', 'callback_query_id')
+REFERRAL_LINK = re.compile(r'\?start=([A-Za-z0-9_-]+)')
+SESSION_SCRIPT = (
+    ('command', '/profile'),
+    ('callback', 'leaderboard'),
+    ('callback', 'profile'),
+    ('command', '/leaderboard'),
+    ('callback', 'redeem'),
+)
+WEBHOOK_CONNECTIONS = 40
+
+
+def decode_parameters(body: bytes, content_type: str) -> dict:
+    if content_type.startswith('application/json'):
+        return json.loads(body or b'{}')
+    params = {}
+    # PTB sends form fields whose non-string values are JSON encoded
+    for key, value in parse_qsl(body.decode('utf-8'), keep_blank_values=True):
+        if key in TEXT_PARAMETERS:
+            params[key] = value
+            continue
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+def percentile(ordered: List[float], share: float) -> float:
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))] if ordered else 0.0
+
+
+class Population:
+    """Closed-loop synthetic users measuring update-to-reply latency.
+
+    A step counts as answered by the first sendMessage, editMessageText or
+    answerCallbackQuery addressed to that user after the update was queued.
+    """
+
+    def __init__(self, api: FakeBotApi, users: int, first_user_id: int = 1,
+                 referred_share: float = 0.7, think_time: float = 1.0, reply_timeout: float = 10.0):
+        self.api = api
+        self.users = users
+        self.first_user_id = first_user_id
+        self.referred_share = referred_share
+        self.think_time = think_time
+        self.reply_timeout = reply_timeout
+        self.codes: List[str] = []
+        self.latencies: List[float] = []
+        self.answered = 0
+        self.timeouts = 0
+        self._waiting: Dict[int, asyncio.Future] = {}
+        api.listeners.append(self._on_call)
+
+    def _on_call(self, method: str, params: dict):
+        if method == 'answerCallbackQuery':
+            user_id = int(str(params.get('callback_query_id', '0')).split(':')[0])
+        elif method in ('sendMessage', 'editMessageText'):
+            user_id = int(params.get('chat_id', 0))
+            match = REFERRAL_LINK.search(params.get('text', ''))
+            if match and method == 'sendMessage':
+                self.codes.append(match.group(1))
+        else:
+            return
+        future = self._waiting.pop(user_id, None)
+        if future and not future.done():
+            future.set_result(time.perf_counter())
+
+    async def _step(self, user_id: int, kind: str, value: str) -> bool:
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[user_id] = future
+        update_id = self.api.next_update_id()
+        if kind == 'command':
+            self.api.push_update(command_update(update_id, user_id, value))
+        else:
+            self.api.push_update(callback_update(update_id, user_id, value))
+        started = time.perf_counter()
+        try:
+            answered_at = await asyncio.wait_for(future, self.reply_timeout)
+        except asyncio.TimeoutError:
+            self._waiting.pop(user_id, None)
+            self.timeouts += 1
+            return False
+        self.latencies.append(answered_at - started)
+        self.answered += 1
+        return True
+
+    async def _run_user(self, user_id: int, deadline: float):
+        start = '/start'
+        if self.codes and random.random() < self.referred_share:
+            start = f"/start {random.choice(self.codes)}"
+        if not await self._step(user_id, 'command', start):
+            return
+        step = 0
+        while time.monotonic() < deadline:
+            await asyncio.sleep(random.expovariate(1 / self.think_time) if self.think_time else 0)
+            kind, value = SESSION_SCRIPT[step % len(SESSION_SCRIPT)]
+            await self._step(user_id, kind, value)
+            step += 1
+
+    async def run(self, duration: float, ramp_up: float):
+        deadline = time.monotonic() + duration
+        tasks = []
+        for index in range(self.users):
+            tasks.append(asyncio.create_task(self._run_user(self.first_user_id + index, deadline)))
+            if ramp_up:
+                await asyncio.sleep(ramp_up / self.users)
+        await asyncio.gather(*tasks)
+
+    def stats(self) -> dict:
+        ordered = sorted(self.latencies)
+        return {
+            'users': self.users,
+            'answered': self.answered,
+            'timeouts': self.timeouts,
+            'p50_ms': round(percentile(ordered, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(ordered, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(ordered, 0.99) * 1000, 1),
+        }
+
+
+class FakeBotApiServer:
+    def __init__(self, api: FakeBotApi, host: str = '127.0.0.1', port: int = 8081,
+                 population: Optional[Population] = None):
+        self.api = api
+        self.host = host
+        self.port = port
+        self.population = population
+        self.webhook_deliveries = 0
+        self.webhook_failures = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers = set()
+        self._webhook_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self._webhook_task = asyncio.create_task(self._deliver_webhooks())
+        logger.info(f"Fake Bot API listening on http://{self.host}:{self.port}/bot")
+
+    async def stop(self):
+        if self._webhook_task:
+            self._webhook_task.cancel()
+        if self._server:
+            self._server.close()
+            # Drop kept-alive client connections too, or wait_closed hangs
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+
+    def stats(self) -> dict:
+        stats = {'api': self.api.stats(),
+                 'webhook': {'deliveries': self.webhook_deliveries, 'failures': self.webhook_failures}}
+        if self.population:
+            stats['population'] = self.population.stats()
+        return stats
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            # Clients such as httpx keep the connection open between calls
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                method, path = request_line.decode('latin-1').split()[:2]
+                path = path.split('?', 1)[0]
+                if method == 'GET' and path == '/stats':
+                    status, payload = 200, self.stats()
+                else:
+                    try:
+                        params = decode_parameters(body, headers.get('content-type', ''))
+                    except ValueError:
+                        status, payload = 400, {'ok': False, 'error_code': 400,
+                                                'description': 'Bad Request: unsupported body'}
+                    else:
+                        status, payload = await self.api.call(path.rsplit('/', 1)[-1], params)
+
+                data = json.dumps(payload).encode('utf-8')
+                writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError, ValueError):
+            # Cancelled only at shutdown, which should not be reported as a failure
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _deliver_webhooks(self):
+        semaphore = asyncio.Semaphore(WEBHOOK_CONNECTIONS)
+        offset = 0
+        while True:
+            if not self.api.webhook_url:
+                await asyncio.sleep(0.1)
+                continue
+            updates = await self.api.wait_updates(offset, timeout=1)
+            for update in updates:
+                offset = update['update_id'] + 1
+                await semaphore.acquire()
+                task = asyncio.create_task(self._post_update(update))
+                task.add_done_callback(lambda _: semaphore.release())
+
+    async def _post_update(self, update: dict):
+        url = urlsplit(self.api.webhook_url)
+        body = json.dumps(update).encode('utf-8')
+        headers = (f"POST {url.path or '/'} HTTP/1.1\r\n"
+                   f"Host: {url.netloc}\r\n"
+                   f"Content-Type: application/json\r\n"
+                   f"Content-Length: {len(body)}\r\n"
+                   f"Connection: close\r\n")
+        if self.api.webhook_secret:
+            headers += f"X-Telegram-Bot-Api-Secret-Token: {self.api.webhook_secret}\r\n"
+        try:
+            reader, writer = await asyncio.open_connection(
+                url.hostname, url.port or (443 if url.scheme == 'https' else 80),
+                ssl=url.scheme == 'https' or None)
+            writer.write(headers.encode('latin-1') + b'\r\n' + body)
+            await writer.drain()
+            status_line = await reader.readline()
+            writer.close()
+            if b' 200 ' in status_line:
+                self.webhook_deliveries += 1
+                return
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        self.webhook_failures += 1
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--users', type=int, default=0, help="Scripted users to simulate; 0 only serves the API")
+    parser.add_argument('--first-user-id', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=60, help="Seconds to run the population for")
+    parser.add_argument('--ramp-up', type=float, default=10, help="Seconds over which users arrive")
+    parser.add_argument('--think-time', type=float, default=1.0, help="Mean pause between a user's steps")
+    parser.add_argument('--referred-share', type=float, default=0.7)
+    parser.add_argument('--latency', type=float, default=0.05, help="Delay before answering each call")
+    parser.add_argument('--retry-after-rate', type=float, default=0.0,
+                        help="Share of calls answered with 429 retry_after")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--non-member-share', type=float, default=0.0,
+                        help="Share of users getChatMember reports as having left")
+    parser.add_argument('--report-interval', type=float, default=10)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    api = FakeBotApi(latency=args.latency, retry_after_rate=args.retry_after_rate,
+                     retry_after=args.retry_after, non_member_share=args.non_member_share)
+    population = None
+    if args.users:
+        population = Population(api, args.users, args.first_user_id, args.referred_share, args.think_time)
+    server = FakeBotApiServer(api, args.host, args.port, population)
+    await server.start()
+
+    async def report():
+        while True:
+            await asyncio.sleep(args.report_interval)
+            logger.info(json.dumps(server.stats()))
+
+    reporter = asyncio.create_task(report())
+    try:
+        if population:
+            # Give the bot a moment to connect before the first users arrive
+            while not api.calls['getUpdates'] and not api.webhook_url:
+                await asyncio.sleep(0.2)
+            await population.run(args.duration, args.ramp_up)
+            print(json.dumps(server.stats(), indent=2))
+        else:
+            await asyncio.Event().wait()
+    finally:
+        reporter.cancel()
+        await server.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,241 @@
+"""Stand-in for the Telegram Bot API, shared by the benchmarks.
+
+FakeBotApi answers Bot API methods from a synthetic user population and
+counts every call. FakeRequest plugs it into a real ``telegram.Bot``
+through PTB's request interface, so PTB's own serialisation and parsing
+still run on every call; fake_bot_api_server.py serves it over HTTP.
+"""
+import asyncio
+import json
+import random
+import time
+import zlib
+from collections import Counter
+from typing import Callable, List, Optional, Tuple
+
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {'id': 1000000001, 'is_bot': True, 'first_name': 'Bench Bot', 'username': 'bench_bot'}
+# Bookkeeping calls that are never delayed or rate limited
+CONTROL_METHODS = ('getMe', 'getUpdates', 'setWebhook', 'deleteWebhook', 'getWebhookInfo')
+MAX_POLL_TIMEOUT = 30
+
+
+def user_payload(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}", 'username': f"user{user_id}"}
+
+
+def chat_payload(chat_id) -> dict:
+    if isinstance(chat_id, str) and chat_id.startswith('@'):
+        name = chat_id[1:]
+        chat_id = -1000000000000 - zlib.crc32(name.encode('utf-8')) % 1000000
+        return {'id': chat_id, 'type': 'channel', 'title': name, 'username': name}
+    chat_id = int(chat_id)
+    if chat_id < 0:
+        return {'id': chat_id, 'type': 'channel', 'title': f"Channel {-chat_id}"}
+    return {'id': chat_id, 'type': 'private', 'first_name': f"User {chat_id}"}
+
+
+def message_payload(message_id: int, chat_id, text: str = '', from_user: Optional[dict] = None) -> dict:
+    message = {
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': chat_payload(chat_id),
+        'from': from_user or BOT_USER,
+        'text': text,
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return message
+
+
+def command_update(update_id: int, user_id: int, text: str) -> dict:
+    """A private-chat message from ``user_id``, e.g. ``/start abc``"""
+    return {'update_id': update_id,
+            'message': message_payload(update_id, user_id, text, user_payload(user_id))}
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> dict:
+    """An inline button press on a message the bot sent to ``user_id``"""
+    return {'update_id': update_id,
+            'callback_query': {
+                # Prefixed with the user so answers can be traced back to them
+                'id': f"{user_id}:{update_id}",
+                'from': user_payload(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': message_payload(update_id, user_id, 'menu'),
+            }}
+
+
+class FakeBotApi:
+    """Answers Bot API methods with plausible results after ``latency`` seconds.
+
+    ``retry_after_rate`` is the share of calls answered with a 429 asking
+    the client to wait ``retry_after`` seconds. getChatMember reports
+    ``member_status``, except for the ``non_member_share`` of users who
+    have left. Updates queued with ``push_update`` are served by
+    getUpdates, or to whatever webhook was registered with setWebhook.
+    ``listeners`` are called with (method, params) for every call.
+    """
+
+    def __init__(self, latency: float = 0.0, retry_after_rate: float = 0.0, retry_after: int = 1,
+                 member_status: str = 'member', non_member_share: float = 0.0):
+        self.latency = latency
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.member_status = member_status
+        self.non_member_share = non_member_share
+        self.calls = Counter()
+        self.errors = Counter()
+        self.listeners: List[Callable[[str, dict], None]] = []
+        self.started = time.monotonic()
+        self.webhook_url = ''
+        self.webhook_secret: Optional[str] = None
+        self._message_id = 0
+        self._update_id = 0
+        self._updates: List[dict] = []
+        self._new_update = asyncio.Event()
+        self.methods = {
+            'getMe': self.get_me,
+            'getUpdates': self.get_updates,
+            'setWebhook': self.set_webhook,
+            'deleteWebhook': self.delete_webhook,
+            'getWebhookInfo': self.get_webhook_info,
+            'sendMessage': self.send_message,
+            'editMessageText': self.edit_message_text,
+            'answerCallbackQuery': self.answer_callback_query,
+            'getChatMember': self.get_chat_member,
+            'getChat': self.get_chat,
+        }
+
+    async def call(self, method: str, params: dict) -> Tuple[int, dict]:
+        self.calls[method] += 1
+        handler = self.methods.get(method)
+        if handler is None:
+            self.errors['not_found'] += 1
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'}
+        if method in CONTROL_METHODS:
+            return 200, {'ok': True, 'result': await handler(params) if method == 'getUpdates' else handler(params)}
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.retry_after_rate and random.random() < self.retry_after_rate:
+            self.errors['retry_after'] += 1
+            return 429, {'ok': False, 'error_code': 429,
+                         'description': f"Too Many Requests: retry after {self.retry_after}",
+                         'parameters': {'retry_after': self.retry_after}}
+        result = handler(params)
+        for listener in self.listeners:
+            listener(method, params)
+        return 200, {'ok': True, 'result': result}
+
+    def next_message_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+
+    def next_update_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    def push_update(self, update: dict):
+        self._updates.append(update)
+        self._new_update.set()
+
+    async def wait_updates(self, offset: int, limit: int = 100, timeout: float = 0) -> List[dict]:
+        """Updates with update_id >= offset; earlier ones count as confirmed"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(timeout, MAX_POLL_TIMEOUT)
+        while True:
+            if offset:
+                self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            if self._updates:
+                return self._updates[:limit]
+            self._new_update.clear()
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return []
+            try:
+                await asyncio.wait_for(self._new_update.wait(), remaining)
+            except asyncio.TimeoutError:
+                return []
+
+    def pending_updates(self) -> int:
+        return len(self._updates)
+
+    def get_me(self, params: dict):
+        return BOT_USER
+
+    async def get_updates(self, params: dict):
+        return await self.wait_updates(int(params.get('offset') or 0), int(params.get('limit') or 100),
+                                       float(params.get('timeout') or 0))
+
+    def set_webhook(self, params: dict):
+        self.webhook_url = params.get('url', '')
+        self.webhook_secret = params.get('secret_token')
+        return True
+
+    def delete_webhook(self, params: dict):
+        self.webhook_url = ''
+        self.webhook_secret = None
+        if params.get('drop_pending_updates'):
+            self._updates = []
+        return True
+
+    def get_webhook_info(self, params: dict):
+        return {'url': self.webhook_url, 'has_custom_certificate': False,
+                'pending_update_count': self.pending_updates()}
+
+    def send_message(self, params: dict):
+        return message_payload(self.next_message_id(), params['chat_id'], params.get('text', ''))
+
+    def edit_message_text(self, params: dict):
+        return message_payload(params.get('message_id', 1), params.get('chat_id', 1), params.get('text', ''))
+
+    def answer_callback_query(self, params: dict):
+        return True
+
+    def get_chat_member(self, params: dict):
+        user_id = int(params['user_id'])
+        status = self.member_status
+        if self.non_member_share and zlib.crc32(str(user_id).encode('ascii')) % 1000 < self.non_member_share * 1000:
+            status = 'left'
+        return {'status': status, 'user': user_payload(user_id)}
+
+    def get_chat(self, params: dict):
+        return chat_payload(params['chat_id'])
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            'seconds': round(elapsed, 1),
+            'calls': dict(self.calls),
+            'errors': dict(self.errors),
+            'calls_per_sec': round(sum(self.calls.values()) / elapsed, 1) if elapsed else 0,
+            'pending_updates': self.pending_updates(),
+        }
+
+
+class FakeRequest(BaseRequest):
+    """PTB request backend that routes every Bot API call to a FakeBotApi"""
+
+    def __init__(self, api: FakeBotApi):
+        self.api = api
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        params = request_data.parameters if request_data else {}
+        status, payload = await self.api.call(url.rsplit('/', 1)[-1], params)
+        return status, json.dumps(payload).encode('utf-8')
@@ -0,0 +1,206 @@
+"""Latency and throughput of the real bot handlers against a fake Bot API.
+
+Seeds a database per ``--users`` size with a preferential-attachment
+referral graph (a few heavy referrers, a long tail of users with none),
+then feeds synthetic updates for each scenario through the real
+Application handler table. Every Bot API call is answered in-process by
+FakeBotApi after ``--latency`` seconds.
+
+    python benchmarks/handlers.py --users 10000 100000 1000000 --json
+
+Seeded databases are kept in ``--data-dir`` when given, so large sizes
+are built once and reused across runs and commits.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update
+from telegram.ext import Application
+
+from async_database import AsyncDatabase
+from database import Database
+from fake_telegram import FakeBotApi, FakeRequest, callback_update, command_update
+
+REFERRED_SHARE = 0.7
+BENCH_SECRET = 'handler-benchmark'
+
+
+def seed(path: str, users: int, rng: random.Random):
+    """Create ``users`` users; each is referred by an earlier user with
+    probability REFERRED_SHARE, picked in proportion to their referrals + 1"""
+    database = Database(path, referral_secret=BENCH_SECRET)
+    codec = database.referral_codes
+    referrals = [0] * (users + 1)
+    referred_by = [None] * (users + 1)
+    pool = []
+    for user_id in range(1, users + 1):
+        if pool and rng.random() < REFERRED_SHARE:
+            referrer = rng.choice(pool)
+            referred_by[user_id] = referrer
+            referrals[referrer] += 1
+            pool.append(referrer)
+        pool.append(user_id)
+
+    joined_date = datetime.now().isoformat()
+    joined_at = int(time.time())
+    conn = database.get_connection()
+    conn.executemany('''
+        INSERT INTO users (user_id, username, first_name, referral_code, referred_by,
+                           credits, total_referrals, joined_date, joined_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', ((user_id, f"user{user_id}", f"User {user_id}", codec.encode(user_id), referred_by[user_id],
+           referrals[user_id] * 5, referrals[user_id], joined_date, joined_at)
+          for user_id in range(1, users + 1)))
+    conn.executemany('''
+        INSERT INTO referrals (referrer_id, referred_id, date, created_at) VALUES (?, ?, ?, ?)
+    ''', ((referred_by[user_id], user_id, joined_date, joined_at)
+          for user_id in range(1, users + 1) if referred_by[user_id]))
+    conn.commit()
+    database.close()
+
+
+def scenarios(users: int, codec, rng: random.Random) -> Dict[str, Callable[[int], dict]]:
+    """Scenario name -> function building the n-th update payload"""
+    new_user_ids = itertools.count(users + 1)
+
+    def existing():
+        return rng.randint(1, users)
+
+    return {
+        'start': lambda n: command_update(n, existing(), '/start'),
+        'start_referred': lambda n: command_update(
+            n, next(new_user_ids), f"/start {codec.encode(existing())}"),
+        'profile': lambda n: command_update(n, existing(), '/profile'),
+        'leaderboard': lambda n: command_update(n, existing(), '/leaderboard'),
+        'redeem': lambda n: command_update(n, existing(), '/redeem'),
+        'button_callback': lambda n: callback_update(
+            n, existing(), rng.choice(('profile', 'leaderboard', 'redeem'))),
+    }
+
+
+def percentile(ordered: List[float], share: float) -> float:
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+async def run_scenario(application: Application, updates: List[Update], concurrency: int) -> dict:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def handle(update: Update):
+        async with semaphore:
+            started = time.perf_counter()
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[handle(update) for update in updates])
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'updates': len(updates),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'updates_per_sec': round(len(updates) / elapsed, 1),
+    }
+
+
+async def run_size(bot_module, seed_path: str, scratch: str, users: int, args) -> List[dict]:
+    run_path = os.path.join(scratch, 'run.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(run_path + suffix):
+            os.remove(run_path + suffix)
+    shutil.copyfile(seed_path, run_path)
+
+    # Handlers look the database up as a module global
+    bot_module.db = AsyncDatabase(Database(run_path, referral_secret=BENCH_SECRET))
+    api = FakeBotApi(latency=args.latency)
+    application = (
+        Application.builder()
+        .token('123456:benchmark')
+        .request(FakeRequest(api))
+        .get_updates_request(FakeRequest(api))
+        .updater(None)
+        .build())
+    bot_module.add_handlers(application)
+    errors = []
+
+    async def count_error(update, context):
+        errors.append(context.error)
+
+    application.add_error_handler(count_error)
+    await application.initialize()
+
+    rng = random.Random(args.seed)
+    results = []
+    for name, build in scenarios(users, bot_module.db.database.referral_codes, rng).items():
+        if args.scenarios and name not in args.scenarios:
+            continue
+        updates = [Update.de_json(build(n), application.bot) for n in range(1, args.updates + 1)]
+        errors.clear()
+        result = await run_scenario(application, updates, args.concurrency)
+        results.append({'users': users, 'handler': name, **result, 'errors': len(errors)})
+        if errors:
+            print(f"{name}: {len(errors)} handler errors, first: {errors[0]!r}", file=sys.stderr)
+
+    await application.shutdown()
+    bot_module.db.close()
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--updates', type=int, default=2000, help="Updates per scenario")
+    parser.add_argument('--concurrency', type=int, default=32, help="Updates in flight at once")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Simulated Bot API latency per call, in seconds")
+    parser.add_argument('--scenarios', nargs='*', help="Only run these scenarios")
+    parser.add_argument('--data-dir', help="Keep seeded databases here and reuse them")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as scratch:
+        data_dir = args.data_dir or scratch
+        os.makedirs(data_dir, exist_ok=True)
+        # bot opens its module-level database on import; keep it out of the cwd
+        os.environ['DB_PATH'] = os.path.join(scratch, 'import.db')
+        import bot as bot_module
+        import_db = bot_module.db
+
+        for users in args.users:
+            seed_path = os.path.join(data_dir, f"handlers-{users}-{args.seed}.db")
+            if not os.path.exists(seed_path):
+                started = time.perf_counter()
+                seed(seed_path, users, random.Random(args.seed))
+                print(f"Seeded {users} users in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+            results.extend(await run_size(bot_module, seed_path, scratch, users, args))
+
+        import_db.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(f"{result['users']:>8} users {result['handler']:>16}: "
+                  f"p50 {result['p50_ms']:>7}ms  p95 {result['p95_ms']:>7}ms  p99 {result['p99_ms']:>7}ms  "
+                  f"{result['updates_per_sec']:>8} updates/s  ({result['errors']} errors)")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
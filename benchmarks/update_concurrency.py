@@ -0,0 +1,102 @@
+"""Throughput of PerUserUpdateProcessor at different worker counts.
+
+Each synthetic update reads its user from a scratch database through
+AsyncDatabase and then waits ``--latency`` seconds to stand in for the Bot
+API round trip, which is what dominates a real handler.
+
+    python benchmarks/update_concurrency.py --workers 1 8 64
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Chat, Message, Update, User
+
+from async_database import AsyncDatabase
+from database import Database
+from update_processor import PerUserUpdateProcessor
+
+
+def make_updates(count: int, users: int):
+    updates = []
+    for update_id in range(1, count + 1):
+        user_id = random.randint(1, users)
+        user = User(id=user_id, first_name=f"user{user_id}", is_bot=False)
+        chat = Chat(id=user_id, type=Chat.PRIVATE)
+        message = Message(message_id=update_id, date=datetime.now(), chat=chat,
+                          from_user=user, text='/profile')
+        updates.append(Update(update_id=update_id, message=message))
+    return updates
+
+
+async def run(workers: int, updates, db: AsyncDatabase, latency: float) -> dict:
+    processor = PerUserUpdateProcessor(workers)
+    running = {}
+    overlaps = 0
+
+    async def handle(update: Update):
+        nonlocal overlaps
+        user_id = update.effective_user.id
+        if running.get(user_id):
+            overlaps += 1
+        running[user_id] = True
+        await db.get_user(user_id)
+        await asyncio.sleep(latency)
+        running[user_id] = False
+
+    started = time.perf_counter()
+    # Mirrors Application: one task per update, each going through the processor
+    await asyncio.gather(*[
+        asyncio.create_task(processor.process_update(update, handle(update)))
+        for update in updates
+    ])
+    elapsed = time.perf_counter() - started
+    return {
+        'workers': workers,
+        'updates': len(updates),
+        'seconds': round(elapsed, 3),
+        'updates_per_sec': round(len(updates) / elapsed, 1),
+        'same_user_overlaps': overlaps,
+        'dropped': processor.dropped,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8, 64])
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="Simulated Bot API latency per update, in seconds")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        database = Database(os.path.join(scratch, 'bench.db'))
+        for user_id in range(1, args.users + 1):
+            database.add_user(user_id, f"user{user_id}", f"User {user_id}")
+        db = AsyncDatabase(database)
+
+        updates = make_updates(args.updates, args.users)
+        results = [await run(workers, updates, db, args.latency) for workers in args.workers]
+        db.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            print(f"{result['workers']:>4} workers: {result['updates_per_sec']:>8} updates/s "
+                  f"({result['updates']} updates in {result['seconds']}s, "
+                  f"{result['same_user_overlaps']} same-user overlaps, {result['dropped']} dropped)")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""Registration throughput with and without group-commit write batching.
+
+Every caller registers one new user, and most name an earlier user as their
+referrer, so each operation inserts a user and a referral and credits the
+referrer. Each configuration runs against a fresh scratch database.
+
+    python benchmarks/write_batching.py --durability NORMAL FULL
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_database import AsyncDatabase
+from database import Database
+
+
+async def run(scratch: str, durability: str, batched: bool, args) -> dict:
+    path = os.path.join(scratch, f"bench-{durability}-{int(batched)}.db")
+    db = AsyncDatabase(Database(path), batch_writes=batched, durability=durability,
+                       max_batch=args.batch_size, max_delay=args.batch_delay_ms / 1000)
+    # Seed referrers so credits hit existing rows
+    for user_id in range(1, args.referrers + 1):
+        await db.register_user(user_id, f"user{user_id}", f"User {user_id}")
+
+    first_id = args.referrers + 1
+    ids = range(first_id, first_id + args.users)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def register(user_id: int):
+        referrer = random.randint(1, args.referrers) if random.random() < args.referred else None
+        async with semaphore:
+            await db.register_user(user_id, f"user{user_id}", f"User {user_id}", referrer)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[register(user_id) for user_id in ids])
+    elapsed = time.perf_counter() - started
+
+    stats = db.batcher.stats() if db.batcher else {}
+    db.close()
+    return {
+        'durability': durability,
+        'batched': batched,
+        'users': args.users,
+        'seconds': round(elapsed, 3),
+        'inserts_per_sec': round(args.users / elapsed, 1),
+        'average_batch': stats.get('average_batch', 1),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--durability', nargs='+', default=['NORMAL', 'FULL'])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--referrers', type=int, default=200)
+    parser.add_argument('--referred', type=float, default=0.8,
+                        help="Fraction of registrations that credit a referrer")
+    parser.add_argument('--concurrency', type=int, default=256,
+                        help="Registrations in flight at once")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--batch-delay-ms', type=float, default=5)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as scratch:
+        for durability in args.durability:
+            for batched in (False, True):
+                results.append(await run(scratch, durability, batched, args))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            mode = 'batched' if result['batched'] else 'one txn per op'
+            print(f"{result['durability']:>6} {mode:>15}: {result['inserts_per_sec']:>9} inserts/s "
+                  f"({result['users']} in {result['seconds']}s, avg batch {result['average_batch']})")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,10 +1,26 @@
 import os
+import time
+import argparse
+import asyncio
 import logging
 import html
+import secrets
+import signal
+from typing import List
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler
-from telegram.error import TelegramError
+from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler, ChatMemberHandler, TypeHandler
+from telegram.error import TelegramError, BadRequest, Forbidden
 from database import Database
+from async_database import AsyncDatabase
+from membership_cache import MembershipCache
+from circuit_breaker import CircuitBreaker
+from broadcast import BroadcastEngine
+from rate_limiter import RateLimiter
+from log_pipeline import LogPipeline
+from http_server import HttpServer, json_response
+from update_processor import PerUserUpdateProcessor
+from metrics import Metrics, InstrumentedRequest
+from profiler import Profiler, format_report
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -15,36 +31,157 @@ OWNER_ID = 7924074157
 RUPEES_PER_REFERRAL = 5
 REDEMPTION_THRESHOLD = 300
 
-db = Database()
+# Users columns each view renders; without the user cache only these are read
+START_USER_COLUMNS = ('referral_code', 'credits', 'total_referrals')
+PROFILE_USER_COLUMNS = ('first_name', 'referral_code', 'credits', 'total_referrals')
+LEADERBOARD_USER_COLUMNS = ('referral_code', 'total_referrals')
+REDEEM_USER_COLUMNS = ('first_name', 'username', 'referral_code', 'credits', 'total_referrals')
+
+metrics = Metrics(
+    enabled=os.getenv('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes', 'on'),
+    slow_query_threshold=float(os.getenv('SLOW_QUERY_MS', '100')) / 1000)
+METRICS_DUMP_INTERVAL = float(os.getenv('METRICS_DUMP_INTERVAL', '0'))
+METRICS_DUMP_PATH = os.getenv('METRICS_DUMP_PATH', 'metrics.json')
+profiler = Profiler(
+    output_dir=os.getenv('PROFILE_DIR', 'profiles'),
+    max_seconds=float(os.getenv('PROFILE_MAX_SECONDS', '300')))
+PROFILE_SECONDS = float(os.getenv('PROFILE_SECONDS', '30'))
+
+db = AsyncDatabase(
+    Database(os.getenv('DB_PATH', 'referral_bot.db'), referral_secret=os.getenv('REFERRAL_CODE_SECRET'),
+             user_cache_size=int(os.getenv('USER_CACHE_SIZE', '50000'))),
+    batch_writes=os.getenv('WRITE_BATCHING', '').lower() in ('1', 'true', 'yes', 'on'),
+    durability=os.getenv('DB_DURABILITY'),
+    max_batch=int(os.getenv('WRITE_BATCH_SIZE', '64')),
+    max_delay=float(os.getenv('WRITE_BATCH_DELAY_MS', '5')) / 1000)
+metrics.instrument_database(db.database)
+membership_cache = MembershipCache(
+    positive_ttl=float(os.getenv('MEMBERSHIP_POSITIVE_TTL', '300')),
+    negative_ttl=float(os.getenv('MEMBERSHIP_NEGATIVE_TTL', '30')),
+    max_entries=int(os.getenv('MEMBERSHIP_CACHE_SIZE', '100000')))
+MEMBERSHIP_CHECK_TIMEOUT = float(os.getenv('MEMBERSHIP_CHECK_TIMEOUT', '3'))
+broadcast_engine = BroadcastEngine(
+    db,
+    RateLimiter(global_rate=float(os.getenv('BROADCAST_RATE', '25'))),
+    concurrency=int(os.getenv('BROADCAST_CONCURRENCY', '16')))
+log_pipeline = LogPipeline(
+    lambda: db.settings.get('log_channel'),
+    max_queue=int(os.getenv('LOG_QUEUE_SIZE', '1000')),
+    flush_interval=float(os.getenv('LOG_FLUSH_INTERVAL', '3')),
+    overflow=os.getenv('LOG_OVERFLOW_POLICY', 'drop_oldest'))
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '32'))
+BOT_API_POOL_SIZE = int(os.getenv('BOT_API_POOL_SIZE', '128'))
+BOT_API_BASE_URL = os.getenv('BOT_API_BASE_URL')
+SETTINGS_RELOAD_INTERVAL = float(os.getenv('SETTINGS_RELOAD_INTERVAL', '60'))
+USER_CACHE_SYNC_INTERVAL = float(os.getenv('USER_CACHE_SYNC_INTERVAL', '0'))
+RANKING_RELOAD_INTERVAL = float(os.getenv('RANKING_RELOAD_INTERVAL', '600'))
+# Membership answers still being stored, awaited in post_stop
+member_writes = set()
+channel_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv('CHANNEL_BREAKER_THRESHOLD', '3')),
+    cooldown=float(os.getenv('CHANNEL_BREAKER_COOLDOWN', '600')))
+
+def send_log(context: ContextTypes.DEFAULT_TYPE, message: str):
+    """Queue a log message for the logging channel without waiting on delivery"""
+    log_pipeline.submit(message)
+
+
+def save_channel_member(channel_id: str, user_id: int, status: str):
+    """Store an API membership answer without making the check wait on the writer"""
+    task = asyncio.create_task(db.set_channel_member(channel_id, user_id, status))
+    member_writes.add(task)
+    task.add_done_callback(saved_channel_member)
+
+
+def saved_channel_member(task: asyncio.Task):
+    member_writes.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"Failed to store channel membership: {task.exception()}")
+
+
+async def fetch_channel_membership(context: ContextTypes.DEFAULT_TYPE,
+                                   user_id: int, channel_id: str):
+    """Ask Telegram whether the user is in the channel; None when unknown"""
+    if not channel_breaker.allow(channel_id):
+        return None
 
-async def send_log(context: ContextTypes.DEFAULT_TYPE, message: str):
-    """Send log message to the logging channel"""
-    log_channel = db.get_log_channel()
-    if log_channel:
-        try:
-            await context.bot.send_message(chat_id=log_channel, text=message, parse_mode='HTML')
-        except TelegramError as e:
-            logger.error(f"Failed to send log to channel: {e}")
+    try:
+        member = await asyncio.wait_for(
+            context.bot.get_chat_member(chat_id=channel_id, user_id=user_id),
+            timeout=MEMBERSHIP_CHECK_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Timed out checking membership for {channel_id}")
+        channel_breaker.record_failure(channel_id)
+        return None
+    except (BadRequest, Forbidden) as e:
+        if 'user not found' in str(e).lower():
+            # About this user, not the channel: the channel answered, which
+            # also resolves a half-open probe
+            logger.error(f"Error checking membership for {channel_id}: {e}")
+            channel_breaker.record_success(channel_id)
+            return None
+        # Usually means the bot lost admin rights or was removed from the channel
+        logger.error(f"Error checking membership for {channel_id}, skipping it "
+                     f"for {channel_breaker.cooldown:.0f}s: {e}")
+        channel_breaker.record_failure(channel_id, trip=True)
+        return None
+    except TelegramError as e:
+        logger.error(f"Error checking membership for {channel_id}: {e}")
+        channel_breaker.record_failure(channel_id)
+        return None
+
+    channel_breaker.record_success(channel_id)
+    save_channel_member(channel_id, user_id, member.status)
+    is_member = member.status not in ['left', 'kicked']
+    membership_cache.set(user_id, channel_id, is_member)
+    return is_member
 
 
 async def check_channel_membership(update: Update,
                                    context: ContextTypes.DEFAULT_TYPE) -> bool:
     user_id = update.effective_user.id
-    channels = db.get_channels()
+    channels = await db.get_channels()
 
     if not channels:
         return True
 
     not_joined = []
-    for channel_id, channel_name, channel_link in channels:
-        try:
-            member = await context.bot.get_chat_member(chat_id=channel_id,
-                                                       user_id=user_id)
-            if member.status in ['left', 'kicked']:
-                not_joined.append((channel_id, channel_name, channel_link))
-        except TelegramError as e:
-            logger.error(f"Error checking membership for {channel_id}: {e}")
-            continue
+    uncached = []
+    for channel in channels:
+        is_member = membership_cache.get(user_id, channel[0])
+        if is_member is None:
+            uncached.append(channel)
+        elif not is_member:
+            not_joined.append(channel)
+
+    # Then the local index kept current by chat_member updates. A join or
+    # leave whose update was missed would leave a stale row there, so rows
+    # older than the matching cache TTL are asked about again
+    unknown = []
+    if uncached:
+        statuses = await db.get_channel_memberships(user_id)
+        now = time.time()
+        for channel in uncached:
+            status, updated_at = statuses.get(channel[0], (None, None))
+            is_member = status not in ['left', 'kicked']
+            ttl = membership_cache.positive_ttl if is_member else membership_cache.negative_ttl
+            if status is None or (updated_at or 0) <= now - ttl:
+                unknown.append(channel)
+                continue
+            membership_cache.set(user_id, channel[0], is_member)
+            if not is_member:
+                not_joined.append(channel)
+
+    # Check the remaining channels concurrently so latency is bounded by the
+    # slowest channel; channels that could not be checked are let through
+    if unknown:
+        results = await asyncio.gather(*[
+            fetch_channel_membership(context, user_id, channel_id)
+            for channel_id, _, _ in unknown
+        ])
+        for channel, is_member in zip(unknown, results):
+            if is_member is False:
+                not_joined.append(channel)
 
     if not_joined:
         keyboard = []
@@ -64,6 +201,25 @@ async def check_channel_membership(update: Update,
     return True
 
 
+async def track_channel_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Record joins and leaves in mandatory channels from chat_member updates"""
+    change = update.chat_member
+    chat = change.chat
+    candidates = {str(chat.id)}
+    if chat.username:
+        candidates.add(f"@{chat.username}")
+
+    channel_id = next((channel_id for channel_id, _, _ in await db.get_channels()
+                       if channel_id in candidates), None)
+    if channel_id is None:
+        return
+
+    user_id = change.new_chat_member.user.id
+    status = change.new_chat_member.status
+    await db.set_channel_member(channel_id, user_id, status)
+    membership_cache.set(user_id, channel_id, status not in ['left', 'kicked'])
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     user_id = user.id
@@ -73,11 +229,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_channel_membership(update, context):
         return
 
-    existing_user = db.get_user(user_id)
+    existing_user = await db.get_user(user_id, START_USER_COLUMNS)
 
     if existing_user:
-        start_msg = db.get_start_message()
-        referral_link = f"https://t.me/{context.bot.username}?start={existing_user['referral_code']}"
+        start_msg = await db.get_start_message()
+        referral_link = f"https://t.me/{context.bot.username}?start={existing_user.referral_code}"
 
         keyboard = [
             [
@@ -102,8 +258,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             f"{start_msg}\n\n"
             f"👤 Your Profile:\n"
-            f"💰 Balance: ₹{existing_user['credits']}\n"
-            f"👥 Total Referrals: {existing_user['total_referrals']}\n\n"
+            f"💰 Balance: ₹{existing_user.credits}\n"
+            f"👥 Total Referrals: {existing_user.total_referrals}\n\n"
             f"🔗 Your Referral Link:\n{referral_link}\n\n"
             f"Share this link to earn ₹{RUPEES_PER_REFERRAL} per referral!",
             reply_markup=reply_markup)
@@ -111,21 +267,23 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         referred_by = None
         if context.args:
             referral_code = context.args[0]
-            referred_by = db.get_user_by_referral_code(referral_code)
+            referred_by = await db.get_user_by_referral_code(referral_code)
 
             if referred_by == user_id:
                 await update.message.reply_text(
                     "❌ You cannot use your own referral link!")
                 return
 
-        referral_code = db.add_user(user_id, username, first_name, referred_by)
+        registration = await db.register_user(user_id, username, first_name, referred_by)
 
-        if referral_code:
-            start_msg = db.get_start_message()
+        if registration:
+            referral_code = registration['referral_code']
+            referrer = registration['referrer']
+            start_msg = await db.get_start_message()
             referral_link = f"https://t.me/{context.bot.username}?start={referral_code}"
 
             welcome_text = f"{start_msg}\n\n"
-            if referred_by:
+            if referrer:
                 welcome_text += f"✅ You were referred! Your referrer earned ₹{RUPEES_PER_REFERRAL}.\n\n"
 
             welcome_text += (f"🔗 Your Referral Link:\n{referral_link}\n\n"
@@ -150,26 +308,25 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(welcome_text,
                                             reply_markup=reply_markup)
 
-            if referred_by:
+            if referrer:
                 try:
-                    referrer = db.get_user(referred_by)
                     await context.bot.send_message(
                         chat_id=referred_by,
                         text=f"🎉 New Referral!\n\n"
                         f"User: {first_name}\n"
                         f"You earned ₹{RUPEES_PER_REFERRAL}!\n"
-                        f"Total Balance: ₹{referrer['credits']}")
+                        f"Total Balance: ₹{referrer.credits}")
                     
-                    await send_log(
+                    send_log(
                         context,
                         f"📊 <b>New Referral</b>\n\n"
-                        f"👤 Referrer: {html.escape(referrer['first_name'])} (@{html.escape(referrer['username'] or 'N/A')})\n"
+                        f"👤 Referrer: {html.escape(referrer.first_name)} (@{html.escape(referrer.username or 'N/A')})\n"
                         f"ID: <code>{referred_by}</code>\n\n"
                         f"👥 New User: {html.escape(first_name)} (@{html.escape(username or 'N/A')})\n"
                         f"ID: <code>{user_id}</code>\n\n"
                         f"💰 Earned: ₹{RUPEES_PER_REFERRAL}\n"
-                        f"💵 Total Balance: ₹{referrer['credits']}\n"
-                        f"📈 Total Referrals: {referrer['total_referrals']}"
+                        f"💵 Total Balance: ₹{referrer.credits}\n"
+                        f"📈 Total Referrals: {referrer.total_referrals}"
                     )
                 except TelegramError as e:
                     logger.error(f"Could not notify referrer: {e}")
@@ -180,20 +337,20 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     user_id = update.effective_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id, PROFILE_USER_COLUMNS)
 
     if not user:
         await update.message.reply_text("Please use /start first!")
         return
 
-    rank = db.get_user_rank(user_id)
-    referral_link = f"https://t.me/{context.bot.username}?start={user['referral_code']}"
+    rank = db.rank_for(user.total_referrals)
+    referral_link = f"https://t.me/{context.bot.username}?start={user.referral_code}"
 
-    remaining = REDEMPTION_THRESHOLD - user['credits']
+    remaining = REDEMPTION_THRESHOLD - user.credits
     profile_text = (f"👤 Your Profile\n\n"
-                    f"Name: {user['first_name']}\n"
-                    f"💰 Balance: ₹{user['credits']}\n"
-                    f"👥 Total Referrals: {user['total_referrals']}\n"
+                    f"Name: {user.first_name}\n"
+                    f"💰 Balance: ₹{user.credits}\n"
+                    f"👥 Total Referrals: {user.total_referrals}\n"
                     f"🏆 Rank: #{rank}\n\n"
                     f"🔗 Your Referral Link:\n{referral_link}\n\n"
                     f"💡 Earn ₹{remaining} more to redeem!")
@@ -216,19 +373,21 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(profile_text, reply_markup=reply_markup)
 
 
-async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not await check_channel_membership(update, context):
-        return
+_leaderboard_block = (None, None)
+
 
-    top_users = db.get_leaderboard(10)
+def render_leaderboard_block():
+    """Header totals and top 10 rows, re-rendered only when the snapshot changes"""
+    global _leaderboard_block
+    cached_version, cached_text = _leaderboard_block
+    if cached_version == db.leaderboard.version:
+        return cached_text
 
+    version, top_users, stats = db.leaderboard.snapshot()
     if not top_users:
-        await update.message.reply_text("No users on the leaderboard yet!")
-        return
+        _leaderboard_block = (version, None)
+        return None
 
-    stats = db.get_stats()
-    total_earnings = sum([refs * RUPEES_PER_REFERRAL for _, _, _, refs in top_users])
-    
     leaderboard_text = (
         f"🏆 <b>Top 10 Referrers Leaderboard</b> 🏆\n\n"
         f"📊 Total Users: {stats['total_users']}\n"
@@ -238,20 +397,29 @@ async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     medals = ["🥇", "🥈", "🥉"]
-    for i, (user_id, username, first_name,
-            referrals) in enumerate(top_users, 1):
+    for i, entry in enumerate(top_users, 1):
         medal = medals[i - 1] if i <= 3 else f"{i}."
-        display_name = f"@{html.escape(username)}" if username else html.escape(first_name)
+        display_name = f"@{html.escape(entry.username)}" if entry.username else html.escape(entry.first_name)
+        referrals = entry.total_referrals
         leaderboard_text += f"{medal} {display_name}\n   └ {referrals} referrals • ₹{referrals * RUPEES_PER_REFERRAL}\n"
-    
-    user = db.get_user(update.effective_user.id)
+
+    _leaderboard_block = (version, leaderboard_text)
+    return leaderboard_text
+
+
+async def build_leaderboard(user_id: int, context: ContextTypes.DEFAULT_TYPE):
+    leaderboard_text = render_leaderboard_block()
+    if leaderboard_text is None:
+        return None, None
+
+    user = await db.get_user(user_id, LEADERBOARD_USER_COLUMNS)
     if user:
-        user_rank = db.get_user_rank(update.effective_user.id)
+        user_rank = db.rank_for(user.total_referrals)
         leaderboard_text += f"\n━━━━━━━━━━━━━━━━━━━━\n"
         leaderboard_text += f"📍 Your Position: #{user_rank}\n"
-        leaderboard_text += f"💰 Your Earnings: ₹{user['total_referrals'] * RUPEES_PER_REFERRAL}"
-    
-    referral_link = f"https://t.me/{context.bot.username}?start={user['referral_code']}" if user else ""
+        leaderboard_text += f"💰 Your Earnings: ₹{user.total_referrals * RUPEES_PER_REFERRAL}"
+
+    referral_link = f"https://t.me/{context.bot.username}?start={user.referral_code}" if user else ""
 
     keyboard = [[
         InlineKeyboardButton(
@@ -260,7 +428,18 @@ async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"https://t.me/share/url?url={referral_link}&text=Join this amazing bot and earn money! ₹{RUPEES_PER_REFERRAL} per referral!"
         )
     ], [InlineKeyboardButton("💰 My Profile", callback_data="profile")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return leaderboard_text, InlineKeyboardMarkup(keyboard)
+
+
+async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await check_channel_membership(update, context):
+        return
+
+    leaderboard_text, reply_markup = await build_leaderboard(update.effective_user.id, context)
+
+    if leaderboard_text is None:
+        await update.message.reply_text("No users on the leaderboard yet!")
+        return
 
     await update.message.reply_text(leaderboard_text,
                                     reply_markup=reply_markup,
@@ -272,14 +451,14 @@ async def redeem(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     user_id = update.effective_user.id
-    user = db.get_user(user_id)
+    user = await db.get_user(user_id, REDEEM_USER_COLUMNS)
 
     if not user:
         await update.message.reply_text("Please use /start first!")
         return
 
-    if user['credits'] < REDEMPTION_THRESHOLD:
-        referral_link = f"https://t.me/{context.bot.username}?start={user['referral_code']}"
+    if user.credits < REDEMPTION_THRESHOLD:
+        referral_link = f"https://t.me/{context.bot.username}?start={user.referral_code}"
         keyboard = [[
             InlineKeyboardButton(
                 "📤 Share & Earn More",
@@ -291,17 +470,17 @@ async def redeem(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         await update.message.reply_text(
             f"❌ Insufficient Balance!\n\n"
-            f"You have: ₹{user['credits']}\n"
+            f"You have: ₹{user.credits}\n"
             f"Required: ₹{REDEMPTION_THRESHOLD}\n"
-            f"Need: ₹{REDEMPTION_THRESHOLD - user['credits']} more\n\n"
+            f"Need: ₹{REDEMPTION_THRESHOLD - user.credits} more\n\n"
             f"💡 Share your referral link to earn ₹{RUPEES_PER_REFERRAL} per referral!",
             reply_markup=reply_markup)
         return
 
-    redemption_code = db.redeem_credits(user_id, REDEMPTION_THRESHOLD)
+    redemption_code = await db.redeem_credits(user_id, REDEMPTION_THRESHOLD)
 
     if redemption_code:
-        referral_link = f"https://t.me/{context.bot.username}?start={user['referral_code']}"
+        referral_link = f"https://t.me/{context.bot.username}?start={user.referral_code}"
         keyboard = [[
             InlineKeyboardButton(
                 "📤 Share & Earn More",
@@ -311,30 +490,35 @@ async def redeem(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ], [InlineKeyboardButton("💰 My Profile", callback_data="profile")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await send_log(
-            context,
-            f"💸 <b>Redemption Successful</b>\n\n"
-            f"👤 User: {html.escape(user['first_name'])} (@{html.escape(user['username'] or 'N/A')})\n"
-            f"ID: <code>{user_id}</code>\n\n"
-            f"🎁 Redemption Code: <code>{redemption_code}</code>\n"
-            f"💰 Amount Used: ₹{REDEMPTION_THRESHOLD}\n"
-            f"📊 Total Referrals: {user['total_referrals']}"
-        )
+        log_redemption(context, user_id, user, redemption_code)
 
         await update.message.reply_text(
             f"🎉 Congratulations! 🎉\n\n"
             f"You have successfully achieved the task!\n\n"
-            f"Your Reward Code: `{redemption_code}`\n\n"
+            f"Your Reward Code: <code>{html.escape(redemption_code)}</code>\n\n"
             f"✅ Redemption Successful!\n"
             f"Amount Used: ₹{REDEMPTION_THRESHOLD}\n\n"
             f"Keep referring to earn more rewards!",
-            parse_mode='Markdown',
+            parse_mode='HTML',
             reply_markup=reply_markup)
     else:
         await update.message.reply_text(
             "❌ Redemption failed. Please try again later.")
 
 
+def log_redemption(context: ContextTypes.DEFAULT_TYPE, user_id: int, user, redemption_code: str):
+    # Imported reward codes are arbitrary text, so escape them like names
+    send_log(
+        context,
+        f"💸 <b>Redemption Successful</b>\n\n"
+        f"👤 User: {html.escape(user.first_name)} (@{html.escape(user.username or 'N/A')})\n"
+        f"ID: <code>{user_id}</code>\n\n"
+        f"🎁 Redemption Code: <code>{html.escape(redemption_code)}</code>\n"
+        f"💰 Amount Used: ₹{REDEMPTION_THRESHOLD}\n"
+        f"📊 Total Referrals: {user.total_referrals}"
+    )
+
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     help_text = ("📖 Available Commands:\n\n"
                  "👤 User Commands:\n"
@@ -350,7 +534,12 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         help_text += (
             "\n\n👑 Admin Commands:\n"
             "/broadcast <message> - Send message to all users\n"
+            "/cancelbroadcast [id] - Stop a running broadcast\n"
+            "/resumebroadcast [id] - Resume an interrupted broadcast\n"
             "/stats - View bot statistics\n"
+            "/importcodes - Import reward codes from a .txt file\n"
+            "/checkcounters [fix] - Check the stored totals, and repair them with fix\n"
+            "/profiler [seconds] | updates <count> | stop - Profile the live bot\n"
             "/addchannel <channel_id> <name> - Add mandatory channel\n"
             "/removechannel <channel_id> - Remove channel\n"
             "/channels - List all channels\n"
@@ -361,6 +550,24 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(help_text)
 
 
+def log_broadcast(context: ContextTypes.DEFAULT_TYPE, admin):
+    """Completion callback for a broadcast started or resumed by ``admin``"""
+    async def on_complete(result: dict):
+        message = result['message']
+        send_log(
+            context,
+            f"📢 <b>Broadcast Sent</b>\n\n"
+            f"👑 Admin: {html.escape(admin.first_name)}\n"
+            f"ID: <code>{admin.id}</code>\n\n"
+            f"📝 Message Preview: {html.escape(message[:100])}{'...' if len(message) > 100 else ''}\n\n"
+            f"✅ Success: {result['success']}\n"
+            f"❌ Failed: {result['failed']}\n"
+            f"📊 Total: {result['total']}"
+        )
+
+    return on_complete
+
+
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != OWNER_ID:
         await update.message.reply_text(
@@ -372,36 +579,111 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     message = ' '.join(context.args)
-    users = db.get_all_users()
-
-    success = 0
-    failed = 0
+    admin = update.effective_user
 
+    total = (await db.get_stats())['total_users']
     status_msg = await update.message.reply_text(
-        f"📤 Broadcasting to {len(users)} users...")
+        f"📤 Broadcasting to {total} users...")
 
-    for user_id in users:
-        try:
-            await context.bot.send_message(chat_id=user_id, text=message)
-            success += 1
-        except TelegramError as e:
-            logger.error(f"Failed to send to {user_id}: {e}")
-            failed += 1
+    broadcast_id = await broadcast_engine.start(context.bot, message, status_msg.chat_id,
+                                                status_msg.message_id, log_broadcast(context, admin),
+                                                total=total)
+    await update.message.reply_text(
+        f"Broadcast #{broadcast_id} is running in the background.\n"
+        f"Cancel with /cancelbroadcast {broadcast_id}")
 
-    await status_msg.edit_text(f"✅ Broadcast Complete!\n\n"
-                               f"Success: {success}\n"
-                               f"Failed: {failed}\n"
-                               f"Total: {len(users)}")
-    
-    await send_log(
+
+async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID:
+        await update.message.reply_text(
+            "❌ This command is only for the bot owner!")
+        return
+
+    if context.args and context.args[0].isdigit():
+        broadcast_id = int(context.args[0])
+    else:
+        broadcast_id = await db.get_latest_broadcast_id('running')
+
+    if broadcast_id and broadcast_engine.cancel(broadcast_id):
+        await update.message.reply_text(f"🛑 Cancelling broadcast #{broadcast_id}...")
+    elif broadcast_id and (await db.get_broadcast(broadcast_id) or {}).get('status') == 'running':
+        # Interrupted by a restart, so there is no task to stop
+        await db.set_broadcast_status(broadcast_id, 'cancelled')
+        await update.message.reply_text(f"🛑 Broadcast #{broadcast_id} cancelled.")
+    else:
+        await update.message.reply_text("❌ No running broadcast found!")
+
+
+async def resume_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID:
+        await update.message.reply_text(
+            "❌ This command is only for the bot owner!")
+        return
+
+    if context.args and context.args[0].isdigit():
+        broadcast_id = int(context.args[0])
+    else:
+        broadcast_id = await db.get_latest_broadcast_id('running')
+
+    if broadcast_id and await broadcast_engine.resume(context.bot, broadcast_id,
+                                                      log_broadcast(context, update.effective_user)):
+        await update.message.reply_text(f"▶️ Resuming broadcast #{broadcast_id}...")
+    else:
+        await update.message.reply_text("❌ No interrupted broadcast to resume!")
+
+
+def parse_reward_codes(content: bytes) -> List[str]:
+    """Lines of an uploaded code file; strict, so no code is stored mangled"""
+    # utf-8-sig drops the BOM Windows editors put in front of the first code
+    return content.decode('utf-8-sig').splitlines()
+
+
+async def import_codes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID:
+        await update.message.reply_text(
+            "❌ This command is only for the bot owner!")
+        return
+
+    # Accept the file either captioned with /importcodes or as the replied-to message
+    document = update.message.document
+    if not document and update.message.reply_to_message:
+        document = update.message.reply_to_message.document
+
+    if not document:
+        await update.message.reply_text(
+            "📝 Usage: send a .txt file with one reward code per line and the caption "
+            "/importcodes, or reply /importcodes to such a file.")
+        return
+
+    try:
+        file = await context.bot.get_file(document.file_id)
+        content = await file.download_as_bytearray()
+    except TelegramError as e:
+        await update.message.reply_text(f"❌ Could not download the file: {e}")
+        return
+
+    try:
+        codes = parse_reward_codes(bytes(content))
+    except UnicodeDecodeError:
+        await update.message.reply_text(
+            "❌ The file is not valid UTF-8, so nothing was imported. "
+            "Save it as UTF-8 text and send it again.")
+        return
+    added, skipped = await db.import_reward_codes(codes)
+    inventory = await db.get_reward_code_stats()
+
+    await update.message.reply_text(
+        f"✅ Reward codes imported!\n\n"
+        f"➕ Added: {added}\n"
+        f"⏭ Skipped (blank/duplicate): {skipped}\n"
+        f"🎁 Available: {inventory['available']}")
+
+    send_log(
         context,
-        f"📢 <b>Broadcast Sent</b>\n\n"
+        f"🎟 <b>Reward Codes Imported</b>\n\n"
         f"👑 Admin: {html.escape(update.effective_user.first_name)}\n"
-        f"ID: <code>{update.effective_user.id}</code>\n\n"
-        f"📝 Message Preview: {html.escape(message[:100])}{'...' if len(message) > 100 else ''}\n\n"
-        f"✅ Success: {success}\n"
-        f"❌ Failed: {failed}\n"
-        f"📊 Total: {len(users)}"
+        f"➕ Added: {added}\n"
+        f"🎁 Available: {inventory['available']}"
     )
 
 
@@ -411,16 +693,119 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "❌ This command is only for the bot owner!")
         return
 
-    stats = db.get_stats()
+    stats = await db.get_stats()
 
     stats_text = (f"📊 Bot Statistics\n\n"
                   f"👥 Total Users: {stats['total_users']}\n"
                   f"🔗 Total Referrals: {stats['total_referrals']}\n"
                   f"🎁 Total Redemptions: {stats['total_redemptions']}\n")
 
+    inventory = await db.get_reward_code_stats()
+    stats_text += (f"\n🎟 Reward Codes:\n"
+                   f"Available: {inventory['available']} • Claimed: {inventory['claimed']}\n")
+
+    cache_stats = membership_cache.stats()
+    stats_text += (f"\n🗂 Membership Cache:\n"
+                   f"Entries: {cache_stats['entries']}\n"
+                   f"Hits: {cache_stats['hits']} • Misses: {cache_stats['misses']}\n"
+                   f"Hit Rate: {cache_stats['hit_rate']:.1%}\n")
+
+    user_cache = db.database.users
+    user_stats = user_cache.stats()
+    stats_text += (f"\n👤 User Cache:\n"
+                   f"Entries: {user_stats['entries']} • Memory: {user_cache.memory_usage() / 1048576:.1f} MB\n"
+                   f"Hits: {user_stats['hits']} • Misses: {user_stats['misses']}\n"
+                   f"Hit Rate: {user_stats['hit_rate']:.1%}\n")
+
+    log_stats = log_pipeline.stats()
+    stats_text += (f"\n📝 Log Pipeline:\n"
+                   f"Queued: {log_stats['queued']} • Sent: {log_stats['sent']}\n"
+                   f"Dropped: {log_stats['dropped']} • Failed: {log_stats['failed']}\n")
+
+    if db.batcher:
+        batch_stats = db.batcher.stats()
+        stats_text += (f"\n📦 Write Batching:\n"
+                       f"Batches: {batch_stats['batches']} • Avg Size: {batch_stats['average_batch']}\n")
+
+    skipped_channels = channel_breaker.open_keys()
+    if skipped_channels:
+        stats_text += f"\n⚠️ Skipped Channels: {', '.join(skipped_channels)}\n"
+
     await update.message.reply_text(stats_text)
 
 
+async def check_counters(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID:
+        await update.message.reply_text(
+            "❌ This command is only for the bot owner!")
+        return
+
+    repair = bool(context.args) and context.args[0].lower() == 'fix'
+    report = await db.check_counters(repair)
+
+    lines = []
+    drifted = False
+    for name, (stored, actual) in report.items():
+        if stored == actual:
+            lines.append(f"✅ {name}: {actual}")
+        else:
+            drifted = True
+            lines.append(f"⚠️ {name}: counter {stored}, actual {actual}")
+
+    text = "🧮 Counter Check\n\n" + "\n".join(lines)
+    if drifted:
+        text += "\n\n🔧 Counters repaired." if repair else "\n\nSend /checkcounters fix to repair."
+    await update.message.reply_text(text)
+
+
+def report_profile(bot):
+    async def send_report(report: dict):
+        logger.info(f"Profile written to {report['pstats_path']} and {report['collapsed_path']}")
+        try:
+            await bot.send_message(chat_id=OWNER_ID, text=format_report(report))
+        except TelegramError as e:
+            logger.error(f"Failed to send profile report: {e}")
+
+    return send_report
+
+
+async def profile_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID:
+        await update.message.reply_text(
+            "❌ This command is only for the bot owner!")
+        return
+
+    args = [arg.lower() for arg in context.args]
+    if args and args[0] == 'stop':
+        if not profiler.stop():
+            await update.message.reply_text("ℹ️ No profile is running.")
+        return
+
+    try:
+        if args and args[0] == 'updates':
+            updates = int(args[1])
+            started = profiler.start(updates=updates, on_complete=report_profile(context.bot))
+            target = f"the next {updates} updates (at most {profiler.max_seconds:g}s)"
+        else:
+            seconds = float(args[0]) if args else PROFILE_SECONDS
+            started = profiler.start(seconds=seconds, on_complete=report_profile(context.bot))
+            target = f"{min(seconds, profiler.max_seconds):g}s"
+    except (IndexError, ValueError):
+        await update.message.reply_text(
+            "📝 Usage: /profiler [seconds] | /profiler updates <count> | /profiler stop")
+        return
+
+    if not started:
+        await update.message.reply_text(
+            "⚠️ A profile is already running. Send /profiler stop to end it early.")
+        return
+    await update.message.reply_text(f"🔬 Profiling {target}. The report will follow.")
+
+
+async def count_profiled_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    profiler.count_update()
+
+
 async def add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != OWNER_ID:
         await update.message.reply_text(
@@ -487,7 +872,9 @@ async def add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
             channel_name = chat.title
             final_link = f"https://t.me/{chat.username}" if chat.username else None
         
-        if db.add_channel(channel_id, channel_name, final_link):
+        if await db.add_channel(channel_id, channel_name, final_link):
+            membership_cache.invalidate(channel_id=channel_id)
+            channel_breaker.reset(channel_id)
             channel_type = "Private" if is_private_link else "Public"
             await update.message.reply_text(
                 f"✅ {channel_type} channel added successfully!\n\n"
@@ -495,7 +882,7 @@ async def add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"🆔 ID: {channel_id}\n"
                 f"🔗 Link: {final_link if final_link else 'N/A'}")
             
-            await send_log(
+            send_log(
                 context,
                 f"➕ <b>{channel_type} Channel Added</b>\n\n"
                 f"👑 Admin: {html.escape(update.effective_user.first_name)}\n"
@@ -528,10 +915,12 @@ async def remove_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     channel_id = context.args[0]
 
-    if db.remove_channel(channel_id):
+    if await db.remove_channel(channel_id):
+        membership_cache.invalidate(channel_id=channel_id)
+        channel_breaker.reset(channel_id)
         await update.message.reply_text(f"✅ Channel removed: {channel_id}")
         
-        await send_log(
+        send_log(
             context,
             f"➖ <b>Channel Removed</b>\n\n"
             f"👑 Admin: {html.escape(update.effective_user.first_name)}\n"
@@ -547,7 +936,7 @@ async def list_channels(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "❌ This command is only for the bot owner!")
         return
 
-    channels = db.get_channels()
+    channels = await db.get_channels()
 
     if not channels:
         await update.message.reply_text("No channels configured.")
@@ -573,12 +962,12 @@ async def set_start_message(update: Update,
         return
 
     message = ' '.join(context.args)
-    db.set_start_message(message)
+    await db.set_start_message(message)
 
     await update.message.reply_text(
         f"✅ Start message updated!\n\nNew message:\n{message}")
     
-    await send_log(
+    send_log(
         context,
         f"✏️ <b>Start Message Updated</b>\n\n"
         f"👑 Admin: {html.escape(update.effective_user.first_name)}\n"
@@ -596,11 +985,11 @@ async def set_log_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     channel_id = context.args[0]
-    db.set_log_channel(channel_id)
+    await db.set_log_channel(channel_id)
     
     await update.message.reply_text(f"✅ Log channel set to: {channel_id}")
     
-    await send_log(
+    send_log(
         context,
         f"🔧 <b>Log Channel Updated</b>\n\n"
         f"👑 Admin: {html.escape(update.effective_user.first_name)}\n"
@@ -612,7 +1001,7 @@ async def get_log_channel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ This command is only for the bot owner!")
         return
     
-    log_channel = db.get_log_channel()
+    log_channel = await db.get_log_channel()
     
     if log_channel:
         await update.message.reply_text(f"📺 Current log channel: {log_channel}")
@@ -626,19 +1015,19 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = query.from_user.id
 
     if query.data == "profile":
-        user = db.get_user(user_id)
+        user = await db.get_user(user_id, PROFILE_USER_COLUMNS)
         if not user:
             await query.message.reply_text("Please use /start first!")
             return
 
-        rank = db.get_user_rank(user_id)
-        referral_link = f"https://t.me/{context.bot.username}?start={user['referral_code']}"
-        remaining = REDEMPTION_THRESHOLD - user['credits']
+        rank = db.rank_for(user.total_referrals)
+        referral_link = f"https://t.me/{context.bot.username}?start={user.referral_code}"
+        remaining = REDEMPTION_THRESHOLD - user.credits
 
         profile_text = (f"👤 Your Profile\n\n"
-                        f"Name: {user['first_name']}\n"
-                        f"💰 Balance: ₹{user['credits']}\n"
-                        f"👥 Total Referrals: {user['total_referrals']}\n"
+                        f"Name: {user.first_name}\n"
+                        f"💰 Balance: ₹{user.credits}\n"
+                        f"👥 Total Referrals: {user.total_referrals}\n"
                         f"🏆 Rank: #{rank}\n\n"
                         f"🔗 Your Referral Link:\n{referral_link}\n\n"
                         f"💡 Earn ₹{remaining} more to redeem!")
@@ -661,61 +1050,25 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.message.edit_text(profile_text, reply_markup=reply_markup)
 
     elif query.data == "leaderboard":
-        top_users = db.get_leaderboard(10)
+        leaderboard_text, reply_markup = await build_leaderboard(user_id, context)
 
-        if not top_users:
+        if leaderboard_text is None:
             await query.message.edit_text("No users on the leaderboard yet!")
             return
 
-        stats = db.get_stats()
-        total_earnings = sum([refs * RUPEES_PER_REFERRAL for _, _, _, refs in top_users])
-        
-        leaderboard_text = (
-            f"🏆 <b>Top 10 Referrers Leaderboard</b> 🏆\n\n"
-            f"📊 Total Users: {stats['total_users']}\n"
-            f"💰 Total Distributed: ₹{stats['total_referrals'] * RUPEES_PER_REFERRAL}\n"
-            f"🎁 Total Redemptions: {stats['total_redemptions']}\n\n"
-            f"━━━━━━━━━━━━━━━━━━━━\n\n"
-        )
-
-        medals = ["🥇", "🥈", "🥉"]
-        for i, (user_id, username, first_name,
-                referrals) in enumerate(top_users, 1):
-            medal = medals[i - 1] if i <= 3 else f"{i}."
-            display_name = f"@{html.escape(username)}" if username else html.escape(first_name)
-            leaderboard_text += f"{medal} {display_name}\n   └ {referrals} referrals • ₹{referrals * RUPEES_PER_REFERRAL}\n"
-        
-        user = db.get_user(query.from_user.id)
-        if user:
-            user_rank = db.get_user_rank(query.from_user.id)
-            leaderboard_text += f"\n━━━━━━━━━━━━━━━━━━━━\n"
-            leaderboard_text += f"📍 Your Position: #{user_rank}\n"
-            leaderboard_text += f"💰 Your Earnings: ₹{user['total_referrals'] * RUPEES_PER_REFERRAL}"
-        
-        referral_link = f"https://t.me/{context.bot.username}?start={user['referral_code']}" if user else ""
-
-        keyboard = [[
-            InlineKeyboardButton(
-                "📤 Share & Climb Up!",
-                url=
-                f"https://t.me/share/url?url={referral_link}&text=Join this amazing bot and earn money! ₹{RUPEES_PER_REFERRAL} per referral!"
-            )
-        ], [InlineKeyboardButton("💰 My Profile", callback_data="profile")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
         await query.message.edit_text(leaderboard_text,
                                       reply_markup=reply_markup,
                                       parse_mode='HTML')
 
     elif query.data == "redeem":
-        user = db.get_user(user_id)
+        user = await db.get_user(user_id, REDEEM_USER_COLUMNS)
 
         if not user:
             await query.message.reply_text("Please use /start first!")
             return
 
-        if user['credits'] < REDEMPTION_THRESHOLD:
-            referral_link = f"https://t.me/{context.bot.username}?start={user['referral_code']}"
+        if user.credits < REDEMPTION_THRESHOLD:
+            referral_link = f"https://t.me/{context.bot.username}?start={user.referral_code}"
             keyboard = [[
                 InlineKeyboardButton(
                     "📤 Share & Earn More",
@@ -727,17 +1080,17 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             await query.message.edit_text(
                 f"❌ Insufficient Balance!\n\n"
-                f"You have: ₹{user['credits']}\n"
+                f"You have: ₹{user.credits}\n"
                 f"Required: ₹{REDEMPTION_THRESHOLD}\n"
-                f"Need: ₹{REDEMPTION_THRESHOLD - user['credits']} more\n\n"
+                f"Need: ₹{REDEMPTION_THRESHOLD - user.credits} more\n\n"
                 f"💡 Share your referral link to earn ₹{RUPEES_PER_REFERRAL} per referral!",
                 reply_markup=reply_markup)
             return
 
-        redemption_code = db.redeem_credits(user_id, REDEMPTION_THRESHOLD)
+        redemption_code = await db.redeem_credits(user_id, REDEMPTION_THRESHOLD)
 
         if redemption_code:
-            referral_link = f"https://t.me/{context.bot.username}?start={user['referral_code']}"
+            referral_link = f"https://t.me/{context.bot.username}?start={user.referral_code}"
             keyboard = [[
                 InlineKeyboardButton(
                     "📤 Share & Earn More",
@@ -747,21 +1100,201 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ], [InlineKeyboardButton("💰 My Profile", callback_data="profile")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
 
+            log_redemption(context, user_id, user, redemption_code)
+
             await query.message.edit_text(
                 f"🎉 Congratulations! 🎉\n\n"
                 f"You have successfully achieved the task!\n\n"
-                f"Your Reward Code: `{redemption_code}`\n\n"
+                f"Your Reward Code: <code>{html.escape(redemption_code)}</code>\n\n"
                 f"✅ Redemption Successful!\n"
                 f"Amount Used: ₹{REDEMPTION_THRESHOLD}\n\n"
                 f"Keep referring to earn more rewards!",
-                parse_mode='Markdown',
+                parse_mode='HTML',
                 reply_markup=reply_markup)
         else:
             await query.message.reply_text(
                 "❌ Redemption failed. Please try again later.")
 
 
-def main():
+async def reload_settings_periodically():
+    """Pick up settings changed by other processes sharing the database"""
+    while True:
+        await asyncio.sleep(SETTINGS_RELOAD_INTERVAL)
+        try:
+            await db.reload_settings()
+        except Exception as e:
+            logger.error(f"Failed to reload settings: {e}")
+
+
+async def sync_user_cache_periodically():
+    """Drop cached users that other processes sharing the database changed"""
+    while True:
+        await asyncio.sleep(USER_CACHE_SYNC_INTERVAL)
+        try:
+            await db.sync_user_cache()
+        except Exception as e:
+            logger.error(f"Failed to sync user cache: {e}")
+
+
+async def reload_rankings_periodically():
+    """Rebuild the rank index and leaderboard from the database, so referrals
+    credited by other processes sharing it show up here too"""
+    while True:
+        await asyncio.sleep(RANKING_RELOAD_INTERVAL)
+        try:
+            await db.reload_rankings()
+        except Exception as e:
+            logger.error(f"Failed to reload rankings: {e}")
+
+
+health_server = None
+background_tasks: List[asyncio.Task] = []
+started_at = time.monotonic()
+
+
+def add_health_route(server: HttpServer, application: Application, mode: str):
+    async def health():
+        return json_response({
+            'status': 'ok',
+            'mode': mode,
+            'uptime': round(time.monotonic() - started_at, 1),
+            'pending_updates': application.update_queue.qsize(),
+        })
+
+    server.add_route('/health', health)
+
+
+def add_metrics_route(server: HttpServer, application: Application):
+    metrics.gauge('queue_depth', application.update_queue.qsize, queue='updates')
+    metrics.gauge('queue_depth', application.update_processor.pending_updates, queue='per_user')
+    metrics.gauge('queue_depth', log_pipeline.depth, queue='log_pipeline')
+    if db.batcher:
+        metrics.gauge('queue_depth', db.batcher.pending, queue='write_batch')
+
+    async def prometheus():
+        return 200, 'text/plain; version=0.0.4', metrics.render_prometheus()
+
+    server.add_route('/metrics', prometheus)
+
+
+async def dump_metrics_periodically():
+    while True:
+        await asyncio.sleep(METRICS_DUMP_INTERVAL)
+        try:
+            metrics.dump(METRICS_DUMP_PATH)
+        except OSError as e:
+            logger.error(f"Failed to write metrics to {METRICS_DUMP_PATH}: {e}")
+
+
+def start_background_task(coro):
+    # post_init runs before the Application is running, so its create_task
+    # would warn and leave the loops pending at shutdown; post_stop ends them
+    background_tasks.append(asyncio.create_task(coro))
+
+
+async def stop_background_tasks():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+
+
+async def post_init(application: Application):
+    log_pipeline.start(application.bot)
+    if SETTINGS_RELOAD_INTERVAL > 0:
+        start_background_task(reload_settings_periodically())
+    if RANKING_RELOAD_INTERVAL > 0:
+        start_background_task(reload_rankings_periodically())
+    if USER_CACHE_SYNC_INTERVAL > 0:
+        await db.track_user_changes()
+        start_background_task(sync_user_cache_periodically())
+    if metrics.enabled and METRICS_DUMP_INTERVAL > 0:
+        start_background_task(dump_metrics_periodically())
+    if health_server:
+        await health_server.start()
+    if hasattr(signal, 'SIGUSR1'):
+        # kill -USR1 <pid> profiles a live bot without touching Telegram
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGUSR1, profiler.start, PROFILE_SECONDS, None, report_profile(application.bot))
+
+
+async def post_stop(application: Application):
+    await stop_background_tasks()
+    await asyncio.gather(*member_writes, return_exceptions=True)
+    # post_shutdown runs after the bot's HTTP client is closed, too late to deliver
+    await log_pipeline.stop()
+
+
+async def post_shutdown(application: Application):
+    if health_server:
+        await health_server.stop()
+    await db.flush()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Telegram referral bot")
+    parser.add_argument('--mode', choices=['polling', 'webhook'],
+                        default=os.getenv('BOT_MODE', 'polling'),
+                        help="How to receive updates (env BOT_MODE)")
+    parser.add_argument('--webhook-url', default=os.getenv('WEBHOOK_URL'),
+                        help="Public base URL Telegram should call (env WEBHOOK_URL)")
+    parser.add_argument('--listen', default=os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+                        help="Address the webhook server binds to (env WEBHOOK_LISTEN)")
+    parser.add_argument('--port', type=int, default=int(os.getenv('WEBHOOK_PORT', '8443')),
+                        help="Port the webhook server binds to (env WEBHOOK_PORT)")
+    parser.add_argument('--path', default=os.getenv('WEBHOOK_PATH', 'telegram'),
+                        help="URL path for incoming updates (env WEBHOOK_PATH)")
+    parser.add_argument('--secret-token', default=os.getenv('WEBHOOK_SECRET'),
+                        help="Expected X-Telegram-Bot-Api-Secret-Token (env WEBHOOK_SECRET)")
+    parser.add_argument('--health-port', type=int,
+                        default=int(os.environ['HEALTH_PORT']) if os.getenv('HEALTH_PORT') else None,
+                        help="Port for GET /health and /metrics; 0 disables (env HEALTH_PORT)")
+    parser.add_argument('--health-listen', default=os.getenv('HEALTH_LISTEN'),
+                        help="Address the health server binds to; defaults to --listen in webhook "
+                             "mode and 127.0.0.1 in polling mode (env HEALTH_LISTEN)")
+    return parser.parse_args(argv)
+
+
+# Metrics labels for the buttons the bot sends; anything else is client-supplied
+CALLBACK_LABELS = ('profile', 'leaderboard', 'redeem')
+
+
+def callback_label(update: Update) -> str:
+    data = update.callback_query.data
+    return f"callback:{data if data in CALLBACK_LABELS else 'other'}"
+
+
+def add_handlers(application: Application):
+    # Runs ahead of the real handlers so /profiler updates N can count them
+    application.add_handler(TypeHandler(Update, count_profiled_update), group=-1)
+    timed = metrics.timed_handler
+    application.add_handler(CommandHandler("start", timed(start)))
+    application.add_handler(CommandHandler("profile", timed(profile)))
+    application.add_handler(CommandHandler("leaderboard", timed(leaderboard)))
+    application.add_handler(CommandHandler("redeem", timed(redeem)))
+    application.add_handler(CommandHandler("help", timed(help_command)))
+    application.add_handler(CommandHandler("broadcast", timed(broadcast)))
+    application.add_handler(CommandHandler("cancelbroadcast", timed(cancel_broadcast)))
+    application.add_handler(CommandHandler("resumebroadcast", timed(resume_broadcast)))
+    application.add_handler(CommandHandler("stats", timed(stats)))
+    application.add_handler(CommandHandler("importcodes", timed(import_codes)))
+    application.add_handler(CommandHandler("checkcounters", timed(check_counters)))
+    application.add_handler(CommandHandler("profiler", timed(profile_bot)))
+    application.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r'^/importcodes'), timed(import_codes)))
+    application.add_handler(CommandHandler("addchannel", timed(add_channel)))
+    application.add_handler(CommandHandler("removechannel", timed(remove_channel)))
+    application.add_handler(CommandHandler("channels", timed(list_channels)))
+    application.add_handler(CommandHandler("setstart", timed(set_start_message)))
+    application.add_handler(CommandHandler("setlogchannel", timed(set_log_channel)))
+    application.add_handler(CommandHandler("getlogchannel", timed(get_log_channel)))
+    application.add_handler(CallbackQueryHandler(timed(button_callback, callback_label)))
+    application.add_handler(ChatMemberHandler(timed(track_channel_member), ChatMemberHandler.CHAT_MEMBER))
+
+
+def main(argv=None):
+    global health_server
+
+    args = parse_args(argv)
     token = os.getenv('BOT_TOKEN')
 
     if not token:
@@ -772,27 +1305,71 @@ def main():
         print("2. Add BOT_TOKEN to Replit Secrets")
         return
 
-    application = Application.builder().token(token).build()
-
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("profile", profile))
-    application.add_handler(CommandHandler("leaderboard", leaderboard))
-    application.add_handler(CommandHandler("redeem", redeem))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("broadcast", broadcast))
-    application.add_handler(CommandHandler("stats", stats))
-    application.add_handler(CommandHandler("addchannel", add_channel))
-    application.add_handler(CommandHandler("removechannel", remove_channel))
-    application.add_handler(CommandHandler("channels", list_channels))
-    application.add_handler(CommandHandler("setstart", set_start_message))
-    application.add_handler(CommandHandler("setlogchannel", set_log_channel))
-    application.add_handler(CommandHandler("getlogchannel", get_log_channel))
-    application.add_handler(CallbackQueryHandler(button_callback))
-
-    logger.info("Bot is starting...")
+    if args.mode == 'webhook' and not args.webhook_url:
+        logger.error("WEBHOOK_URL is required in webhook mode!")
+        print("❌ ERROR: WEBHOOK_URL not set!")
+        return
+
+    if args.mode == 'webhook':
+        try:
+            import tornado  # noqa: F401 - PTB's webhook server
+        except ImportError:
+            logger.error("Webhook mode needs python-telegram-bot[webhooks]!")
+            print("❌ ERROR: webhook mode needs the webhooks extra:")
+            print('pip install "python-telegram-bot[webhooks]"')
+            return
+
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(PerUserUpdateProcessor(UPDATE_WORKERS))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown))
+    # Handlers, broadcasts and the log pipeline all share this pool
+    if metrics.enabled:
+        builder.request(InstrumentedRequest(metrics, connection_pool_size=BOT_API_POOL_SIZE, pool_timeout=10))
+    else:
+        builder.connection_pool_size(BOT_API_POOL_SIZE).pool_timeout(10)
+    if BOT_API_BASE_URL:
+        # A self-hosted Bot API server, or benchmarks/fake_bot_api_server.py
+        builder.base_url(BOT_API_BASE_URL)
+    application = builder.build()
+
+    add_handlers(application)
+
+    # Webhook deployments get a health check by default, polling ones opt in
+    # (enabling metrics counts as opting in, for /metrics)
+    health_port = args.health_port
+    if health_port is None:
+        health_port = 8080 if args.mode == 'webhook' or metrics.enabled else 0
+    if health_port:
+        # Polling deployments have no public listener, so keep /metrics local
+        health_listen = args.health_listen or (args.listen if args.mode == 'webhook' else '127.0.0.1')
+        health_server = HttpServer(health_listen, health_port)
+        add_health_route(health_server, application, args.mode)
+        if metrics.enabled:
+            add_metrics_route(health_server, application)
+
+    logger.info(f"Bot is starting in {args.mode} mode...")
     print("🤖 Bot is running! Press Ctrl+C to stop.")
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if args.mode == 'webhook':
+        secret_token = args.secret_token
+        if not secret_token:
+            secret_token = secrets.token_urlsafe(32)
+            logger.warning("WEBHOOK_SECRET not set, using a random secret for this run")
+
+        url_path = args.path.strip('/')
+        application.run_webhook(
+            listen=args.listen,
+            port=args.port,
+            url_path=url_path,
+            webhook_url=f"{args.webhook_url.rstrip('/')}/{url_path}",
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES)
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == '__main__':
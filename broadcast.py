@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from telegram.error import TelegramError, RetryAfter, Forbidden
+
+from async_database import AsyncDatabase
+from rate_limiter import RateLimiter, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_CONCURRENCY = 16
+BROADCAST_CHUNK_SIZE = 200
+BROADCAST_MAX_RETRIES = 3
+PROGRESS_INTERVAL = 5.0
+
+
+class BroadcastEngine:
+    """Sends a message to every user under Telegram's rate limits.
+
+    Users are walked in user_id order in chunks. Each chunk is delivered with
+    bounded concurrency, then its per-user results and the new cursor are
+    committed together, so a broadcast interrupted by a restart resumes from
+    the last completed chunk. When the run is cancelled or an error escapes
+    mid-chunk, sends already under way finish and are recorded first, so
+    only a hard kill mid-chunk can deliver a message twice.
+    """
+
+    def __init__(self, database: AsyncDatabase, limiter: Optional[RateLimiter] = None,
+                 concurrency: int = BROADCAST_CONCURRENCY,
+                 chunk_size: int = BROADCAST_CHUNK_SIZE,
+                 max_retries: int = BROADCAST_MAX_RETRIES,
+                 progress_interval: float = PROGRESS_INTERVAL):
+        self.database = database
+        self.limiter = limiter or RateLimiter()
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._cancelled = set()
+
+    def is_running(self, broadcast_id: int) -> bool:
+        task = self._tasks.get(broadcast_id)
+        return task is not None and not task.done()
+
+    async def start(self, bot, message: str, status_chat_id: int, status_message_id: int,
+                    on_complete: Optional[Callable[[dict], Awaitable]] = None,
+                    total: Optional[int] = None) -> int:
+        if total is None:
+            total = (await self.database.get_stats())['total_users']
+        broadcast_id = await self.database.create_broadcast(message, total, status_chat_id, status_message_id)
+        self._spawn(bot, broadcast_id, on_complete)
+        return broadcast_id
+
+    async def resume(self, bot, broadcast_id: int,
+                     on_complete: Optional[Callable[[dict], Awaitable]] = None) -> bool:
+        broadcast = await self.database.get_broadcast(broadcast_id)
+        if not broadcast or broadcast['status'] != 'running' or self.is_running(broadcast_id):
+            return False
+        self._spawn(bot, broadcast_id, on_complete)
+        return True
+
+    def cancel(self, broadcast_id: int) -> bool:
+        if not self.is_running(broadcast_id):
+            return False
+        self._cancelled.add(broadcast_id)
+        return True
+
+    def _spawn(self, bot, broadcast_id: int, on_complete):
+        task = asyncio.create_task(self.run(bot, broadcast_id, on_complete))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda done: self._finished(broadcast_id, done))
+
+    def _finished(self, broadcast_id: int, task: asyncio.Task):
+        self._tasks.pop(broadcast_id, None)
+        if not task.cancelled() and task.exception():
+            # The broadcast stays 'running' in the database and can be resumed
+            logger.error(f"Broadcast {broadcast_id} stopped: {task.exception()!r}")
+
+    async def run(self, bot, broadcast_id: int, on_complete=None) -> dict:
+        broadcast = await self.database.get_broadcast(broadcast_id)
+        message = broadcast['message']
+        cursor = broadcast['cursor']
+        semaphore = asyncio.Semaphore(self.concurrency)
+        last_progress = time.monotonic()
+
+        try:
+            async for rows in self.database.iter_user_chunks(chunk_size=self.chunk_size, after_id=cursor):
+                if broadcast_id in self._cancelled:
+                    break
+                user_ids = [row[0] for row in rows]
+
+                # Skip anyone already handled before an interruption mid-chunk
+                done = await self.database.get_broadcast_done(broadcast_id, user_ids[0], user_ids[-1])
+                pending = [user_id for user_id in user_ids if user_id not in done]
+                deliveries = [asyncio.ensure_future(self._deliver(bot, semaphore, broadcast_id, user_id, message))
+                              for user_id in pending]
+                try:
+                    if deliveries:
+                        await asyncio.wait(deliveries)
+                except asyncio.CancelledError:
+                    # Stopped mid-chunk: let sends already under way finish and
+                    # record them, so a resume does not send them again
+                    self._cancelled.add(broadcast_id)
+                    await asyncio.wait(deliveries)
+                    await self.database.record_broadcast_results(broadcast_id, [
+                        (user_id,) + delivery.result()
+                        for user_id, delivery in zip(pending, deliveries)
+                        if not delivery.exception() and delivery.result()], None)
+                    raise
+                outcomes = [delivery.exception() or delivery.result() for delivery in deliveries]
+
+                results = [(user_id,) + outcome
+                           for user_id, outcome in zip(pending, outcomes)
+                           if isinstance(outcome, tuple)]
+                complete = len(results) == len(pending)
+                await self.database.record_broadcast_results(
+                    broadcast_id, results, user_ids[-1] if complete else None)
+                # Whatever was sent is recorded before an unexpected error escapes
+                for outcome in outcomes:
+                    if isinstance(outcome, BaseException):
+                        raise outcome
+                if not complete:
+                    break
+
+                if time.monotonic() - last_progress >= self.progress_interval:
+                    last_progress = time.monotonic()
+                    await self._report_progress(bot, broadcast_id)
+
+            status = 'cancelled' if broadcast_id in self._cancelled else 'done'
+            await self.database.set_broadcast_status(broadcast_id, status)
+        finally:
+            self._cancelled.discard(broadcast_id)
+
+        broadcast = await self.database.get_broadcast(broadcast_id)
+        await self._report_progress(bot, broadcast_id, broadcast)
+        if on_complete:
+            await on_complete(broadcast)
+        return broadcast
+
+    async def _deliver(self, bot, semaphore: asyncio.Semaphore, broadcast_id: int,
+                       user_id: int, message: str):
+        """Returns (status, error), or None if cancelled before sending"""
+        async with semaphore:
+            error = None
+            for _ in range(self.max_retries + 1):
+                if broadcast_id in self._cancelled:
+                    return None
+                await self.limiter.acquire(user_id)
+                if broadcast_id in self._cancelled:
+                    return None
+                try:
+                    await bot.send_message(chat_id=user_id, text=message)
+                    return 'sent', None
+                except RetryAfter as e:
+                    # Flood control applies to the whole bot, so stop everyone
+                    delay = retry_after_seconds(e)
+                    logger.warning(f"Broadcast {broadcast_id} hit flood control, waiting {delay}s")
+                    self.limiter.pause(delay)
+                    error = str(e)
+                except Forbidden as e:
+                    return 'blocked', str(e)
+                except TelegramError as e:
+                    logger.error(f"Failed to send to {user_id}: {e}")
+                    return 'failed', str(e)
+            return 'failed', error
+
+    async def _report_progress(self, bot, broadcast_id: int, broadcast: Optional[dict] = None):
+        broadcast = broadcast or await self.database.get_broadcast(broadcast_id)
+        if not broadcast['status_chat_id']:
+            return
+        try:
+            await bot.edit_message_text(chat_id=broadcast['status_chat_id'],
+                                        message_id=broadcast['status_message_id'],
+                                        text=format_progress(broadcast))
+        except TelegramError as e:
+            logger.error(f"Could not update broadcast {broadcast_id} status: {e}")
+
+
+def format_progress(broadcast: dict) -> str:
+    processed = broadcast['success'] + broadcast['failed']
+    headline = {
+        'running': f"📤 Broadcast #{broadcast['id']} in progress...",
+        'done': f"✅ Broadcast #{broadcast['id']} Complete!",
+        'cancelled': f"🛑 Broadcast #{broadcast['id']} Cancelled",
+    }.get(broadcast['status'], f"📤 Broadcast #{broadcast['id']}")
+    return (f"{headline}\n\n"
+            f"Success: {broadcast['success']}\n"
+            f"Failed: {broadcast['failed']}\n"
+            f"Processed: {processed}/{broadcast['total']}")
@@ -0,0 +1,65 @@
+import time
+from typing import Callable, Dict, Hashable
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 600.0
+
+
+class CircuitBreaker:
+    """Per-key circuit breaker.
+
+    After ``failure_threshold`` consecutive failures (or a single failure
+    recorded with ``trip=True``) the key is skipped for ``cooldown`` seconds.
+    After the cooldown exactly one caller is let through as a probe and the
+    rest keep being skipped until it resolves: success closes the circuit
+    again, another failure re-opens it immediately. A probe that never
+    reports back is given up on after another ``cooldown``.
+    """
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 cooldown: float = DEFAULT_COOLDOWN,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.clock = clock
+        self._failures: Dict[Hashable, int] = {}
+        self._open_until: Dict[Hashable, float] = {}
+        # Keys with a probe in flight, and when to stop waiting for it
+        self._probing: Dict[Hashable, float] = {}
+
+    def allow(self, key: Hashable) -> bool:
+        open_until = self._open_until.get(key)
+        if open_until is None:
+            return True
+        now = self.clock()
+        if open_until > now or self._probing.get(key, 0) > now:
+            return False
+        # Half-open: this caller is the probe, and re-trips on its failure
+        self._probing[key] = now + self.cooldown
+        return True
+
+    def record_success(self, key: Hashable):
+        self._failures.pop(key, None)
+        self._open_until.pop(key, None)
+        self._probing.pop(key, None)
+
+    def record_failure(self, key: Hashable, trip: bool = False):
+        probe = self._probing.pop(key, None) is not None
+        failures = self._failures.get(key, 0) + 1
+        self._failures[key] = failures
+        if trip or probe or failures >= self.failure_threshold:
+            self._open_until[key] = self.clock() + self.cooldown
+
+    def is_open(self, key: Hashable) -> bool:
+        return key in self._open_until
+
+    def reset(self, key: Hashable = None):
+        if key is None:
+            self._failures.clear()
+            self._open_until.clear()
+            self._probing.clear()
+        else:
+            self.record_success(key)
+
+    def open_keys(self) -> list:
+        return list(self._open_until)
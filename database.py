@@ -1,15 +1,207 @@
+import logging
+import secrets
 import sqlite3
+import threading
+import time
 import uuid
 from datetime import datetime
-from typing import Optional, List, Tuple
+from typing import Iterable, Iterator, Optional, List, Sequence, Tuple
+
+from leaderboard import LeaderboardSnapshot, LEADERBOARD_SIZE
+from rank_index import RankIndex
+from records import LeaderboardEntry, LEADERBOARD_COLUMNS, USER_COLUMNS, UserRecord, user_columns, user_projection
+from referral_codes import ReferralCodec
+from settings_store import SettingsStore
+from user_cache import UserCache, DEFAULT_MAX_ENTRIES as USER_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Pragmas applied to every connection the manager opens. WAL lets readers run
+# alongside the single writer, and synchronous=NORMAL only fsyncs on checkpoint.
+CONNECTION_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),
+    ('mmap_size', 268435456),
+    ('busy_timeout', 5000),
+    ('temp_store', 'MEMORY'),
+)
+STATEMENT_CACHE_SIZE = 128
+
+# synchronous levels a writer connection may run at. In WAL mode NORMAL can
+# lose the last commits on power loss (never corrupts); FULL fsyncs every commit.
+DURABILITY_LEVELS = ('OFF', 'NORMAL', 'FULL')
+
+# Writes that apply_batch can group into one transaction, by public name
+BATCH_OPERATIONS = {
+    'register_user': '_register_user',
+    'redeem_credits': '_redeem_credits',
+}
+
+USER_CHUNK_SIZE = 1000
+# How long user_changes rows are kept for processes syncing their user cache
+USER_CHANGE_RETENTION = 3600
+
+# Schema upgrades applied in order on top of the tables created by init_db.
+# The applied version is tracked in PRAGMA user_version, so each step runs
+# exactly once per database file, including databases created before this
+# list existed (user_version 0).
+SCHEMA_MIGRATIONS = [
+    (1, [
+        # Leaderboard: range scan on total_referrals, covering the rendered columns
+        'CREATE INDEX IF NOT EXISTS idx_users_leaderboard ON users (total_referrals DESC, username, first_name)',
+        'CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals (referrer_id, referred_id)',
+        # A user can only ever be referred once; drop any historical duplicates first
+        'DELETE FROM referrals WHERE id NOT IN (SELECT MIN(id) FROM referrals GROUP BY referred_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_referrals_referred ON referrals (referred_id)',
+        'CREATE INDEX IF NOT EXISTS idx_redemptions_user ON redemptions (user_id, credits_used)',
+        # Integer epoch timestamps alongside the ISO text dates
+        'ALTER TABLE users ADD COLUMN joined_at INTEGER',
+        'ALTER TABLE referrals ADD COLUMN created_at INTEGER',
+        'ALTER TABLE redemptions ADD COLUMN created_at INTEGER',
+        # The ISO dates came from datetime.now(), so they are local time
+        "UPDATE users SET joined_at = CAST(strftime('%s', joined_date, 'utc') AS INTEGER) WHERE joined_date IS NOT NULL",
+        "UPDATE referrals SET created_at = CAST(strftime('%s', date, 'utc') AS INTEGER) WHERE date IS NOT NULL",
+        "UPDATE redemptions SET created_at = CAST(strftime('%s', date, 'utc') AS INTEGER) WHERE date IS NOT NULL",
+    ]),
+    (2, [
+        # Local membership index fed by chat_member updates
+        '''CREATE TABLE IF NOT EXISTS channel_members (
+            user_id INTEGER NOT NULL,
+            channel_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            updated_at INTEGER,
+            PRIMARY KEY (user_id, channel_id)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_channel_members_channel ON channel_members (channel_id)',
+    ]),
+    (3, [
+        # Resumable broadcasts: cursor is the last user_id whose chunk completed
+        '''CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL,
+            cursor INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            success INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            status_chat_id INTEGER,
+            status_message_id INTEGER,
+            created_at INTEGER,
+            updated_at INTEGER
+        )''',
+        '''CREATE TABLE IF NOT EXISTS broadcast_results (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID''',
+    ]),
+    (4, [
+        # Pre-generated voucher inventory handed out by redeem_credits
+        '''CREATE TABLE IF NOT EXISTS reward_codes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT UNIQUE NOT NULL,
+            claimed_by INTEGER,
+            claimed_at INTEGER,
+            imported_at INTEGER
+        )''',
+        # Only unclaimed codes are indexed, so the next one is always the first entry
+        'CREATE INDEX IF NOT EXISTS idx_reward_codes_unclaimed ON reward_codes (id) WHERE claimed_by IS NULL',
+    ]),
+    (5, [
+        # Row counts kept by triggers so get_stats is a single small read
+        '''CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID''',
+        *[statement for table in ('users', 'referrals', 'redemptions') for statement in (
+            f"INSERT OR REPLACE INTO counters (name, value) SELECT '{table}', COUNT(*) FROM {table}",
+            f'''CREATE TRIGGER IF NOT EXISTS counters_{table}_insert AFTER INSERT ON {table}
+            BEGIN UPDATE counters SET value = value + 1 WHERE name = '{table}'; END''',
+            f'''CREATE TRIGGER IF NOT EXISTS counters_{table}_delete AFTER DELETE ON {table}
+            BEGIN UPDATE counters SET value = value - 1 WHERE name = '{table}'; END''',
+        )],
+    ]),
+    (6, [
+        # Changed user ids, for processes sharing the file to invalidate their
+        # user caches; only filled once a process calls track_user_changes
+        '''CREATE TABLE IF NOT EXISTS user_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            changed_at INTEGER NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_user_changes_changed_at ON user_changes (changed_at)',
+    ]),
+]
+
+# Trigger-maintained counters and the get_stats key each one feeds
+COUNTERS = {
+    'users': 'total_users',
+    'referrals': 'total_referrals',
+    'redemptions': 'total_redemptions',
+}
+
+
+class ConnectionManager:
+    """Keeps one long-lived connection per thread instead of connect-per-call"""
+
+    def __init__(self, db_name: str, pragmas=CONNECTION_PRAGMAS,
+                 cached_statements: int = STATEMENT_CACHE_SIZE):
+        self.db_name = db_name
+        self.pragmas = pragmas
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_name,
+                               check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self.connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass  # Owned by a thread that already went away
+        self._local = threading.local()
+
 
 class Database:
-    def __init__(self, db_name: str = "referral_bot.db"):
+    def __init__(self, db_name: str = "referral_bot.db", referral_secret: Optional[str] = None,
+                 user_cache_size: int = USER_CACHE_SIZE):
         self.db_name = db_name
+        self.connections = ConnectionManager(db_name)
         self.init_db()
+        self.referral_codes = ReferralCodec(referral_secret or self.get_referral_key())
+        self.settings = SettingsStore(self)
+        self.users = UserCache(user_cache_size)
+        self.user_change_seq: Optional[int] = None
+        self.rank_index = self.build_rank_index()
+        self.leaderboard = LeaderboardSnapshot(self.get_leaderboard(LEADERBOARD_SIZE), self.get_stats())
     
     def get_connection(self):
-        return sqlite3.connect(self.db_name)
+        return self.connections.get()
+    
+    def close(self):
+        self.connections.close_all()
     
     def init_db(self):
         conn = self.get_connection()
@@ -85,161 +277,516 @@ class Database:
         ''')
         
         conn.commit()
-        conn.close()
+        
+        self.migrate()
+    
+    def begin(self, conn: sqlite3.Connection, mode: str = 'IMMEDIATE'):
+        """Open an explicit transaction on a reused per-thread connection.
+        
+        Callers must roll back on any exception, not just sqlite3.Error, or
+        the connection stays inside the transaction (and holds the write
+        lock) for good. A transaction still open here was leaked by such a
+        path; it is rolled back rather than failing every later write.
+        """
+        if conn.in_transaction:
+            logger.warning("Rolling back a transaction left open on this connection")
+            conn.rollback()
+        conn.execute(f'BEGIN {mode}')
+    
+    def migrate(self):
+        conn = self.get_connection()
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        
+        for target, statements in SCHEMA_MIGRATIONS:
+            if target <= version:
+                continue
+            self.begin(conn)
+            try:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {target}')
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            version = target
     
     def add_user(self, user_id: int, username: Optional[str], first_name: str, referred_by: Optional[int] = None) -> str:
+        registration = self.register_user(user_id, username, first_name, referred_by)
+        return registration['referral_code'] if registration else None
+    
+    def register_user(self, user_id: int, username: Optional[str], first_name: str,
+                      referred_by: Optional[int] = None) -> Optional[dict]:
+        """Insert the user and credit the referrer in one transaction.
+        
+        Returns None if the user already exists, otherwise the new referral
+        code, whether a referral was recorded, and the referrer's updated row
+        (None when nobody was credited).
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
-        if cursor.fetchone():
-            conn.close()
-            return None
+        # Take the write lock up front so concurrent registrations serialise
+        # here instead of failing on upgrade from a read transaction
+        self.begin(conn)
+        try:
+            result = self._register_user(cursor, user_id, username, first_name, referred_by)
+            if result is None:
+                conn.rollback()
+                return None
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
         
-        referral_code = str(uuid.uuid4())[:8]
+        self._registered(result)
+        return result
+    
+    def _register_user(self, cursor: sqlite3.Cursor, user_id: int, username: Optional[str],
+                       first_name: str, referred_by: Optional[int]) -> Optional[dict]:
+        """Registration statements; the caller owns the transaction"""
+        if referred_by == user_id:
+            referred_by = None
+        if referred_by:
+            # Decoded codes skip the lookup, so make sure the referrer exists
+            cursor.execute('SELECT 1 FROM users WHERE user_id = ?', (referred_by,))
+            if cursor.fetchone() is None:
+                referred_by = None
+        
+        referral_code = self.referral_codes.encode(user_id)
         joined_date = datetime.now().isoformat()
+        joined_at = int(time.time())
+        referrer = None
+        referred = False
         
         cursor.execute('''
-            INSERT INTO users (user_id, username, first_name, referral_code, referred_by, joined_date)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (user_id, username, first_name, referral_code, referred_by, joined_date))
+            INSERT INTO users (user_id, username, first_name, referral_code, referred_by, joined_date, joined_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO NOTHING
+            RETURNING user_id
+        ''', (user_id, username, first_name, referral_code, referred_by, joined_date, joined_at))
+        if not cursor.fetchall():
+            return None
         
         if referred_by:
             cursor.execute('''
-                INSERT INTO referrals (referrer_id, referred_id, date)
-                VALUES (?, ?, ?)
-            ''', (referred_by, user_id, joined_date))
-            
-            cursor.execute('''
+                INSERT INTO referrals (referrer_id, referred_id, date, created_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (referred_id) DO NOTHING
+                RETURNING id
+            ''', (referred_by, user_id, joined_date, joined_at))
+            referred = bool(cursor.fetchall())
+        
+        if referred:
+            cursor.execute(f'''
                 UPDATE users SET credits = credits + 5, total_referrals = total_referrals + 1
                 WHERE user_id = ?
+                RETURNING {', '.join(USER_COLUMNS)}
             ''', (referred_by,))
+            rows = cursor.fetchall()
+            if rows:
+                referrer = UserRecord(*rows[0])
         
-        conn.commit()
-        conn.close()
-        return referral_code
+        return {'referral_code': referral_code, 'referrer': referrer, 'referred': referred}
+    
+    def _registered(self, result: dict):
+        """Apply a committed registration to the in-memory indexes"""
+        referrer = result['referrer']
+        self.rank_index.add(0)
+        if referrer:
+            self.users.store(referrer)
+            self.rank_index.move(referrer.total_referrals - 1, referrer.total_referrals)
+        self.leaderboard.record_user(
+            result['referred'],
+            LeaderboardEntry(referrer.user_id, referrer.username, referrer.first_name, referrer.total_referrals)
+            if referrer else None)
+    
+    def get_user(self, user_id: int, columns: Optional[Sequence[str]] = None):
+        """The user's record, or None; see load_user for ``columns``"""
+        if self.users.enabled:
+            record = self.users.get(user_id)
+            if record is not None:
+                return record
+        return self.load_user(user_id, columns)
     
-    def get_user(self, user_id: int) -> Optional[dict]:
+    def load_user(self, user_id: int, columns: Optional[Sequence[str]] = None):
+        """Read the user from the table, bypassing the cache lookup.
+        
+        ``columns`` is the least the caller needs. With the cache on, the
+        full UserRecord is read and cached anyway; with it off, only those
+        columns are selected, into a record with just those fields.
+        """
+        if columns is None or self.users.enabled:
+            columns = USER_COLUMNS
+        columns = user_columns(columns)
+        generation = self.users.generation
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+        cursor.execute(f'SELECT {", ".join(columns)} FROM users WHERE user_id = ?', (user_id,))
         row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return {
-                'user_id': row[0],
-                'username': row[1],
-                'first_name': row[2],
-                'referral_code': row[3],
-                'referred_by': row[4],
-                'credits': row[5],
-                'total_referrals': row[6],
-                'joined_date': row[7]
-            }
-        return None
+        if row is None:
+            return None
+        record = user_projection(columns)(*row)
+        if columns == USER_COLUMNS:
+            self.users.put(record, generation)
+        return record
     
     def get_user_by_referral_code(self, referral_code: str) -> Optional[int]:
+        user_id = self.referral_codes.decode(referral_code)
+        if user_id is not None:
+            user = self.get_user(user_id, ('referral_code',))
+            if user and user.referral_code == referral_code:
+                return user_id
+        
+        # Legacy random codes are only known to the table, and so are codes
+        # issued under an earlier key, about 1 in 3844 of which pass the
+        # checksum and decode to the wrong id
+        return self._user_by_code_column(referral_code)
+    
+    def _user_by_code_column(self, referral_code: str) -> Optional[int]:
+        """Look the code up in users.referral_code, without decoding it"""
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute('SELECT user_id FROM users WHERE referral_code = ?', (referral_code,))
         row = cursor.fetchone()
-        conn.close()
         return row[0] if row else None
     
-    def get_leaderboard(self, limit: int = 10) -> List[Tuple]:
+    def get_leaderboard(self, limit: int = 10) -> List[LeaderboardEntry]:
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT user_id, username, first_name, total_referrals 
+        cursor.execute(f'''
+            SELECT {', '.join(LEADERBOARD_COLUMNS)}
             FROM users 
             WHERE total_referrals > 0
             ORDER BY total_referrals DESC 
             LIMIT ?
         ''', (limit,))
-        rows = cursor.fetchall()
-        conn.close()
-        return rows
+        return [LeaderboardEntry(*row) for row in cursor.fetchall()]
     
-    def get_user_rank(self, user_id: int) -> int:
+    def build_rank_index(self) -> RankIndex:
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute('''
-            SELECT COUNT(*) + 1 
+            SELECT total_referrals, COUNT(*) 
             FROM users 
-            WHERE total_referrals > (
-                SELECT total_referrals FROM users WHERE user_id = ?
-            )
-        ''', (user_id,))
-        rank = cursor.fetchone()[0]
-        conn.close()
-        return rank
+            GROUP BY total_referrals
+        ''')
+        return RankIndex.from_counts({refs or 0: count for refs, count in cursor.fetchall()})
+    
+    def reload_rankings(self):
+        """Rebuild the rank index and leaderboard snapshot from the tables.
+        
+        Both are only kept current for writes made through this instance,
+        so processes sharing the database converge by calling this.
+        """
+        conn = self.get_connection()
+        # One snapshot, so the index, top list and totals agree
+        self.begin(conn, 'DEFERRED')
+        try:
+            rank_index = self.build_rank_index()
+            top = self.get_leaderboard(self.leaderboard.size)
+            stats = self.get_stats()
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        self.rank_index = rank_index
+        self.leaderboard.reset(top, stats)
+    
+    def get_user_rank(self, user_id: int) -> int:
+        user = self.get_user(user_id, ('total_referrals',))
+        if not user:
+            return 1
+        return self.rank_index.rank(user.total_referrals)
     
     def redeem_credits(self, user_id: int, credits_required: int = 300) -> Optional[str]:
         conn = self.get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT credits FROM users WHERE user_id = ?', (user_id,))
-        row = cursor.fetchone()
-        
-        if not row or row[0] < credits_required:
-            conn.close()
-            return None
+        self.begin(conn)
+        try:
+            redemption_code = self._redeem_credits(cursor, user_id, credits_required)
+            if redemption_code is None:
+                conn.rollback()
+                return None
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
         
-        redemption_code = f"REWARD-{uuid.uuid4().hex[:8].upper()}"
+        self.users.invalidate((user_id,))
+        self.leaderboard.record_redemption()
+        return redemption_code
+    
+    def _redeem_credits(self, cursor: sqlite3.Cursor, user_id: int, credits_required: int) -> Optional[str]:
+        """Redemption statements; on None the caller must roll back the debit"""
         date = datetime.now().isoformat()
+        now = int(time.time())
         
-        cursor.execute('''
-            INSERT INTO redemptions (user_id, redemption_code, credits_used, date)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, redemption_code, credits_required, date))
-        
+        # The balance check and the debit are one statement, so concurrent
+        # taps can never both pass the check
         cursor.execute('''
             UPDATE users SET credits = credits - ?
-            WHERE user_id = ?
-        ''', (credits_required, user_id))
+            WHERE user_id = ? AND credits >= ?
+            RETURNING credits
+        ''', (credits_required, user_id, credits_required))
+        if not cursor.fetchall():
+            return None
         
-        conn.commit()
-        conn.close()
+        redemption_code = self._claim_reward_code(cursor, user_id, now)
+        if redemption_code is None:
+            return None
+        
+        cursor.execute('''
+            INSERT INTO redemptions (user_id, redemption_code, credits_used, date, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, redemption_code, credits_required, date, now))
         return redemption_code
     
-    def get_all_users(self) -> List[int]:
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id FROM users')
-        users = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return users
+    def _claim_reward_code(self, cursor: sqlite3.Cursor, user_id: int, now: int) -> Optional[str]:
+        cursor.execute('''
+            UPDATE reward_codes SET claimed_by = ?, claimed_at = ?
+            WHERE id = (SELECT id FROM reward_codes WHERE claimed_by IS NULL ORDER BY id LIMIT 1)
+            RETURNING code
+        ''', (user_id, now))
+        rows = cursor.fetchall()
+        if rows:
+            return rows[0][0]
+        
+        # Until an inventory has been imported, keep generating codes;
+        # once there is one, running out means redemption must fail
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM reward_codes)')
+        if cursor.fetchone()[0]:
+            return None
+        return f"REWARD-{uuid.uuid4().hex[:8].upper()}"
     
-    def get_stats(self) -> dict:
+    def apply_batch(self, operations: Sequence[Tuple[str, tuple]]) -> List:
+        """Run queued writes in one transaction (group commit).
+        
+        Each operation is (name, args) with name in BATCH_OPERATIONS and gets
+        its own savepoint, so a failing or rejected operation is undone
+        without affecting the others. Returns one result per operation, in
+        order; an operation that raised gets its exception as the result.
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
+        results = []
         
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
+        self.begin(conn)
+        try:
+            for name, args in operations:
+                cursor.execute('SAVEPOINT batch_op')
+                try:
+                    result = getattr(self, BATCH_OPERATIONS[name])(cursor, *args)
+                except Exception as e:
+                    # Only this operation fails; the savepoint undoes it
+                    result = e
+                if result is None or isinstance(result, Exception):
+                    cursor.execute('ROLLBACK TO batch_op')
+                cursor.execute('RELEASE batch_op')
+                results.append(result)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
         
-        cursor.execute('SELECT COUNT(*) FROM referrals')
-        total_referrals = cursor.fetchone()[0]
+        for (name, args), result in zip(operations, results):
+            if result is None or isinstance(result, Exception):
+                continue
+            if name == 'register_user':
+                self._registered(result)
+            elif name == 'redeem_credits':
+                self.users.invalidate((args[0],))
+                self.leaderboard.record_redemption()
+        return results
+    
+    def set_durability(self, level: str):
+        """Set PRAGMA synchronous on the calling thread's connection"""
+        level = level.upper()
+        if level not in DURABILITY_LEVELS:
+            raise ValueError(f"durability must be one of {', '.join(DURABILITY_LEVELS)}")
+        self.get_connection().execute(f'PRAGMA synchronous = {level}')
+    
+    def import_reward_codes(self, codes: Iterable[str]) -> Tuple[int, int]:
+        """Bulk-load voucher codes, one per line; returns (added, skipped).
         
-        cursor.execute('SELECT COUNT(*) FROM redemptions')
-        total_redemptions = cursor.fetchone()[0]
+        Every non-blank line is a code, including ones starting with '#'.
+        Blank lines and codes already imported count as skipped.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        now = int(time.time())
         
-        conn.close()
+        cleaned = [code.strip() for code in codes]
+        rows = [(code, now) for code in cleaned if code]
         
+        before = conn.total_changes
+        with conn:
+            cursor.executemany('INSERT OR IGNORE INTO reward_codes (code, imported_at) VALUES (?, ?)', rows)
+        added = conn.total_changes - before
+        return added, len(cleaned) - added
+    
+    def get_reward_code_stats(self) -> dict:
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) FROM reward_codes WHERE claimed_by IS NULL')
+        available = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*) FROM reward_codes')
+        total = cursor.fetchone()[0]
         return {
-            'total_users': total_users,
-            'total_referrals': total_referrals,
-            'total_redemptions': total_redemptions
+            'available': available,
+            'claimed': total - available,
+            'total': total
         }
     
-    def add_channel(self, channel_id: str, channel_name: str, channel_link: str = None) -> bool:
+    def get_all_users(self) -> List[int]:
+        return list(self.iter_user_ids())
+    
+    def get_user_chunk(self, after_id: int, limit: int, columns: Sequence[str] = ('user_id',)) -> List[Tuple]:
+        """One keyset page of users after after_id; user_id is always the first column"""
+        columns = user_columns(('user_id',) + tuple(columns))
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {', '.join(columns)} FROM users
+            WHERE user_id > ? ORDER BY user_id LIMIT ?
+        ''', (after_id, limit))
+        return cursor.fetchall()
+    
+    def iter_user_chunks(self, columns: Sequence[str] = ('user_id',), chunk_size: int = USER_CHUNK_SIZE,
+                         after_id: int = 0) -> Iterator[List[Tuple]]:
+        # Each page is its own short read, so no lock is held between pages
+        while True:
+            rows = self.get_user_chunk(after_id, chunk_size, columns)
+            if not rows:
+                return
+            yield rows
+            after_id = rows[-1][0]
+    
+    def iter_users(self, columns: Sequence[str] = ('user_id',), chunk_size: int = USER_CHUNK_SIZE,
+                   after_id: int = 0) -> Iterator[Tuple]:
+        for rows in self.iter_user_chunks(columns, chunk_size, after_id):
+            yield from rows
+    
+    def iter_user_ids(self, chunk_size: int = USER_CHUNK_SIZE, after_id: int = 0) -> Iterator[int]:
+        for rows in self.iter_user_chunks(('user_id',), chunk_size, after_id):
+            for row in rows:
+                yield row[0]
+    
+    def create_broadcast(self, message: str, total: int, status_chat_id: int, status_message_id: int) -> int:
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        now = int(time.time())
+        with conn:
+            cursor.execute('''
+                INSERT INTO broadcasts (message, status, total, status_chat_id, status_message_id, created_at, updated_at)
+                VALUES (?, 'running', ?, ?, ?, ?, ?)
+            ''', (message, total, status_chat_id, status_message_id, now, now))
+        return cursor.lastrowid
+    
+    def get_broadcast(self, broadcast_id: int) -> Optional[dict]:
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, message, status, cursor, total, success, failed, status_chat_id, status_message_id
+            FROM broadcasts WHERE id = ?
+        ''', (broadcast_id,))
+        row = cursor.fetchone()
+        
+        if row:
+            return {
+                'id': row[0],
+                'message': row[1],
+                'status': row[2],
+                'cursor': row[3],
+                'total': row[4],
+                'success': row[5],
+                'failed': row[6],
+                'status_chat_id': row[7],
+                'status_message_id': row[8]
+            }
+        return None
+    
+    def get_latest_broadcast_id(self, status: Optional[str] = None) -> Optional[int]:
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        if status:
+            cursor.execute('SELECT MAX(id) FROM broadcasts WHERE status = ?', (status,))
+        else:
+            cursor.execute('SELECT MAX(id) FROM broadcasts')
+        return cursor.fetchone()[0]
+    
+    def get_broadcast_done(self, broadcast_id: int, first_user_id: int, last_user_id: int) -> set:
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT user_id FROM broadcast_results
+            WHERE broadcast_id = ? AND user_id BETWEEN ? AND ?
+        ''', (broadcast_id, first_user_id, last_user_id))
+        return {row[0] for row in cursor.fetchall()}
+    
+    def record_broadcast_results(self, broadcast_id: int, results: List[Tuple[int, str, Optional[str]]],
+                                 new_cursor: Optional[int] = None):
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        success = sum(1 for _, status, _ in results if status == 'sent')
+        with conn:
+            cursor.executemany('''
+                INSERT OR IGNORE INTO broadcast_results (broadcast_id, user_id, status, error)
+                VALUES (?, ?, ?, ?)
+            ''', [(broadcast_id, user_id, status, error) for user_id, status, error in results])
+            cursor.execute('''
+                UPDATE broadcasts
+                SET success = success + ?, failed = failed + ?, cursor = COALESCE(?, cursor), updated_at = ?
+                WHERE id = ?
+            ''', (success, len(results) - success, new_cursor, int(time.time()), broadcast_id))
+    
+    def set_broadcast_status(self, broadcast_id: int, status: str):
+        conn = self.get_connection()
+        with conn:
+            conn.execute('UPDATE broadcasts SET status = ?, updated_at = ? WHERE id = ?',
+                         (status, int(time.time()), broadcast_id))
+    
+    def get_stats(self) -> dict:
+        conn = self.get_connection()
+        values = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+        return {key: values.get(name, 0) for name, key in COUNTERS.items()}
+    
+    def check_counters(self, repair: bool = False) -> dict:
+        """Compare each counter with a real COUNT(*); returns {name: (stored, actual)}.
+        
+        The counts are full scans, so this is for occasional audits only.
+        With repair, drifted counters are reset to the actual count.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # One transaction so counters and counts come from the same snapshot
+        self.begin(conn, 'IMMEDIATE' if repair else 'DEFERRED')
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('INSERT INTO channels (channel_id, channel_name, channel_link) VALUES (?, ?, ?)', 
-                         (channel_id, channel_name, channel_link))
+            values = dict(cursor.execute('SELECT name, value FROM counters').fetchall())
+            report = {}
+            for name in COUNTERS:
+                actual = cursor.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0]
+                report[name] = (values.get(name), actual)
+                if repair and values.get(name) != actual:
+                    cursor.execute('INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)', (name, actual))
             conn.commit()
-            conn.close()
+        except BaseException:
+            conn.rollback()
+            raise
+        if repair and any(stored != actual for stored, actual in report.values()):
+            # The snapshot header was built from the drifted counters
+            self.reload_rankings()
+        return report
+    
+    def add_channel(self, channel_id: str, channel_name: str, channel_link: str = None) -> bool:
+        conn = self.get_connection()
+        try:
+            with conn:
+                conn.execute('INSERT INTO channels (channel_id, channel_name, channel_link) VALUES (?, ?, ?)', 
+                             (channel_id, channel_name, channel_link))
             return True
         except sqlite3.IntegrityError:
             return False
@@ -247,10 +794,10 @@ class Database:
     def remove_channel(self, channel_id: str) -> bool:
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('DELETE FROM channels WHERE channel_id = ?', (channel_id,))
-        deleted = cursor.rowcount > 0
-        conn.commit()
-        conn.close()
+        with conn:
+            cursor.execute('DELETE FROM channels WHERE channel_id = ?', (channel_id,))
+            deleted = cursor.rowcount > 0
+            cursor.execute('DELETE FROM channel_members WHERE channel_id = ?', (channel_id,))
         return deleted
     
     def get_channels(self) -> List[Tuple[str, str, str]]:
@@ -258,37 +805,95 @@ class Database:
         cursor = conn.cursor()
         cursor.execute('SELECT channel_id, channel_name, channel_link FROM channels')
         channels = cursor.fetchall()
-        conn.close()
         return channels
     
-    def set_start_message(self, message: str):
+    def set_channel_member(self, channel_id: str, user_id: int, status: str):
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', 
-                      ('start_message', message))
-        conn.commit()
-        conn.close()
+        with conn:
+            conn.execute('''
+                INSERT INTO channel_members (user_id, channel_id, status, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, channel_id) DO UPDATE
+                SET status = excluded.status, updated_at = excluded.updated_at
+            ''', (user_id, channel_id, status, int(time.time())))
     
-    def get_start_message(self) -> str:
+    def get_channel_memberships(self, user_id: int) -> dict:
+        """Stored (status, updated_at) per channel_id for the user"""
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT value FROM settings WHERE key = ?', ('start_message',))
-        row = cursor.fetchone()
-        conn.close()
-        return row[0] if row else 'Welcome!'
+        cursor.execute('SELECT channel_id, status, updated_at FROM channel_members WHERE user_id = ?', (user_id,))
+        return {channel_id: (status, updated_at) for channel_id, status, updated_at in cursor.fetchall()}
     
-    def set_log_channel(self, channel_id: str):
+    def track_user_changes(self):
+        """Log every changed user id to user_changes, for sync_user_cache.
+        
+        The triggers live in the database file, so once any process turns
+        this on, writes from every process sharing the file are logged.
+        """
+        conn = self.get_connection()
+        with conn:
+            for event in ('UPDATE', 'DELETE'):
+                conn.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS user_changes_{event.lower()} AFTER {event} ON users
+                    BEGIN
+                        INSERT INTO user_changes (user_id, changed_at) VALUES (OLD.user_id, CAST(strftime('%s') AS INTEGER));
+                    END
+                ''')
+        self.user_change_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM user_changes').fetchone()[0]
+    
+    def sync_user_cache(self, retention: int = USER_CHANGE_RETENTION) -> int:
+        """Invalidate cached users changed since the last sync; returns how many.
+        
+        Changes older than ``retention`` seconds are pruned. A process that
+        slept through the pruning of changes it had not seen yet clears its
+        whole cache instead.
+        """
+        if self.user_change_seq is None:
+            return 0
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', 
-                      ('log_channel', channel_id))
-        conn.commit()
-        conn.close()
+        cursor.execute('SELECT seq, user_id FROM user_changes WHERE seq > ? ORDER BY seq', (self.user_change_seq,))
+        rows = cursor.fetchall()
+        if rows:
+            if rows[0][0] > self.user_change_seq + 1:
+                self.users.invalidate()
+            else:
+                self.users.invalidate({user_id for _, user_id in rows})
+            self.user_change_seq = rows[-1][0]
+        
+        with conn:
+            cursor.execute('DELETE FROM user_changes WHERE changed_at < ?', (int(time.time()) - retention,))
+        return len(rows)
     
-    def get_log_channel(self) -> Optional[str]:
+    def get_referral_key(self) -> str:
+        """The referral code key stored in settings, created on first use"""
+        conn = self.get_connection()
+        # OR IGNORE so processes starting together agree on the first key written
+        with conn:
+            conn.execute('INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)',
+                         ('referral_code_key', secrets.token_hex(16)))
+        return conn.execute("SELECT value FROM settings WHERE key = 'referral_code_key'").fetchone()[0]
+    
+    def load_settings(self) -> dict:
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT value FROM settings WHERE key = ?', ('log_channel',))
-        row = cursor.fetchone()
-        conn.close()
-        return row[0] if row else None
+        cursor.execute('SELECT key, value FROM settings')
+        return dict(cursor.fetchall())
+    
+    def write_setting(self, key: str, value: Optional[str]):
+        conn = self.get_connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', 
+                         (key, value))
+    
+    def set_start_message(self, message: str):
+        self.settings.set('start_message', message)
+    
+    def get_start_message(self) -> str:
+        return self.settings.get('start_message', 'Welcome!')
+    
+    def set_log_channel(self, channel_id: str):
+        self.settings.set('log_channel', channel_id)
+    
+    def get_log_channel(self) -> Optional[str]:
+        return self.settings.get('log_channel')
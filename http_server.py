@@ -0,0 +1,78 @@
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# A route returns (status code, content type, body)
+Response = Tuple[int, str, str]
+Route = Callable[[], Awaitable[Response]]
+
+REASONS = {200: 'OK', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+def json_response(payload: dict, status: int = 200) -> Response:
+    return status, 'application/json', json.dumps(payload)
+
+
+class HttpServer:
+    """Tiny asyncio HTTP server for operational GET endpoints (health, metrics).
+
+    It runs on the bot's event loop next to polling or the webhook server and
+    only understands GET requests without a body.
+    """
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 8080):
+        self.host = host
+        self.port = port
+        self.routes: Dict[str, Route] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def add_route(self, path: str, route: Route):
+        self.routes[path] = route
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"HTTP endpoints listening on {self.host}:{self.port}: {', '.join(self.routes)}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain the headers; none of the routes need them
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2:
+                return
+            method, path = parts[0], parts[1].split('?', 1)[0]
+
+            route = self.routes.get(path)
+            if route is None:
+                status, content_type, body = json_response({'error': 'not found'}, 404)
+            elif method != 'GET':
+                status, content_type, body = json_response({'error': 'method not allowed'}, 405)
+            else:
+                try:
+                    status, content_type, body = await route()
+                except Exception as e:
+                    logger.error(f"HTTP route {path} failed: {e}")
+                    status, content_type, body = json_response({'error': str(e)}, 500)
+
+            payload = body.encode('utf-8')
+            writer.write(
+                f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + payload)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,55 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from records import LeaderboardEntry
+
+LEADERBOARD_SIZE = 10
+
+
+class LeaderboardSnapshot:
+    """In-memory top-N referrers and header totals, kept current by Database.
+
+    Referral counts only ever grow, so crediting a referrer can only move them
+    up: the top list stays exact without re-querying. Every change bumps
+    ``version`` so callers can cache anything rendered from a snapshot.
+    """
+
+    def __init__(self, top: List[LeaderboardEntry], stats: Dict[str, int], size: int = LEADERBOARD_SIZE):
+        self.size = size
+        self.version = 0
+        self._top = list(top)[:size]
+        self._stats = dict(stats)
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> Tuple[int, List[LeaderboardEntry], Dict[str, int]]:
+        with self._lock:
+            return self.version, list(self._top), dict(self._stats)
+
+    def record_user(self, referred: bool = False, referrer: Optional[LeaderboardEntry] = None):
+        """Account for a new user, and for the referrer row they credited"""
+        with self._lock:
+            self._stats['total_users'] += 1
+            if referred:
+                self._stats['total_referrals'] += 1
+            if referrer:
+                self._promote(referrer)
+            self.version += 1
+
+    def reset(self, top: List[LeaderboardEntry], stats: Dict[str, int]):
+        """Replace everything with a fresh read of the database"""
+        with self._lock:
+            self._top = list(top)[:self.size]
+            self._stats = dict(stats)
+            self.version += 1
+
+    def record_redemption(self):
+        with self._lock:
+            self._stats['total_redemptions'] += 1
+            self.version += 1
+
+    def _promote(self, referrer: LeaderboardEntry):
+        top = [row for row in self._top if row.user_id != referrer.user_id]
+        if len(top) < self.size or referrer.total_referrals > top[-1].total_referrals:
+            top.append(referrer)
+            top.sort(key=lambda row: row.total_referrals, reverse=True)
+        self._top = top[:self.size]
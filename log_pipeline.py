@@ -0,0 +1,180 @@
+import asyncio
+import logging
+from typing import Callable, List, Optional
+
+from telegram.error import TelegramError, RetryAfter
+
+from rate_limiter import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+BATCH_SEPARATOR = '\n\n➖➖➖➖➖\n\n'
+LOG_QUEUE_SIZE = 1000
+LOG_FLUSH_INTERVAL = 3.0
+LOG_MAX_RETRIES = 3
+OVERFLOW_POLICIES = ('drop_newest', 'drop_oldest')
+
+
+class LogPipeline:
+    """Delivers audit log messages to the log channel in the background.
+
+    Handlers only enqueue. A single worker coalesces queued events into
+    batches no longer than one Telegram message and flushes a batch when it
+    is full or ``flush_interval`` seconds after its first event. When the
+    queue is full the ``overflow`` policy decides which event is dropped.
+    """
+
+    def __init__(self, get_chat_id: Callable[[], Optional[str]],
+                 max_queue: int = LOG_QUEUE_SIZE,
+                 flush_interval: float = LOG_FLUSH_INTERVAL,
+                 overflow: str = 'drop_oldest',
+                 max_retries: int = LOG_MAX_RETRIES):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {', '.join(OVERFLOW_POLICIES)}")
+        self.get_chat_id = get_chat_id
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.max_retries = max_retries
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._carry: Optional[str] = None
+        self._bot = None
+        self._worker: Optional[asyncio.Task] = None
+        self._batch: List[str] = []
+        self._sending = False
+        self._stopping = False
+        self.submitted = 0
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def start(self, bot):
+        self._bot = bot
+        self._stopping = False
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the worker and flush whatever is still queued.
+
+        Needs the bot's HTTP client, so call it before the application shuts
+        down. A batch already being sent is allowed to finish, so it is
+        counted as sent or failed rather than lost.
+        """
+        if self._worker:
+            self._stopping = True
+            if not self._sending:
+                self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        # A batch the worker was still collecting when it was cancelled
+        batch, self._batch = self._batch, []
+        await self._send(batch)
+        while self._carry is not None or not self._queue.empty():
+            await self._send(self._next_batch_nowait())
+
+    def submit(self, message: str):
+        self.submitted += 1
+        message = truncate(message)
+        try:
+            self._queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.overflow == 'drop_oldest':
+                self._queue.get_nowait()
+                self._queue.put_nowait(message)
+
+    def depth(self) -> int:
+        return self._queue.qsize() + (self._carry is not None) + len(self._batch)
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.depth(),
+            'submitted': self.submitted,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'batches': self.batches,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            if self._carry is not None:
+                first, self._carry = self._carry, None
+            else:
+                first = await self._queue.get()
+
+            batch = self._batch = [first]
+            size = len(first)
+            deadline = loop.time() + self.flush_interval
+            while True:
+                timeout = deadline - loop.time()
+                # wait_for can swallow stop()'s cancel when a message arrives
+                # in the same step, so check the flag too rather than wait out
+                # the flush interval
+                if timeout <= 0 or self._stopping:
+                    break
+                try:
+                    message = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if size + len(BATCH_SEPARATOR) + len(message) > MESSAGE_LIMIT:
+                    self._carry = message
+                    break
+                batch.append(message)
+                size += len(BATCH_SEPARATOR) + len(message)
+
+            self._batch = []
+            self._sending = True
+            try:
+                await self._send(batch)
+            finally:
+                self._sending = False
+
+    def _next_batch_nowait(self) -> List[str]:
+        batch = []
+        size = -len(BATCH_SEPARATOR)
+        while True:
+            if self._carry is not None:
+                message, self._carry = self._carry, None
+            elif not self._queue.empty():
+                message = self._queue.get_nowait()
+            else:
+                return batch
+            if batch and size + len(BATCH_SEPARATOR) + len(message) > MESSAGE_LIMIT:
+                self._carry = message
+                return batch
+            batch.append(message)
+            size += len(BATCH_SEPARATOR) + len(message)
+
+    async def _send(self, batch: List[str]):
+        chat_id = self.get_chat_id()
+        if not batch or not chat_id or self._bot is None:
+            return
+
+        text = BATCH_SEPARATOR.join(batch)
+        for _ in range(self.max_retries + 1):
+            try:
+                await self._bot.send_message(chat_id=chat_id, text=text, parse_mode='HTML')
+                self.sent += len(batch)
+                self.batches += 1
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(retry_after_seconds(e))
+            except TelegramError as e:
+                logger.error(f"Failed to send log to channel: {e}")
+                break
+        self.failed += len(batch)
+
+
+def truncate(message: str) -> str:
+    if len(message) <= MESSAGE_LIMIT:
+        return message
+    # Cut on a line boundary so an HTML tag is less likely to be split
+    cut = message.rfind('\n', 0, MESSAGE_LIMIT - 1)
+    return message[:cut if cut > 0 else MESSAGE_LIMIT - 1] + '…'
@@ -0,0 +1,89 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+DEFAULT_POSITIVE_TTL = 300.0
+DEFAULT_NEGATIVE_TTL = 30.0
+DEFAULT_MAX_ENTRIES = 100000
+
+
+class MembershipCache:
+    """LRU cache of channel membership results keyed by (user_id, channel_id).
+
+    Members are remembered for ``positive_ttl`` seconds and non-members for
+    the shorter ``negative_ttl`` so a user who just joined is not locked out
+    for long. Once ``max_entries`` is reached the least recently used entry is
+    evicted, which keeps memory bounded regardless of user count.
+    """
+
+    def __init__(self, positive_ttl: float = DEFAULT_POSITIVE_TTL,
+                 negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int, channel_id: str) -> Optional[bool]:
+        key = (user_id, channel_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        is_member, expires_at = entry
+        if expires_at <= self.clock():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return is_member
+
+    def set(self, user_id: int, channel_id: str, is_member: bool):
+        ttl = self.positive_ttl if is_member else self.negative_ttl
+        if ttl <= 0:
+            return
+        key = (user_id, channel_id)
+        self._entries[key] = (is_member, self.clock() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, channel_id: Optional[str] = None, user_id: Optional[int] = None):
+        if channel_id is None and user_id is None:
+            self._entries.clear()
+            return
+        stale = [key for key in self._entries
+                 if (user_id is None or key[0] == user_id)
+                 and (channel_id is None or key[1] == channel_id)]
+        for key in stale:
+            del self._entries[key]
+
+    def memory_usage(self) -> int:
+        """Rough size in bytes of the cache structure and its entries"""
+        size = sys.getsizeof(self._entries)
+        for key, value in self._entries.items():
+            size += sys.getsizeof(key) + sys.getsizeof(value)
+        return size
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,229 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Seconds; Prometheus-style upper bounds, +Inf is implicit
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_QUERY_THRESHOLD = 0.1
+# Database methods that are plumbing rather than queries
+UNTIMED_DATABASE_METHODS = ('get_connection', 'close', 'init_db', 'migrate', 'begin')
+
+Labels = Tuple[Tuple[str, str], ...]
+
+DESCRIPTIONS = {
+    'handler_seconds': ('histogram', 'Handler latency by command or callback'),
+    'handler_errors_total': ('counter', 'Handler calls that raised'),
+    'db_seconds': ('histogram', 'Database method latency, measured on the worker thread'),
+    'db_slow_total': ('counter', 'Database calls slower than the slow query threshold'),
+    'api_calls_total': ('counter', 'Bot API requests by method'),
+    'api_errors_total': ('counter', 'Failed Bot API requests by method and status code or exception'),
+    'api_retry_after_total': ('counter', 'Bot API requests answered with 429 RetryAfter'),
+    'queue_depth': ('gauge', 'Items waiting in background queues'),
+}
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, share: float) -> float:
+        """Upper bound of the bucket holding the given quantile, capped at the last bucket"""
+        target = share * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return self.buckets[-1]
+
+
+class Metrics:
+    """In-process metrics registry with Prometheus text and JSON output.
+
+    When disabled, the instrumentation helpers return the original
+    callables untouched, so the hot paths carry no extra work at all.
+    Observations may come from database worker threads, hence the lock.
+    """
+
+    def __init__(self, enabled: bool = False, namespace: str = 'referral_bot',
+                 slow_query_threshold: float = SLOW_QUERY_THRESHOLD):
+        self.enabled = enabled
+        self.namespace = namespace
+        self.slow_query_threshold = slow_query_threshold
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], Callable[[], float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def gauge(self, name: str, read: Callable[[], float], **labels):
+        """Register a gauge that is read when metrics are rendered"""
+        self._gauges[(name, tuple(sorted(labels.items())))] = read
+
+    def timed_handler(self, callback: Callable, label: Optional[Callable[[Any], str]] = None) -> Callable:
+        """Wrap a PTB callback to record its latency under its name, or ``label(update)``"""
+        if not self.enabled:
+            return callback
+        name = callback.__name__
+
+        @wraps(callback)
+        async def timed(update, context):
+            handler = label(update) if label else name
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                self.inc('handler_errors_total', handler=handler)
+                raise
+            finally:
+                self.observe('handler_seconds', time.perf_counter() - started, handler=handler)
+
+        return timed
+
+    def instrument_database(self, database):
+        """Time every public Database method and log the slow calls"""
+        if not self.enabled:
+            return
+        for name, attribute in vars(type(database)).items():
+            if callable(attribute) and not name.startswith('_') and name not in UNTIMED_DATABASE_METHODS:
+                setattr(database, name, self._timed_call(name, getattr(database, name)))
+
+    def _timed_call(self, name: str, method: Callable) -> Callable:
+        @wraps(method)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                self.observe('db_seconds', elapsed, method=name)
+                if elapsed >= self.slow_query_threshold:
+                    self.inc('db_slow_total', method=name)
+                    logger.warning(f"Slow database call: {name} took {elapsed * 1000:.0f}ms")
+
+        return timed
+
+    def render_prometheus(self) -> str:
+        lines = []
+        described = set()
+
+        def header(name: str):
+            if name not in described:
+                described.add(name)
+                kind, text = DESCRIPTIONS.get(name, ('untyped', name))
+                lines.append(f"# HELP {self.namespace}_{name} {text}")
+                lines.append(f"# TYPE {self.namespace}_{name} {kind}")
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = [(key, histogram.buckets, list(histogram.counts), histogram.count, histogram.sum)
+                          for key, histogram in sorted(self._histograms.items(), key=lambda item: item[0])]
+
+        for (name, labels), value in counters:
+            header(name)
+            lines.append(f"{self.namespace}_{name}{format_labels(labels)} {value:g}")
+        for (name, labels), read in sorted(self._gauges.items(), key=lambda item: item[0]):
+            header(name)
+            lines.append(f"{self.namespace}_{name}{format_labels(labels)} {read():g}")
+        for (name, labels), buckets, counts, count, total in histograms:
+            header(name)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                lines.append(f"{self.namespace}_{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{self.namespace}_{name}_sum{format_labels(labels)} {total:g}")
+            lines.append(f"{self.namespace}_{name}_count{format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> dict:
+        """JSON-friendly view with approximate quantiles instead of buckets"""
+        snapshot = {'counters': {}, 'gauges': {}, 'histograms': {}}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                snapshot['counters'].setdefault(name, {})[label_key(labels)] = value
+            for (name, labels), histogram in self._histograms.items():
+                snapshot['histograms'].setdefault(name, {})[label_key(labels)] = {
+                    'count': histogram.count,
+                    'mean_ms': round(histogram.sum / histogram.count * 1000, 3) if histogram.count else 0,
+                    'p50_ms': histogram.quantile(0.50) * 1000,
+                    'p95_ms': histogram.quantile(0.95) * 1000,
+                    'p99_ms': histogram.quantile(0.99) * 1000,
+                }
+        for (name, labels), read in self._gauges.items():
+            snapshot['gauges'].setdefault(name, {})[label_key(labels)] = read()
+        return snapshot
+
+    def dump(self, path: str):
+        """Write the snapshot as JSON, atomically so readers never see half a file"""
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump({'time': int(time.time()), **self.snapshot()}, f, indent=2)
+        os.replace(temporary, path)
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels) + '}'
+
+
+def label_key(labels: Labels) -> str:
+    return ','.join(f"{name}={value}" for name, value in labels) or 'total'
+
+
+def escape_label(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that counts Bot API calls, errors and 429s per method"""
+
+    def __init__(self, metrics: Metrics, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = metrics
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.metrics.inc('api_calls_total', method=endpoint)
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception as e:
+            self.metrics.inc('api_errors_total', method=endpoint, error=type(e).__name__)
+            raise
+        if code == 429:
+            self.metrics.inc('api_retry_after_total', method=endpoint)
+        elif code >= 400:
+            self.metrics.inc('api_errors_total', method=endpoint, error=str(code))
+        return code, payload
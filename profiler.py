@@ -0,0 +1,199 @@
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = 'profiles'
+SAMPLE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 300
+# Files whose functions the report focuses on
+PROFILE_SCOPE = ('bot.py', 'database.py', 'async_database.py')
+HOTSPOTS = 10
+
+
+class Profiler:
+    """Profiles the running bot on demand for N seconds or N updates.
+
+    cProfile records the event loop thread, where every handler runs, and
+    is written as a .pstats file. Alongside it a sampler thread snapshots
+    the stacks of all threads every ``interval`` seconds, which also covers
+    the database worker threads; stacks passing through ``scope`` files
+    are written in collapsed format (one ``frame;frame;... count`` line per
+    stack, the input of flamegraph.pl and speedscope).
+    """
+
+    def __init__(self, output_dir: str = PROFILE_DIR, interval: float = SAMPLE_INTERVAL,
+                 max_seconds: float = PROFILE_MAX_SECONDS, scope: Sequence[str] = PROFILE_SCOPE):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.scope = tuple(scope)
+        self.updates_left: Optional[int] = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._samples: Counter = Counter()
+        self._sampler: Optional[threading.Thread] = None
+        self._sampling = threading.Event()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._on_complete: Optional[Callable[[dict], Awaitable]] = None
+        self._writing: Optional[asyncio.Future] = None
+        self._started = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self._profile is not None
+
+    def start(self, seconds: Optional[float] = None, updates: Optional[int] = None,
+              on_complete: Optional[Callable[[dict], Awaitable]] = None) -> bool:
+        """Start profiling on the event loop thread; False if already running.
+
+        Stops after ``seconds``, or after ``updates`` updates (see
+        ``count_update``), and never later than ``max_seconds``.
+        """
+        if seconds is not None and not seconds > 0:
+            raise ValueError("seconds must be positive")
+        if updates is not None and updates <= 0:
+            raise ValueError("updates must be positive")
+        if self.active:
+            return False
+        seconds = self.max_seconds if seconds is None else min(seconds, self.max_seconds)
+        self.updates_left = updates
+        self._on_complete = on_complete
+        self._samples = Counter()
+        self._started = time.perf_counter()
+
+        # Each run gets its own event and counter, so a sampler still winding
+        # down from the previous run never records into this one
+        self._sampling = threading.Event()
+        self._sampling.set()
+        self._sampler = threading.Thread(target=self._sample,
+                                         args=(threading.get_ident(), self._sampling, self._samples),
+                                         name='profiler-sampler', daemon=True)
+        self._sampler.start()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        self._timer = asyncio.get_running_loop().call_later(seconds, self._finish)
+        return True
+
+    def count_update(self):
+        if self.updates_left is None or not self.active:
+            return
+        self.updates_left -= 1
+        if self.updates_left <= 0:
+            self._finish()
+
+    def stop(self) -> bool:
+        if not self.active:
+            return False
+        self._finish()
+        return True
+
+    def _finish(self):
+        """Stop recording on the loop and write the report in the default executor"""
+        if not self.active:
+            return
+        self._profile.disable()
+        profile, self._profile = self._profile, None
+        self._sampling.clear()
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        elapsed = time.perf_counter() - self._started
+        self._writing = asyncio.ensure_future(
+            self._report(profile, self._sampler, self._samples, elapsed, self._on_complete))
+
+    async def _report(self, profile: cProfile.Profile, sampler: threading.Thread, samples: Counter,
+                      elapsed: float, on_complete: Optional[Callable[[dict], Awaitable]]):
+        loop = asyncio.get_running_loop()
+        try:
+            report = await loop.run_in_executor(None, self._write, profile, sampler, samples, elapsed)
+        except Exception:
+            logger.exception("Writing the profile failed")
+            return
+        if on_complete:
+            await on_complete(report)
+
+    def _sample(self, loop_thread: int, sampling: threading.Event, samples: Counter):
+        own = threading.get_ident()
+        while sampling.is_set():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                in_scope = False
+                while frame is not None:
+                    code = frame.f_code
+                    filename = os.path.basename(code.co_filename)
+                    in_scope = in_scope or filename in self.scope
+                    stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if in_scope:
+                    thread = 'event-loop' if thread_id == loop_thread else names.get(thread_id, 'thread')
+                    samples[';'.join([thread] + stack[::-1])] += 1
+            time.sleep(self.interval)
+
+    def _write(self, profile: cProfile.Profile, sampler: threading.Thread, samples: Counter,
+               elapsed: float) -> dict:
+        # The sampler sees the cleared event within one interval
+        sampler.join()
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        pstats_path = os.path.join(self.output_dir, f"profile-{stamp}.pstats")
+        collapsed_path = os.path.join(self.output_dir, f"profile-{stamp}.collapsed")
+
+        profile.dump_stats(pstats_path)
+        with open(collapsed_path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        return {
+            'seconds': round(elapsed, 1),
+            'samples': sum(samples.values()),
+            'pstats_path': pstats_path,
+            'collapsed_path': collapsed_path,
+            'cumulative': self._pstats_hotspots(profile),
+            'sampled': self._sampled_hotspots(samples),
+        }
+
+    def _pstats_hotspots(self, profile: cProfile.Profile):
+        """Top in-scope functions by cumulative time on the event loop thread"""
+        stats = pstats.Stats(profile, stream=io.StringIO())
+        rows = []
+        for (filename, line, name), (_, calls, _, cumulative, _) in stats.stats.items():
+            if os.path.basename(filename) in self.scope:
+                rows.append((cumulative, calls, f"{name} ({os.path.basename(filename)}:{line})"))
+        rows.sort(reverse=True)
+        return [{'function': function, 'calls': calls, 'cumulative_ms': round(cumulative * 1000, 1)}
+                for cumulative, calls, function in rows[:HOTSPOTS]]
+
+    def _sampled_hotspots(self, samples: Counter):
+        """Top in-scope functions by the share of in-scope samples they appear in"""
+        inclusive = Counter()
+        total = sum(samples.values())
+        for stack, count in samples.items():
+            frames = set(frame for frame in stack.split(';')[1:]
+                         if frame.split('(')[-1].split(':')[0] in self.scope)
+            for frame in frames:
+                inclusive[frame] += count
+        return [{'function': function, 'share': round(count / total, 3)}
+                for function, count in inclusive.most_common(HOTSPOTS)]
+
+
+def format_report(report: dict) -> str:
+    lines = [f"🔬 Profile finished ({report['seconds']}s, {report['samples']} samples)", '',
+             '⏱ Cumulative time (event loop):']
+    lines += [f"{row['cumulative_ms']}ms  {row['calls']}×  {row['function']}" for row in report['cumulative']]
+    lines += ['', '📊 Share of sampled stacks (all threads):']
+    lines += [f"{row['share']:.1%}  {row['function']}" for row in report['sampled']]
+    lines += ['', f"📁 {report['pstats_path']}", f"📁 {report['collapsed_path']}"]
+    return '\n'.join(lines)
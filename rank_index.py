@@ -0,0 +1,81 @@
+import threading
+from typing import Dict
+
+
+class RankIndex:
+    """Fenwick tree over total_referrals values for O(log n) rank lookups.
+
+    Slot ``v`` holds how many users currently have exactly ``v`` referrals,
+    so a user's rank is one plus the number of users in slots above theirs.
+    """
+
+    def __init__(self, size: int = 1024):
+        self._size = size
+        self._counts = [0] * size
+        self._tree = [0] * (size + 1)
+        self._total = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_counts(cls, counts: Dict[int, int]) -> 'RankIndex':
+        size = 1024
+        highest = max(counts, default=0)
+        while size <= highest:
+            size *= 2
+        index = cls(size)
+        for value, count in counts.items():
+            index._counts[value] = count
+        index._rebuild()
+        return index
+
+    def _rebuild(self):
+        tree = [0] * (self._size + 1)
+        for i, count in enumerate(self._counts, 1):
+            tree[i] += count
+            parent = i + (i & -i)
+            if parent <= self._size:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self._total = sum(self._counts)
+
+    def _grow(self, value: int):
+        size = self._size
+        while size <= value:
+            size *= 2
+        self._counts.extend([0] * (size - self._size))
+        self._size = size
+        self._rebuild()
+
+    def _update(self, value: int, delta: int):
+        if value >= self._size:
+            self._grow(value)
+        self._counts[value] += delta
+        self._total += delta
+        i = value + 1
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _count_at_most(self, value: int) -> int:
+        i = min(value + 1, self._size)
+        result = 0
+        while i > 0:
+            result += self._tree[i]
+            i -= i & -i
+        return result
+
+    def add(self, value: int, delta: int = 1):
+        with self._lock:
+            self._update(value, delta)
+
+    def move(self, old_value: int, new_value: int):
+        with self._lock:
+            self._update(old_value, -1)
+            self._update(new_value, 1)
+
+    def rank(self, value: int) -> int:
+        with self._lock:
+            return self._total - self._count_at_most(value) + 1
+
+    def __len__(self) -> int:
+        return self._total
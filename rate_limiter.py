@@ -0,0 +1,87 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+# Telegram allows roughly 30 messages per second overall and about one per
+# second to the same chat; stay a little under both.
+GLOBAL_RATE = 25.0
+PER_CHAT_RATE = 1.0
+MAX_TRACKED_CHATS = 10000
+
+
+class TokenBucket:
+    """Async token bucket: ``rate`` tokens per second, bursting to ``capacity``"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        # Waiters queue on the lock, so tokens are handed out in FIFO order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Hand out nothing for ``seconds``, e.g. after a RetryAfter"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+
+class RateLimiter:
+    """Global token bucket plus a bounded set of per-chat buckets"""
+
+    def __init__(self, global_rate: float = GLOBAL_RATE,
+                 per_chat_rate: float = PER_CHAT_RATE,
+                 max_tracked_chats: int = MAX_TRACKED_CHATS):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.max_tracked_chats = max_tracked_chats
+        self._chats = OrderedDict()
+
+    def _chat_bucket(self, chat_id: Hashable) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.per_chat_rate, capacity=1.0)
+            self._chats[chat_id] = bucket
+            while len(self._chats) > self.max_tracked_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def acquire(self, chat_id: Hashable = None):
+        if chat_id is not None:
+            await self._chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+    def pause(self, seconds: float, chat_id: Hashable = None):
+        if chat_id is None:
+            self.global_bucket.pause(seconds)
+        else:
+            self._chat_bucket(chat_id).pause(seconds)
+
+
+def retry_after_seconds(error) -> float:
+    """RetryAfter.retry_after is an int or a timedelta depending on the PTB version"""
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
@@ -0,0 +1,47 @@
+from collections import namedtuple
+from functools import lru_cache
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+# Columns that readers may project from users, in table order
+USER_COLUMNS = ('user_id', 'username', 'first_name', 'referral_code', 'referred_by',
+                'credits', 'total_referrals', 'joined_date', 'joined_at')
+
+
+class UserRecord(NamedTuple):
+    """One full users row. Immutable, so a cached record can be shared freely."""
+    user_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    referral_code: Optional[str]
+    referred_by: Optional[int]
+    credits: int
+    total_referrals: int
+    joined_date: Optional[str]
+    joined_at: Optional[int]
+
+
+class LeaderboardEntry(NamedTuple):
+    user_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    total_referrals: int
+
+
+LEADERBOARD_COLUMNS = LeaderboardEntry._fields
+
+
+def user_columns(columns: Sequence[str]) -> Tuple[str, ...]:
+    """Validate a projection of users, dropping duplicates but keeping the order"""
+    columns = tuple(dict.fromkeys(columns))
+    unknown = set(columns) - set(USER_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown user columns: {', '.join(sorted(unknown))}")
+    return columns
+
+
+@lru_cache(maxsize=None)
+def user_projection(columns: Tuple[str, ...]) -> type:
+    """Record class for a subset of users columns, built once per projection"""
+    if columns == USER_COLUMNS:
+        return UserRecord
+    return namedtuple('UserProjection', columns)
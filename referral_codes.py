@@ -0,0 +1,76 @@
+import hashlib
+import hmac
+import string
+from typing import Optional
+
+ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+BODY_LENGTH = 11  # 62 ** 11 > 2 ** 64
+CHECKSUM_LENGTH = 2
+CODE_LENGTH = BODY_LENGTH + CHECKSUM_LENGTH
+ROUNDS = 4
+HALF_MASK = 0xFFFFFFFF
+
+
+def to_base62(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, 62)
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+
+def from_base62(text: str) -> Optional[int]:
+    value = 0
+    for char in text:
+        digit = ALPHABET.find(char)
+        if digit < 0:
+            return None
+        value = value * 62 + digit
+    return value
+
+
+class ReferralCodec:
+    """Reversible referral codes: a keyed permutation of the user id.
+
+    The 64-bit id goes through a small Feistel network keyed with ``secret``,
+    so consecutive ids give unrelated-looking codes, and is written as 11
+    base62 characters plus a 2-character keyed checksum. Decoding needs
+    only the key, never the database, and two users can never share a code.
+    Legacy 8-character codes are not decodable and fall back to the table.
+    """
+
+    def __init__(self, secret: str):
+        # blake2b keys are capped at 64 bytes, so derive a fixed-size one
+        self.key = hashlib.sha256(secret.encode('utf-8')).digest()
+
+    def _round(self, index: int, half: int) -> int:
+        digest = hashlib.blake2b(bytes((index,)) + half.to_bytes(4, 'big'),
+                                 key=self.key, digest_size=4).digest()
+        return int.from_bytes(digest, 'big')
+
+    def _checksum(self, body: str) -> str:
+        digest = hashlib.blake2b(b'checksum:' + body.encode('ascii'), key=self.key, digest_size=4).digest()
+        return to_base62(int.from_bytes(digest, 'big') % 62 ** CHECKSUM_LENGTH, CHECKSUM_LENGTH)
+
+    def encode(self, user_id: int) -> str:
+        if not 0 < user_id < 2 ** 64:
+            raise ValueError("user_id must be a positive 64-bit integer")
+        left, right = user_id >> 32, user_id & HALF_MASK
+        for index in range(ROUNDS):
+            left, right = right, left ^ self._round(index, right)
+        body = to_base62((left << 32) | right, BODY_LENGTH)
+        return body + self._checksum(body)
+
+    def decode(self, code: str) -> Optional[int]:
+        """The user id behind a code, or None if it is not one of ours"""
+        if len(code) != CODE_LENGTH:
+            return None
+        body, checksum = code[:BODY_LENGTH], code[BODY_LENGTH:]
+        value = from_base62(body)
+        if value is None or value >= 2 ** 64 or not hmac.compare_digest(checksum, self._checksum(body)):
+            return None
+        left, right = value >> 32, value & HALF_MASK
+        for index in reversed(range(ROUNDS)):
+            left, right = right ^ self._round(index, left), left
+        user_id = (left << 32) | right
+        return user_id or None
@@ -0,0 +1,40 @@
+import threading
+from typing import Any, Callable, Dict
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+class SettingsStore:
+    """In-memory copy of the settings table with write-through updates.
+
+    Reads never touch SQLite. Other processes sharing the database converge
+    by calling ``reload`` (the bot does so periodically).
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self._values: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        values = self.database.load_settings()
+        with self._lock:
+            self._values = values
+
+    def get(self, key: str, default: Any = None, type: Callable[[str], Any] = str) -> Any:
+        raw = self._values.get(key)
+        if raw is None:
+            return default
+        if type is bool:
+            return raw.strip().lower() in TRUE_VALUES
+        try:
+            return type(raw)
+        except (TypeError, ValueError):
+            return default
+
+    def set(self, key: str, value: Any):
+        raw = None if value is None else str(value)
+        self.database.write_setting(key, raw)
+        with self._lock:
+            self._values = {**self._values, key: raw}
@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from database import Database
+
+TEST_SECRET = 'test-secret'
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'bot.db')
+
+
+@pytest.fixture
+def database(db_path):
+    database = Database(db_path, referral_secret=TEST_SECRET)
+    yield database
+    database.close()
+
+
+async def fake_bot(api):
+    """A real telegram.Bot whose Bot API calls are answered by ``api``"""
+    from telegram import Bot
+    from fake_telegram import FakeRequest
+
+    bot = Bot('123:TEST', request=FakeRequest(api))
+    await bot.initialize()
+    return bot
+
+
+@pytest.fixture(scope='session')
+def bot_module(tmp_path_factory):
+    """bot.py, imported once with its module database in a scratch directory"""
+    os.environ['DB_PATH'] = str(tmp_path_factory.mktemp('bot') / 'import.db')
+    import bot
+    return bot
+
+
+@pytest.fixture
+def bot_db(bot_module, database):
+    """Points the handlers' module globals at a fresh database"""
+    from async_database import AsyncDatabase
+
+    saved = bot_module.db
+    bot_module.db = AsyncDatabase(database)
+    bot_module.membership_cache.invalidate()
+    yield bot_module.db
+    bot_module.db.close()
+    bot_module.db = saved
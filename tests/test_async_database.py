@@ -0,0 +1,76 @@
+import asyncio
+import sqlite3
+import time
+
+from async_database import AsyncDatabase
+from database import Database
+from conftest import TEST_SECRET
+
+WRITE_STALL = 1.0
+READ_BOUND = 0.25
+
+
+def test_slow_write_does_not_delay_profile_reads(db_path):
+    # Cache off so the reads really go to SQLite
+    database = Database(db_path, referral_secret=TEST_SECRET, user_cache_size=0)
+    database.register_user(1, 'alice', 'Alice')
+    database.register_user(2, 'bob', 'Bob', 1)
+
+    async def run():
+        db = AsyncDatabase(database)
+        # Another process holds the write lock, so the writer thread waits in busy_timeout
+        blocker = sqlite3.connect(db_path, isolation_level=None)
+        blocker.execute('BEGIN IMMEDIATE')
+        loop = asyncio.get_running_loop()
+        loop.call_later(WRITE_STALL, blocker.rollback)
+        try:
+            write = asyncio.ensure_future(db.register_user(3, 'carol', 'Carol', 1))
+            await asyncio.sleep(0.05)
+
+            started = time.perf_counter()
+            user = await db.get_user(2, ('first_name', 'credits', 'total_referrals', 'referral_code'))
+            rank = await db.get_user_rank(2)
+            elapsed = time.perf_counter() - started
+
+            assert not write.done()
+            assert user.first_name == 'Bob' and rank == 2
+            assert elapsed < READ_BOUND
+
+            registration = await write
+            assert registration['referrer'].total_referrals == 2
+        finally:
+            blocker.close()
+            db.close()
+
+    asyncio.run(run())
+
+
+def test_event_loop_keeps_ticking_during_slow_write(db_path):
+    database = Database(db_path, referral_secret=TEST_SECRET)
+
+    def slow_write():
+        conn = database.get_connection()
+        database.begin(conn)
+        try:
+            time.sleep(WRITE_STALL)
+        finally:
+            conn.rollback()
+
+    async def run():
+        db = AsyncDatabase(database)
+        try:
+            write = asyncio.ensure_future(db._write(slow_write))
+            ticks = 0
+            longest = 0.0
+            while not write.done():
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                longest = max(longest, time.perf_counter() - started)
+                ticks += 1
+            await write
+            assert ticks > 20
+            assert longest < READ_BOUND
+        finally:
+            db.close()
+
+    asyncio.run(run())
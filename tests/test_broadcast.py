@@ -0,0 +1,229 @@
+import asyncio
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+
+from async_database import AsyncDatabase
+from broadcast import BroadcastEngine
+from fake_telegram import FakeBotApi, command_update
+from rate_limiter import RateLimiter
+from conftest import fake_bot
+
+USERS = 60
+CHUNK_SIZE = 20
+MESSAGE = 'Hello everyone'
+
+
+class ScriptedBotApi(FakeBotApi):
+    """FakeBotApi that answers sendMessage to chosen users with a 429 once, or a 403"""
+
+    def __init__(self, flood_once=(), blocked=(), **kwargs):
+        super().__init__(**kwargs)
+        self.flood_once = set(flood_once)
+        self.blocked = set(blocked)
+        self.delivered = Counter()
+        self.listeners.append(self.count_delivery)
+
+    def count_delivery(self, method: str, params: dict):
+        if method == 'sendMessage':
+            self.delivered[int(params['chat_id'])] += 1
+
+    async def call(self, method: str, params: dict):
+        chat_id = int(params.get('chat_id') or 0)
+        if method == 'sendMessage' and chat_id in self.flood_once:
+            self.flood_once.discard(chat_id)
+            return 429, {'ok': False, 'error_code': 429,
+                         'description': f"Too Many Requests: retry after {self.retry_after}",
+                         'parameters': {'retry_after': self.retry_after}}
+        if method == 'sendMessage' and chat_id in self.blocked:
+            return 403, {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}
+        return await super().call(method, params)
+
+
+class RecordingLimiter(RateLimiter):
+    def __init__(self):
+        super().__init__(global_rate=10000, per_chat_rate=10000)
+        self.pauses = []
+
+    def pause(self, seconds: float, chat_id=None):
+        self.pauses.append(seconds)
+        super().pause(seconds, chat_id)
+
+
+@pytest.fixture
+def users(database):
+    for user_id in range(1, USERS + 1):
+        database.register_user(user_id, f"user{user_id}", f"User {user_id}")
+    return list(range(1, USERS + 1))
+
+
+def engine_for(database, **kwargs) -> BroadcastEngine:
+    return BroadcastEngine(AsyncDatabase(database), RecordingLimiter(), concurrency=8, chunk_size=CHUNK_SIZE, **kwargs)
+
+
+def results(database, broadcast_id: int) -> dict:
+    conn = database.get_connection()
+    return dict(conn.execute('SELECT user_id, status FROM broadcast_results WHERE broadcast_id = ?',
+                             (broadcast_id,)))
+
+
+def test_retry_after_pauses_everyone_and_forbidden_marks_blocked(database, users):
+    api = ScriptedBotApi(flood_once={5}, blocked={7, 8}, retry_after=1)
+    engine = engine_for(database)
+
+    async def run():
+        bot = await fake_bot(api)
+        broadcast_id = await engine.database.create_broadcast(MESSAGE, USERS, 0, 0)
+        started = time.monotonic()
+        broadcast = await engine.run(bot, broadcast_id)
+        engine.database.close()
+        return broadcast, time.monotonic() - started
+
+    broadcast, elapsed = asyncio.run(run())
+    assert engine.limiter.pauses == [1.0]
+    assert elapsed >= 1.0
+    assert broadcast['status'] == 'done'
+    assert broadcast['success'] == USERS - 2 and broadcast['failed'] == 2
+    assert api.delivered == Counter({user_id: 1 for user_id in users if user_id not in (7, 8)})
+    statuses = results(database, broadcast['id'])
+    assert statuses[5] == 'sent'
+    assert statuses[7] == statuses[8] == 'blocked'
+
+
+def test_cancel_stops_the_broadcast(database, users):
+    api = ScriptedBotApi()
+    engine = engine_for(database)
+
+    async def run():
+        bot = await fake_bot(api)
+        finished = asyncio.get_running_loop().create_future()
+
+        async def on_complete(broadcast):
+            finished.set_result(broadcast)
+
+        api.listeners.append(lambda method, params: sum(api.delivered.values()) == 25 and engine.cancel(broadcast_id))
+        broadcast_id = await engine.start(bot, MESSAGE, 0, 0, on_complete)
+        broadcast = await finished
+        engine.database.close()
+        return broadcast
+
+    broadcast = asyncio.run(run())
+    assert broadcast['status'] == 'cancelled'
+    assert 25 <= sum(api.delivered.values()) < USERS
+    assert max(api.delivered.values()) == 1
+    assert broadcast['success'] == sum(api.delivered.values())
+
+
+def crash_after(api, count: int):
+    """Cancel the running broadcast as the count-th message is delivered"""
+    crash = {}
+
+    def listener(method, params):
+        if method == 'sendMessage' and sum(api.delivered.values()) == count:
+            crash['task'].cancel()
+
+    api.listeners.append(listener)
+    return crash
+
+
+def test_resume_after_a_crash_mid_chunk_sends_each_user_once(database, users):
+    # With some latency several sends are in flight when the crash comes
+    api = ScriptedBotApi(latency=0.01)
+
+    async def run():
+        bot = await fake_bot(api)
+        engine = engine_for(database)
+        broadcast_id = await engine.database.create_broadcast(MESSAGE, USERS, 0, 0)
+        # Halfway through the second chunk
+        crash = crash_after(api, CHUNK_SIZE + CHUNK_SIZE // 2)
+        crash['task'] = asyncio.ensure_future(engine.run(bot, broadcast_id))
+        with pytest.raises(asyncio.CancelledError):
+            await crash['task']
+        engine.database.close()
+        interrupted = sum(api.delivered.values())
+
+        restarted = engine_for(database)
+        broadcast = await restarted.run(bot, broadcast_id)
+        restarted.database.close()
+        return interrupted, broadcast
+
+    interrupted, broadcast = asyncio.run(run())
+    assert CHUNK_SIZE < interrupted < 2 * CHUNK_SIZE
+    assert api.delivered == Counter({user_id: 1 for user_id in users})
+    assert broadcast['status'] == 'done'
+    assert broadcast['success'] == USERS and broadcast['failed'] == 0
+
+
+def test_resume_after_an_error_mid_chunk_sends_each_user_once(database, users):
+    api = ScriptedBotApi()
+
+    class FailingLimiter(RecordingLimiter):
+        async def acquire(self, chat_id=None):
+            if chat_id == CHUNK_SIZE + 3:
+                raise RuntimeError('limiter exploded')
+            await super().acquire(chat_id)
+
+    async def run():
+        bot = await fake_bot(api)
+        engine = BroadcastEngine(AsyncDatabase(database), FailingLimiter(), concurrency=8, chunk_size=CHUNK_SIZE)
+        broadcast_id = await engine.database.create_broadcast(MESSAGE, USERS, 0, 0)
+        with pytest.raises(RuntimeError):
+            await engine.run(bot, broadcast_id)
+        engine.database.close()
+
+        restarted = engine_for(database)
+        broadcast = await restarted.run(bot, broadcast_id)
+        restarted.database.close()
+        return broadcast
+
+    broadcast = asyncio.run(run())
+    assert api.delivered == Counter({user_id: 1 for user_id in users})
+    assert broadcast['status'] == 'done' and broadcast['success'] == USERS
+
+
+def run_owner_command(bot_module, api, handler, text: str, logs: list):
+    async def run():
+        bot = await fake_bot(api)
+        update = Update.de_json(command_update(1, bot_module.OWNER_ID, text), bot)
+        await handler(update, SimpleNamespace(bot=bot, args=text.split()[1:]))
+        # The broadcast runs in the background; its completion writes the log
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 10
+        while not logs and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def owner_engine(bot_module, bot_db, monkeypatch):
+    logs = []
+    monkeypatch.setattr(bot_module, 'send_log', lambda context, message: logs.append(message))
+    monkeypatch.setattr(bot_module, 'broadcast_engine',
+                        BroadcastEngine(bot_db, RecordingLimiter(), chunk_size=CHUNK_SIZE))
+    return logs
+
+
+def test_broadcast_command_reads_the_user_count_once(bot_module, database, users, owner_engine, monkeypatch):
+    calls = []
+    get_stats = database.get_stats
+    monkeypatch.setattr(database, 'get_stats', lambda: calls.append(1) or get_stats())
+    api = ScriptedBotApi()
+
+    run_owner_command(bot_module, api, bot_module.broadcast, f"/broadcast {MESSAGE}", owner_engine)
+    assert len(calls) == 1
+    assert len(owner_engine) == 1 and f"✅ Success: {USERS}" in owner_engine[0]
+
+
+def test_resumed_broadcast_logs_its_completion(bot_module, database, users, owner_engine):
+    broadcast_id = database.create_broadcast(MESSAGE, USERS, 0, 0)
+    database.record_broadcast_results(broadcast_id, [(user_id, 'sent', None) for user_id in range(1, 21)], 20)
+    api = ScriptedBotApi()
+
+    run_owner_command(bot_module, api, bot_module.resume_broadcast, f"/resumebroadcast {broadcast_id}", owner_engine)
+    assert sorted(api.delivered.keys() & set(range(1, USERS + 1))) == list(range(21, USERS + 1))
+    assert len(owner_engine) == 1
+    assert f"✅ Success: {USERS}" in owner_engine[0] and MESSAGE in owner_engine[0]
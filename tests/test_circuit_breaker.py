@@ -0,0 +1,99 @@
+from circuit_breaker import CircuitBreaker
+
+CHANNEL = '@news'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def tripped(clock: Clock) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=60, clock=clock)
+    for _ in range(3):
+        assert breaker.allow(CHANNEL)
+        breaker.record_failure(CHANNEL)
+    return breaker
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=60, clock=Clock())
+    breaker.record_failure(CHANNEL)
+    breaker.record_failure(CHANNEL)
+    assert breaker.allow(CHANNEL) and not breaker.is_open(CHANNEL)
+    breaker.record_failure(CHANNEL)
+    assert not breaker.allow(CHANNEL)
+    assert breaker.open_keys() == [CHANNEL]
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=60, clock=Clock())
+    breaker.record_failure(CHANNEL)
+    breaker.record_failure(CHANNEL)
+    breaker.record_success(CHANNEL)
+    breaker.record_failure(CHANNEL)
+    assert breaker.allow(CHANNEL)
+
+
+def test_trip_opens_immediately():
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=60, clock=Clock())
+    breaker.record_failure(CHANNEL, trip=True)
+    assert not breaker.allow(CHANNEL)
+
+
+def test_half_open_lets_exactly_one_probe_through():
+    clock = Clock()
+    breaker = tripped(clock)
+    clock.now += 59
+    assert not breaker.allow(CHANNEL)
+    clock.now += 1
+    assert [breaker.allow(CHANNEL) for _ in range(5)] == [True, False, False, False, False]
+    assert breaker.is_open(CHANNEL)
+
+
+def test_probe_success_closes_the_circuit():
+    clock = Clock()
+    breaker = tripped(clock)
+    clock.now += 60
+    assert breaker.allow(CHANNEL)
+    breaker.record_success(CHANNEL)
+    assert [breaker.allow(CHANNEL) for _ in range(3)] == [True, True, True]
+    assert breaker.open_keys() == []
+    # Closed again, so it takes the full threshold to re-open
+    breaker.record_failure(CHANNEL)
+    assert breaker.allow(CHANNEL)
+
+
+def test_probe_failure_reopens_for_a_full_cooldown():
+    clock = Clock()
+    breaker = tripped(clock)
+    clock.now += 60
+    assert breaker.allow(CHANNEL)
+    clock.now += 2
+    breaker.record_failure(CHANNEL)
+    assert not breaker.allow(CHANNEL)
+    clock.now += 59
+    assert not breaker.allow(CHANNEL)
+    clock.now += 1
+    assert [breaker.allow(CHANNEL) for _ in range(2)] == [True, False]
+
+
+def test_a_lost_probe_is_replaced_after_a_cooldown():
+    clock = Clock()
+    breaker = tripped(clock)
+    clock.now += 60
+    assert breaker.allow(CHANNEL)
+    clock.now += 59
+    assert not breaker.allow(CHANNEL)
+    clock.now += 1
+    assert breaker.allow(CHANNEL)
+
+
+def test_reset_closes_every_circuit():
+    clock = Clock()
+    breaker = tripped(clock)
+    breaker.reset(CHANNEL)
+    assert breaker.allow(CHANNEL) and breaker.open_keys() == []
@@ -0,0 +1,46 @@
+import asyncio
+import gc
+import warnings
+
+from telegram.ext import Application
+
+from fake_telegram import FakeBotApi, FakeRequest
+
+
+def test_polling_run_starts_and_stops_background_loops(bot_module, bot_db, monkeypatch):
+    monkeypatch.setattr(bot_module, 'SETTINGS_RELOAD_INTERVAL', 60)
+    monkeypatch.setattr(bot_module, 'RANKING_RELOAD_INTERVAL', 60)
+    monkeypatch.setattr(bot_module, 'USER_CACHE_SYNC_INTERVAL', 60)
+    api = FakeBotApi()
+    started = []
+
+    async def post_init(application: Application):
+        await bot_module.post_init(application)
+        started.extend(bot_module.background_tasks)
+        asyncio.get_running_loop().call_later(0.2, application.stop_running)
+
+    application = (
+        Application.builder()
+        .token('123:TEST')
+        .request(FakeRequest(api))
+        .get_updates_request(FakeRequest(api))
+        .post_init(post_init)
+        .post_stop(bot_module.post_stop)
+        .post_shutdown(bot_module.post_shutdown)
+        .build())
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            application.run_polling(stop_signals=None, close_loop=False)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+    gc.collect()
+
+    assert len(started) == 3
+    assert all(task.done() for task in started)
+    assert bot_module.background_tasks == []
+    assert [str(warning.message) for warning in caught if 'create_task' in str(warning.message)] == []
@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+from telegram.ext import Application
+
+from fake_telegram import FakeBotApi, FakeRequest
+from log_pipeline import BATCH_SEPARATOR, MESSAGE_LIMIT, LogPipeline
+from conftest import fake_bot
+
+LOG_CHANNEL = '@audit'
+
+
+def test_stop_lets_the_in_flight_batch_finish():
+    api = FakeBotApi(latency=0.3)
+
+    async def run():
+        bot = await fake_bot(api)
+        pipeline = LogPipeline(lambda: LOG_CHANNEL, flush_interval=0)
+        pipeline.start(bot)
+        pipeline.submit('first')
+        await asyncio.sleep(0.05)
+        # The worker is waiting on sendMessage now
+        pipeline.submit('second')
+        await pipeline.stop()
+        return pipeline.stats()
+
+    stats = asyncio.run(run())
+    assert stats['sent'] == 2 and stats['failed'] == 0 and stats['queued'] == 0
+    assert api.calls['sendMessage'] == 2
+
+
+def test_stop_flushes_the_batch_being_collected():
+    api = FakeBotApi()
+    texts = []
+    api.listeners.append(lambda method, params: texts.append(params['text']))
+
+    async def run():
+        bot = await fake_bot(api)
+        pipeline = LogPipeline(lambda: LOG_CHANNEL, flush_interval=60)
+        pipeline.start(bot)
+        pipeline.submit('first')
+        pipeline.submit('second')
+        await asyncio.sleep(0.05)
+        await pipeline.stop()
+        return pipeline.stats()
+
+    stats = asyncio.run(run())
+    assert stats['sent'] == 2 and stats['batches'] == 1 and stats['queued'] == 0
+    assert len(texts) == 1 and 'first' in texts[0] and 'second' in texts[0]
+
+
+def test_messages_arrive_in_submit_order_across_batches():
+    api = FakeBotApi()
+    texts = []
+    api.listeners.append(lambda method, params: texts.append(params['text']))
+    messages = [f"event {i:03d} " + 'x' * 1500 for i in range(25)]
+
+    async def run():
+        bot = await fake_bot(api)
+        pipeline = LogPipeline(lambda: LOG_CHANNEL, flush_interval=0.05)
+        pipeline.start(bot)
+        for i, message in enumerate(messages):
+            pipeline.submit(message)
+            if i % 7 == 0:
+                await asyncio.sleep(0.06)
+        await pipeline.stop()
+        return pipeline.stats()
+
+    stats = asyncio.run(run())
+    assert stats['sent'] == len(messages) and stats['batches'] == len(texts) > 1
+    assert all(len(text) <= MESSAGE_LIMIT for text in texts)
+    assert [part for text in texts for part in text.split(BATCH_SEPARATOR)] == messages
+
+
+def test_shutdown_flushes_queued_logs(bot_module, bot_db, monkeypatch):
+    monkeypatch.setattr(bot_module, 'SETTINGS_RELOAD_INTERVAL', 0)
+    monkeypatch.setattr(bot_module, 'RANKING_RELOAD_INTERVAL', 0)
+    monkeypatch.setattr(bot_module, 'USER_CACHE_SYNC_INTERVAL', 0)
+    # The module's pipeline queue may be bound to an earlier test's loop
+    monkeypatch.setattr(bot_module, 'log_pipeline', LogPipeline(lambda: LOG_CHANNEL))
+    api = FakeBotApi()
+    texts = []
+    api.listeners.append(lambda method, params: params.get('chat_id') == LOG_CHANNEL and texts.append(params['text']))
+    messages = [f"event {i}" for i in range(5)]
+
+    def log_and_stop(application: Application):
+        # Submitted just before shutdown, well inside the flush interval
+        for message in messages:
+            bot_module.send_log(None, message)
+        application.stop_running()
+
+    async def post_init(application: Application):
+        await bot_module.post_init(application)
+        asyncio.get_running_loop().call_later(0.2, log_and_stop, application)
+
+    application = (
+        Application.builder()
+        .token('123:TEST')
+        .request(FakeRequest(api))
+        .get_updates_request(FakeRequest(api))
+        .post_init(post_init)
+        .post_stop(bot_module.post_stop)
+        .post_shutdown(bot_module.post_shutdown)
+        .build())
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    started = time.perf_counter()
+    try:
+        application.run_polling(stop_signals=None, close_loop=False)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    # Shutdown flushes right away instead of waiting out the flush interval
+    assert time.perf_counter() - started < bot_module.log_pipeline.flush_interval
+    assert [part for text in texts for part in text.split(BATCH_SEPARATOR)] == messages
+    assert bot_module.log_pipeline.depth() == 0
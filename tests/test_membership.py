@@ -0,0 +1,73 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from telegram import Update
+
+from fake_telegram import FakeBotApi, command_update
+from conftest import fake_bot
+
+CHANNEL = '@news'
+USER_ID = 2
+
+
+def check(bot_module, api):
+    async def run():
+        bot = await fake_bot(api)
+        update = Update.de_json(command_update(1, USER_ID, '/profile'), bot)
+        result = await bot_module.check_channel_membership(update, SimpleNamespace(bot=bot))
+        pending = len(bot_module.member_writes)
+        await asyncio.gather(*bot_module.member_writes)
+        return result, pending
+
+    return asyncio.run(run())
+
+
+def store_member(database, status, age):
+    database.set_channel_member(CHANNEL, USER_ID, status)
+    conn = database.get_connection()
+    with conn:
+        conn.execute('UPDATE channel_members SET updated_at = ? WHERE user_id = ?',
+                     (int(time.time() - age), USER_ID))
+
+
+def test_stale_negative_is_checked_again(bot_module, bot_db, database):
+    database.add_channel(CHANNEL, 'News', None)
+    # The user joined, but the chat_member update for it was missed
+    store_member(database, 'left', age=bot_module.membership_cache.negative_ttl + 60)
+    api = FakeBotApi(member_status='member')
+
+    assert check(bot_module, api) == (True, 1)
+    assert api.calls['getChatMember'] == 1
+    # Stored after the check returned, not on its path
+    assert database.get_channel_memberships(USER_ID)[CHANNEL][0] == 'member'
+
+
+def test_fresh_negative_is_trusted(bot_module, bot_db, database):
+    database.add_channel(CHANNEL, 'News', None)
+    store_member(database, 'left', age=0)
+    api = FakeBotApi(member_status='member')
+
+    assert check(bot_module, api) == (False, 0)
+    assert api.calls['getChatMember'] == 0
+    assert api.calls['sendMessage'] == 1
+
+
+def test_stale_positive_is_checked_again(bot_module, bot_db, database):
+    database.add_channel(CHANNEL, 'News', None)
+    # The user left, but the chat_member update for it was missed
+    store_member(database, 'member', age=bot_module.membership_cache.positive_ttl + 60)
+    api = FakeBotApi(member_status='left')
+
+    assert check(bot_module, api) == (False, 1)
+    assert api.calls['getChatMember'] == 1
+    assert database.get_channel_memberships(USER_ID)[CHANNEL][0] == 'left'
+
+
+def test_fresh_positive_is_trusted(bot_module, bot_db, database):
+    database.add_channel(CHANNEL, 'News', None)
+    store_member(database, 'member', age=0)
+    api = FakeBotApi(member_status='left')
+
+    assert check(bot_module, api) == (True, 0)
+    assert api.calls['getChatMember'] == 0
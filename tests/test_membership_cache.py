@@ -0,0 +1,74 @@
+from membership_cache import MembershipCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_members_are_remembered_for_the_positive_ttl():
+    clock = Clock()
+    cache = MembershipCache(positive_ttl=300, negative_ttl=30, clock=clock)
+    cache.set(1, '@news', True)
+    clock.now += 299
+    assert cache.get(1, '@news') is True
+    clock.now += 1
+    assert cache.get(1, '@news') is None
+    assert len(cache) == 0
+
+
+def test_non_members_expire_after_the_shorter_negative_ttl():
+    clock = Clock()
+    cache = MembershipCache(positive_ttl=300, negative_ttl=30, clock=clock)
+    cache.set(1, '@news', False)
+    clock.now += 29
+    assert cache.get(1, '@news') is False
+    clock.now += 1
+    assert cache.get(1, '@news') is None
+
+
+def test_zero_ttl_disables_caching():
+    cache = MembershipCache(positive_ttl=300, negative_ttl=0, clock=Clock())
+    cache.set(1, '@news', False)
+    assert cache.get(1, '@news') is None and len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = MembershipCache(max_entries=2, clock=Clock())
+    cache.set(1, '@news', True)
+    cache.set(2, '@news', True)
+    # Reading user 1 makes user 2 the least recently used
+    assert cache.get(1, '@news') is True
+    cache.set(3, '@news', True)
+    assert cache.get(2, '@news') is None
+    assert cache.get(1, '@news') is True and cache.get(3, '@news') is True
+    assert cache.stats()['evictions'] == 1
+
+
+def test_invalidate_by_channel_user_or_everything():
+    cache = MembershipCache(clock=Clock())
+    for user_id in (1, 2):
+        for channel_id in ('@news', '@chat'):
+            cache.set(user_id, channel_id, True)
+
+    cache.invalidate(channel_id='@news')
+    assert cache.get(1, '@news') is None and cache.get(2, '@news') is None
+    assert cache.get(1, '@chat') is True
+
+    cache.invalidate(user_id=1)
+    assert cache.get(1, '@chat') is None and cache.get(2, '@chat') is True
+
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_stats_count_hits_and_misses():
+    cache = MembershipCache(clock=Clock())
+    cache.set(1, '@news', True)
+    cache.get(1, '@news')
+    cache.get(2, '@news')
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
@@ -0,0 +1,16 @@
+import pytest
+from telegram import Update
+
+from fake_telegram import callback_update
+
+
+@pytest.mark.parametrize('data, label', [
+    ('profile', 'callback:profile'),
+    ('leaderboard', 'callback:leaderboard'),
+    ('redeem', 'callback:redeem'),
+    ('x' * 64, 'callback:other'),
+    ('profile2', 'callback:other'),
+])
+def test_callback_labels_are_bounded(bot_module, data, label):
+    update = Update.de_json(callback_update(1, 2, data), None)
+    assert bot_module.callback_label(update) == label
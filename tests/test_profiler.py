@@ -0,0 +1,87 @@
+import asyncio
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+
+from fake_telegram import FakeBotApi, command_update
+from profiler import Profiler
+from conftest import fake_bot
+
+
+@pytest.mark.parametrize('kwargs', [{'seconds': 0}, {'seconds': -5}, {'seconds': float('nan')}, {'updates': 0}])
+def test_start_rejects_non_positive_limits(tmp_path, kwargs):
+    profiler = Profiler(output_dir=str(tmp_path))
+
+    async def run():
+        with pytest.raises(ValueError):
+            profiler.start(**kwargs)
+
+    asyncio.run(run())
+    assert not profiler.active
+
+
+def test_finish_writes_the_report_off_the_event_loop(tmp_path):
+    profiler = Profiler(output_dir=str(tmp_path), interval=0.001)
+    write = profiler._write
+    writer_threads = []
+
+    def slow_write(*args):
+        writer_threads.append(threading.get_ident())
+        time.sleep(0.3)
+        return write(*args)
+
+    profiler._write = slow_write
+    reports = []
+
+    async def on_complete(report):
+        reports.append(report)
+
+    async def run():
+        profiler.start(seconds=60, on_complete=on_complete)
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        assert profiler.stop()
+        await asyncio.sleep(0)
+        stopped = time.perf_counter() - started
+        assert not profiler.active and not reports
+        await profiler._writing
+        return stopped
+
+    assert asyncio.run(run()) < 0.1
+    assert writer_threads and writer_threads[0] != threading.get_ident()
+    assert len(reports) == 1
+    assert os.path.exists(reports[0]['pstats_path']) and os.path.exists(reports[0]['collapsed_path'])
+
+
+@pytest.mark.parametrize('text', ['/profiler 0', '/profiler -1', '/profiler updates 0'])
+def test_profiler_command_replies_with_usage(bot_module, text):
+    api = FakeBotApi()
+    replies = []
+    api.listeners.append(lambda method, params: replies.append(params.get('text', '')))
+
+    async def run():
+        bot = await fake_bot(api)
+        update = Update.de_json(command_update(1, bot_module.OWNER_ID, text), bot)
+        await bot_module.profile_bot(update, SimpleNamespace(bot=bot, args=text.split()[1:]))
+
+    asyncio.run(run())
+    assert not bot_module.profiler.active
+    assert len(replies) == 1 and replies[0].startswith('📝 Usage')
+
+
+def test_help_lists_every_admin_command(bot_module):
+    api = FakeBotApi()
+    replies = []
+    api.listeners.append(lambda method, params: replies.append(params.get('text', '')))
+
+    async def run():
+        bot = await fake_bot(api)
+        update = Update.de_json(command_update(1, bot_module.OWNER_ID, '/help'), bot)
+        await bot_module.help_command(update, SimpleNamespace(bot=bot, args=[]))
+
+    asyncio.run(run())
+    assert '/profiler' in replies[0] and '/checkcounters' in replies[0]
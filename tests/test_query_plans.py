@@ -0,0 +1,179 @@
+import re
+import sqlite3
+import time
+from datetime import datetime
+
+import pytest
+
+from database import Database, SCHEMA_MIGRATIONS
+from conftest import TEST_SECRET
+
+# Tables read in full on purpose: a handful of config rows, or an audit
+FULL_READS = {
+    'load_settings': 'every setting is loaded into the settings store',
+    'get_channels': 'every mandatory channel is checked',
+    'check_counters': 'an explicit COUNT(*) audit',
+    'build_rank_index': 'one pass over an index at startup',
+    'get_stats': 'the three trigger-maintained counters',
+}
+
+READS = {
+    'get_user': lambda database: database.get_user(2),
+    'load_user_projection': lambda database: database.load_user(2, ('credits', 'referral_code')),
+    'get_user_by_referral_code': lambda database: database.get_user_by_referral_code('legacy-code'),
+    'get_leaderboard': lambda database: database.get_leaderboard(10),
+    'get_user_rank': lambda database: database.get_user_rank(2),
+    'get_user_chunk': lambda database: database.get_user_chunk(0, 100, ('username', 'first_name')),
+    'get_broadcast': lambda database: database.get_broadcast(1),
+    'get_latest_broadcast_id': lambda database: database.get_latest_broadcast_id(),
+    'get_latest_broadcast_id_by_status': lambda database: database.get_latest_broadcast_id('running'),
+    'get_broadcast_done': lambda database: database.get_broadcast_done(1, 1, 100),
+    'get_reward_code_stats': lambda database: database.get_reward_code_stats(),
+    'get_channel_memberships': lambda database: database.get_channel_memberships(2),
+}
+
+# A full table scan; index scans read "SCAN t USING [COVERING] INDEX ..."
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+BASELINE_SCHEMA = [
+    '''CREATE TABLE users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        referral_code TEXT UNIQUE,
+        referred_by INTEGER,
+        credits INTEGER DEFAULT 0,
+        total_referrals INTEGER DEFAULT 0,
+        joined_date TEXT,
+        FOREIGN KEY (referred_by) REFERENCES users(user_id)
+    )''',
+    '''CREATE TABLE referrals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        referrer_id INTEGER,
+        referred_id INTEGER,
+        date TEXT
+    )''',
+    '''CREATE TABLE redemptions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        redemption_code TEXT UNIQUE,
+        credits_used INTEGER,
+        date TEXT
+    )''',
+    '''CREATE TABLE channels (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel_id TEXT UNIQUE,
+        channel_name TEXT,
+        channel_link TEXT
+    )''',
+    'CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT)',
+]
+
+
+@pytest.fixture
+def uncached(db_path):
+    # The user cache would answer user reads without any SQL
+    database = Database(db_path, referral_secret=TEST_SECRET, user_cache_size=0)
+    yield database
+    database.close()
+
+
+def seed(database: Database):
+    database.register_user(1, 'alice', 'Alice')
+    for user_id in range(2, 50):
+        database.register_user(user_id, f"user{user_id}", f"User {user_id}", 1 + user_id % 3)
+    database.import_reward_codes([f"CODE-{n}" for n in range(10)])
+    database.redeem_credits(1, 5)
+    database.set_channel_member('@channel', 2, 'member')
+    broadcast_id = database.create_broadcast('hello', 49, 1, 1)
+    database.record_broadcast_results(broadcast_id, [(2, 'sent', None), (3, 'blocked', 'Forbidden')], 3)
+
+
+def query_plans(database: Database, read):
+    """EXPLAIN QUERY PLAN details of every SELECT the read ran"""
+    conn = database.get_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        read(database)
+    finally:
+        conn.set_trace_callback(None)
+
+    plans = []
+    for sql in statements:
+        if not sql.lstrip().upper().startswith('SELECT'):
+            continue
+        details = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+        plans.append((sql, details))
+    return plans
+
+
+def full_scans(database: Database, read):
+    return [(' '.join(sql.split()), detail)
+            for sql, details in query_plans(database, read)
+            for detail in details if FULL_SCAN.match(detail)]
+
+
+@pytest.mark.parametrize('name', sorted(READS))
+def test_read_methods_use_indexes(uncached, name):
+    seed(uncached)
+    plans = query_plans(uncached, READS[name])
+    assert plans, f"{name} ran no SELECT"
+    assert full_scans(uncached, READS[name]) == []
+
+
+def test_every_public_read_method_is_covered():
+    public = {name for name in vars(Database)
+              if name.startswith(('get_', 'load_', 'build_', 'check_')) and callable(getattr(Database, name))}
+    covered = {name.replace('_projection', '').replace('_by_status', '') for name in READS}
+    # Thin wrappers over methods covered above, or served from memory
+    delegating = {'get_connection', 'get_all_users', 'get_start_message', 'get_log_channel', 'get_referral_key'}
+    assert public - covered - delegating - set(FULL_READS) == set()
+
+
+def test_baseline_database_upgrades_in_place(db_path, monkeypatch):
+    # Baseline dates are naive local time; a zone well away from UTC shows any misreading
+    monkeypatch.setenv('TZ', 'Asia/Kolkata')
+    time.tzset()
+    conn = sqlite3.connect(db_path)
+    for statement in BASELINE_SCHEMA:
+        conn.execute(statement)
+    conn.executemany('INSERT INTO users (user_id, username, first_name, referral_code, referred_by, '
+                     'credits, total_referrals, joined_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+                         (1, 'alice', 'Alice', 'legacy-code', None, 10, 2, '2024-01-02T03:04:05'),
+                         (2, 'bob', 'Bob', 'legacy-bob', 1, 0, 0, '2024-01-03T03:04:05'),
+                         (3, 'carol', 'Carol', 'legacy-carol', 1, 0, 0, '2024-01-04T03:04:05'),
+                     ])
+    # A historical duplicate referral that the UNIQUE index must survive
+    conn.executemany('INSERT INTO referrals (referrer_id, referred_id, date) VALUES (?, ?, ?)', [
+        (1, 2, '2024-01-03T03:04:05'), (1, 3, '2024-01-04T03:04:05'), (1, 3, '2024-01-04T03:04:06'),
+    ])
+    conn.execute("INSERT INTO redemptions (user_id, redemption_code, credits_used, date) "
+                 "VALUES (1, 'CODE-OLD', 300, '2024-01-05T03:04:05')")
+    conn.commit()
+    conn.close()
+
+    database = Database(db_path, referral_secret=TEST_SECRET, user_cache_size=0)
+    try:
+        conn = database.get_connection()
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_MIGRATIONS[-1][0]
+        assert conn.execute('SELECT COUNT(*) FROM referrals').fetchone()[0] == 2
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute('INSERT INTO referrals (referrer_id, referred_id) VALUES (1, 2)')
+        conn.rollback()
+        local_epoch = int(datetime(2024, 1, 2, 3, 4, 5).timestamp())
+        assert conn.execute('SELECT joined_at FROM users WHERE user_id = 1').fetchone()[0] == local_epoch
+        assert conn.execute('SELECT created_at FROM referrals WHERE referred_id = 2').fetchone()[0] == \
+            int(datetime(2024, 1, 3, 3, 4, 5).timestamp())
+        assert conn.execute('SELECT created_at FROM redemptions').fetchone()[0] == \
+            int(datetime(2024, 1, 5, 3, 4, 5).timestamp())
+        assert database.get_stats() == {'total_users': 3, 'total_referrals': 2, 'total_redemptions': 1}
+        assert database.get_user_by_referral_code('legacy-bob') == 2
+        assert database.get_user_rank(1) == 1
+
+        for name, read in READS.items():
+            assert full_scans(database, read) == [], name
+    finally:
+        database.close()
+        monkeypatch.undo()
+        time.tzset()
@@ -0,0 +1,40 @@
+from database import Database
+from conftest import TEST_SECRET
+
+
+def test_reload_picks_up_referrals_from_another_process(database, db_path):
+    database.register_user(1, 'alice', 'Alice')
+    other = Database(db_path, referral_secret=TEST_SECRET)
+    try:
+        other.register_user(2, 'bob', 'Bob')
+        for user_id in range(3, 6):
+            other.register_user(user_id, f"user{user_id}", f"User {user_id}", 2)
+
+        # This process never saw those writes
+        assert database.get_user_rank(2) == 1
+        version, top, stats = database.leaderboard.snapshot()
+        assert top == [] and stats['total_users'] == 1
+
+        database.reload_rankings()
+        assert database.get_user_rank(2) == 1 and database.get_user_rank(1) == 2
+        assert len(database.rank_index) == 5
+        new_version, top, stats = database.leaderboard.snapshot()
+        assert new_version > version
+        assert top == database.get_leaderboard(10) and top[0].user_id == 2
+        assert stats == database.get_stats() == {'total_users': 5, 'total_referrals': 3, 'total_redemptions': 0}
+    finally:
+        other.close()
+
+
+def test_counter_repair_refreshes_the_leaderboard_totals(database):
+    database.register_user(1, 'alice', 'Alice')
+    database.register_user(2, 'bob', 'Bob', 1)
+    conn = database.get_connection()
+    with conn:
+        conn.execute("UPDATE counters SET value = 99 WHERE name = 'users'")
+    database.reload_rankings()
+    assert database.leaderboard.snapshot()[2]['total_users'] == 99
+
+    report = database.check_counters(repair=True)
+    assert report['users'] == (99, 2)
+    assert database.leaderboard.snapshot()[2] == {'total_users': 2, 'total_referrals': 1, 'total_redemptions': 0}
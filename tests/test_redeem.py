@@ -0,0 +1,49 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram import Update
+
+from fake_telegram import FakeBotApi, callback_update, command_update
+from conftest import fake_bot
+
+USER_ID = 2
+REWARD_CODE = '<b>GIFT`&1</b>'
+
+
+@pytest.mark.parametrize('payload', [
+    command_update(1, USER_ID, '/redeem'),
+    callback_update(1, USER_ID, 'redeem'),
+], ids=['command', 'callback'])
+def test_redemption_escapes_the_reward_code(bot_module, bot_db, database, monkeypatch, payload):
+    database.register_user(1, 'alice', 'Alice')
+    database.register_user(USER_ID, 'bob', 'Bob <Builder>')
+    conn = database.get_connection()
+    with conn:
+        conn.execute('UPDATE users SET credits = ? WHERE user_id = ?', (bot_module.REDEMPTION_THRESHOLD, USER_ID))
+    database.users.invalidate()
+    database.import_reward_codes([REWARD_CODE])
+    logs = []
+    monkeypatch.setattr(bot_module, 'send_log', lambda context, message: logs.append(message))
+
+    api = FakeBotApi()
+    replies = []
+    api.listeners.append(lambda method, params: replies.append(params))
+
+    async def run():
+        bot = await fake_bot(api)
+        update = Update.de_json(payload, bot)
+        context = SimpleNamespace(bot=bot)
+        if update.callback_query:
+            await bot_module.button_callback(update, context)
+        else:
+            await bot_module.redeem(update, context)
+
+    asyncio.run(run())
+    assert len(logs) == 1
+    escaped = '<code>&lt;b&gt;GIFT`&amp;1&lt;/b&gt;</code>'
+    assert escaped in logs[0]
+    assert 'Bob &lt;Builder&gt;' in logs[0]
+    # The user's reply carries the same code; a parse error there would hide a voucher already paid for
+    reply = next(params for params in replies if 'Reward Code' in params.get('text', ''))
+    assert reply['parse_mode'] == 'HTML' and escaped in reply['text']
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from async_database import AsyncDatabase
+from database import Database
+from referral_codes import ReferralCodec
+from conftest import TEST_SECRET
+
+OLD_SECRET = 'old-secret'
+
+
+def colliding_code():
+    """An old-key code that also passes the new key's checksum, and the id it
+    decodes to there; ids are spread over 64 bits, so that user never exists"""
+    old, new = ReferralCodec(OLD_SECRET), ReferralCodec(TEST_SECRET)
+    for user_id in range(1, 200000):
+        code = old.encode(user_id)
+        decoded = new.decode(code)
+        if decoded is not None and decoded < 2 ** 63:
+            return user_id, code, decoded
+    pytest.fail("no colliding code found")
+
+
+def test_codes_from_an_earlier_key_resolve_to_their_owner(db_path):
+    owner, code, wrong_id = colliding_code()
+    database = Database(db_path, referral_secret=OLD_SECRET)
+    database.register_user(owner, 'alice', 'Alice')
+    assert database.get_user(owner).referral_code == code
+    database.close()
+
+    # The key was rotated
+    database = Database(db_path, referral_secret=TEST_SECRET)
+    try:
+        assert database.get_user(wrong_id) is None
+        assert database.get_user_by_referral_code(code) == owner
+
+        async def resolve():
+            db = AsyncDatabase(database)
+            try:
+                return await db.get_user_by_referral_code(code)
+            finally:
+                db.close()
+
+        # The async fallback goes straight to the table, without decoding again
+        decodes = []
+        decode = database.referral_codes.decode
+        database.referral_codes.decode = lambda code: decodes.append(code) or decode(code)
+        try:
+            assert asyncio.run(resolve()) == owner
+        finally:
+            del database.referral_codes.decode
+        assert decodes == [code]
+        # Codes issued under the new key still decode
+        database.register_user(owner + 1, 'bob', 'Bob')
+        assert database.get_user_by_referral_code(database.referral_codes.encode(owner + 1)) == owner + 1
+    finally:
+        database.close()
@@ -0,0 +1,85 @@
+import asyncio
+import random
+from collections import Counter
+
+import pytest
+
+from async_database import AsyncDatabase
+from database import Database
+
+REFERRERS = 20
+STARTS = 1000
+NEW_USERS = 600
+
+
+def fire_starts(database: Database, batch_writes: bool):
+    """1,000 concurrent /start registrations, many of them repeated taps"""
+    rng = random.Random(15)
+    referred_by = {user_id: rng.choice([None, *range(1, REFERRERS + 1)])
+                   for user_id in range(REFERRERS + 1, REFERRERS + NEW_USERS + 1)}
+    starts = list(referred_by) + [rng.choice(list(referred_by)) for _ in range(STARTS - NEW_USERS)]
+    rng.shuffle(starts)
+
+    async def run():
+        db = AsyncDatabase(database, batch_writes=batch_writes)
+        try:
+            results = await asyncio.gather(*[
+                db.register_user(user_id, f"user{user_id}", f"User {user_id}", referred_by[user_id])
+                for user_id in starts])
+            await db.flush()
+        finally:
+            db.close()
+        return results
+
+    return starts, referred_by, asyncio.run(run())
+
+
+@pytest.mark.parametrize('batch_writes', [False, True], ids=['direct', 'batched'])
+def test_concurrent_starts_register_and_credit_exactly_once(database, batch_writes):
+    for user_id in range(1, REFERRERS + 1):
+        database.register_user(user_id, f"user{user_id}", f"User {user_id}")
+
+    starts, referred_by, results = fire_starts(database, batch_writes)
+
+    registered = Counter(user_id for user_id, result in zip(starts, results) if result is not None)
+    assert registered == Counter(list(referred_by))
+    for user_id, result in zip(starts, results):
+        if result is not None:
+            assert result['referred'] == (referred_by[user_id] is not None)
+
+    conn = database.get_connection()
+    assert conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] == REFERRERS + NEW_USERS
+    expected = Counter(referrer for referrer in referred_by.values() if referrer)
+    referrals = dict(conn.execute('SELECT referrer_id, COUNT(*) FROM referrals GROUP BY referrer_id'))
+    assert referrals == dict(expected)
+    for user_id, credits, total_referrals in conn.execute(
+            'SELECT user_id, credits, total_referrals FROM users WHERE user_id <= ?', (REFERRERS,)):
+        assert total_referrals == expected[user_id]
+        assert credits == 5 * expected[user_id]
+
+    # Counters, rank index and leaderboard snapshot were all kept current
+    assert all(stored == actual for stored, actual in database.check_counters().values())
+    version, top, stats = database.leaderboard.snapshot()
+    assert stats == database.get_stats()
+    assert sorted(entry.total_referrals for entry in top) == \
+        sorted(entry.total_referrals for entry in database.get_leaderboard(len(top)))
+    for entry in top:
+        assert entry.total_referrals == expected[entry.user_id]
+    rebuilt = database.build_rank_index()
+    for value in set(expected.values()) | {0}:
+        assert database.rank_index.rank(value) == rebuilt.rank(value)
+    assert len(database.rank_index) == len(rebuilt)
+
+
+def test_cached_referrers_match_the_table_after_concurrent_starts(database):
+    for user_id in range(1, REFERRERS + 1):
+        database.register_user(user_id, f"user{user_id}", f"User {user_id}")
+        database.get_user(user_id)
+
+    fire_starts(database, batch_writes=True)
+
+    cached = {user_id: database.get_user(user_id) for user_id in range(1, REFERRERS + 1)}
+    assert database.users.stats()['hits'] >= REFERRERS
+    database.users.invalidate()
+    for user_id, record in cached.items():
+        assert record == database.load_user(user_id)
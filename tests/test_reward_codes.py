@@ -0,0 +1,111 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from async_database import AsyncDatabase
+
+
+def test_code_file_bom_is_dropped(bot_module):
+    content = '\ufeffVOUCHER-1\r\nVOUCHER-2\n'.encode('utf-8')
+    assert bot_module.parse_reward_codes(content) == ['VOUCHER-1', 'VOUCHER-2']
+
+
+def test_non_utf8_code_file_is_rejected(bot_module):
+    with pytest.raises(UnicodeDecodeError):
+        bot_module.parse_reward_codes('CÓDIGO-1\n'.encode('latin-1'))
+
+
+def test_import_counts_added_and_skipped(database):
+    added, skipped = database.import_reward_codes(['CODE-1', ' CODE-2 ', '', 'CODE-1', '#A1B2', '   '])
+    assert (added, skipped) == (3, 3)
+    # Re-importing the same file adds nothing
+    assert database.import_reward_codes(['CODE-1', 'CODE-2']) == (0, 2)
+    assert database.get_reward_code_stats() == {'available': 3, 'claimed': 0, 'total': 3}
+
+
+def test_codes_starting_with_a_hash_are_imported(database):
+    database.import_reward_codes(['#A1B2'])
+    database.register_user(1, 'alice', 'Alice')
+    conn = database.get_connection()
+    with conn:
+        conn.execute('UPDATE users SET credits = 300 WHERE user_id = 1')
+    assert database.redeem_credits(1, 300) == '#A1B2'
+
+
+def give_credits(database, user_id: int, credits: int):
+    conn = database.get_connection()
+    with conn:
+        conn.execute('UPDATE users SET credits = ? WHERE user_id = ?', (credits, user_id))
+    database.users.invalidate((user_id,))
+
+
+def redemption_state(database, user_id: int):
+    conn = database.get_connection()
+    credits = conn.execute('SELECT credits FROM users WHERE user_id = ?', (user_id,)).fetchone()[0]
+    redemptions = [row[0] for row in conn.execute(
+        'SELECT redemption_code FROM redemptions WHERE user_id = ? ORDER BY id', (user_id,))]
+    claimed = [row[0] for row in conn.execute(
+        'SELECT code FROM reward_codes WHERE claimed_by = ? ORDER BY id', (user_id,))]
+    return credits, redemptions, claimed
+
+
+def redeem_concurrently(database, mode: str, taps: int):
+    if mode == 'threads':
+        # Separate connections racing on the database itself
+        barrier = threading.Barrier(taps)
+
+        def tap():
+            barrier.wait()
+            return database.redeem_credits(1, 300)
+
+        with ThreadPoolExecutor(taps) as pool:
+            return list(pool.map(lambda _: tap(), range(taps)))
+
+    async def run():
+        db = AsyncDatabase(database, batch_writes=mode == 'batched')
+        try:
+            return await asyncio.gather(*[db.redeem_credits(1, 300) for _ in range(taps)])
+        finally:
+            db.close()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('mode', ['direct', 'batched', 'threads'])
+def test_concurrent_redeems_never_overdraw(database, mode):
+    database.import_reward_codes([f"CODE-{n}" for n in range(10)])
+    database.register_user(1, 'alice', 'Alice')
+    # Enough for two redemptions, tapped ten times at once
+    give_credits(database, 1, 650)
+
+    codes = [code for code in redeem_concurrently(database, mode, 10) if code]
+    credits, redemptions, claimed = redemption_state(database, 1)
+    assert len(codes) == 2 and len(set(codes)) == 2
+    assert credits == 50
+    assert redemptions == claimed == sorted(codes)
+    assert database.leaderboard.snapshot()[2]['total_redemptions'] == 2
+
+
+@pytest.mark.parametrize('batch_writes', [False, True], ids=['direct', 'batched'])
+def test_debit_is_rolled_back_when_codes_run_out(database, batch_writes):
+    database.import_reward_codes(['ONLY-CODE'])
+    database.register_user(1, 'alice', 'Alice')
+    give_credits(database, 1, 600)
+
+    async def run():
+        db = AsyncDatabase(database, batch_writes=batch_writes)
+        try:
+            first = await db.redeem_credits(1, 300)
+            second = await db.redeem_credits(1, 300)
+            return first, second
+        finally:
+            db.close()
+
+    assert asyncio.run(run()) == ('ONLY-CODE', None)
+    credits, redemptions, claimed = redemption_state(database, 1)
+    assert credits == 300
+    assert redemptions == claimed == ['ONLY-CODE']
+    assert database.get_user(1).credits == 300
+    assert database.get_stats()['total_redemptions'] == 1
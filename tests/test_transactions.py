@@ -0,0 +1,60 @@
+import sqlite3
+
+import pytest
+
+
+def hold_write_lock(db_path):
+    blocker = sqlite3.connect(db_path, isolation_level=None)
+    blocker.execute('BEGIN IMMEDIATE')
+    return blocker
+
+
+def test_locked_implicit_write_leaves_no_open_transaction(database, db_path):
+    conn = database.get_connection()
+    conn.execute('PRAGMA busy_timeout = 50')
+    blocker = hold_write_lock(db_path)
+    try:
+        with pytest.raises(sqlite3.OperationalError, match='locked'):
+            database.write_setting('start_message', 'hello')
+        assert not conn.in_transaction
+    finally:
+        blocker.rollback()
+        blocker.close()
+
+    assert database.register_user(1, 'alice', 'Alice')['referral_code']
+    database.write_setting('start_message', 'hello')
+    assert database.load_settings()['start_message'] == 'hello'
+
+
+@pytest.mark.parametrize('write', [
+    lambda database: database.set_channel_member('@channel', 1, 'member'),
+    lambda database: database.create_broadcast('hi', 1, 1, 1),
+    lambda database: database.import_reward_codes(['CODE-1']),
+    lambda database: database.add_channel('@channel', 'Channel'),
+])
+def test_every_implicit_writer_rolls_back_on_lock(database, db_path, write):
+    conn = database.get_connection()
+    conn.execute('PRAGMA busy_timeout = 50')
+    blocker = hold_write_lock(db_path)
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            write(database)
+        assert not conn.in_transaction
+    finally:
+        blocker.rollback()
+        blocker.close()
+    write(database)
+
+
+def test_non_sqlite_error_rolls_back_registration(database):
+    with pytest.raises(ValueError):
+        database.register_user(0, 'nobody', 'Nobody')
+    assert not database.get_connection().in_transaction
+    assert database.register_user(1, 'alice', 'Alice')
+
+
+def test_begin_recovers_a_leaked_transaction(database):
+    conn = database.get_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    assert database.register_user(1, 'alice', 'Alice')
+    assert database.get_user(1).username == 'alice'
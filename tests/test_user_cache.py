@@ -0,0 +1,54 @@
+import pytest
+
+from database import Database
+from conftest import TEST_SECRET
+
+
+@pytest.fixture
+def other(db_path, database):
+    """A second connection to the same file, standing in for another process"""
+    other = Database(db_path, referral_secret=TEST_SECRET)
+    yield other
+    other.close()
+
+
+@pytest.fixture
+def tracked(database):
+    for user_id in (1, 2, 3):
+        database.add_user(user_id, f"user{user_id}", f"User {user_id}")
+    database.track_user_changes()
+    for user_id in (1, 2, 3):
+        database.get_user(user_id)
+    return database
+
+
+def write(database: Database, sql: str, *params):
+    conn = database.get_connection()
+    with conn:
+        conn.execute(sql, params)
+
+
+def test_sync_invalidates_users_changed_by_another_connection(tracked, other):
+    write(other, 'UPDATE users SET credits = credits + 5 WHERE user_id = ?', 1)
+    write(other, 'DELETE FROM users WHERE user_id = ?', 2)
+    # Still served from the cache until the next sync
+    assert tracked.get_user(1).credits == 0
+    assert tracked.get_user(2) is not None
+
+    assert tracked.sync_user_cache() == 2
+    assert tracked.get_user(1).credits == 5
+    assert tracked.get_user(2) is None
+    # Untouched users stay cached
+    assert tracked.users.get(3) is not None
+    assert tracked.sync_user_cache() == 0
+
+
+def test_sync_clears_the_cache_after_missing_pruned_changes(tracked, other):
+    write(other, 'UPDATE users SET credits = 7 WHERE user_id = ?', 1)
+    write(other, 'UPDATE users SET credits = 9 WHERE user_id = ?', 2)
+    # Another process pruned the first change before this one synced
+    write(other, 'DELETE FROM user_changes WHERE seq = (SELECT MIN(seq) FROM user_changes)')
+
+    assert tracked.sync_user_cache() == 1
+    assert tracked.users.get(1) is None and tracked.users.get(3) is None
+    assert tracked.get_user(1).credits == 7
@@ -0,0 +1,92 @@
+"""Smoke test: python bot.py --mode webhook against the fake Bot API server,
+fed a recorded update over HTTP the way Telegram would POST it"""
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+
+import pytest
+
+pytest.importorskip('tornado', reason="webhook mode needs python-telegram-bot[webhooks]")
+
+from fake_bot_api_server import FakeBotApiServer
+from fake_telegram import FakeBotApi, command_update
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET = 'smoke-secret'
+USER_ID = 4242
+STARTUP_TIMEOUT = 30
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def post(port: int, path: str, payload: dict, secret: str) -> int:
+    body = json.dumps(payload).encode('utf-8')
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"POST /{path} HTTP/1.1\r\n"
+                 f"Host: 127.0.0.1:{port}\r\n"
+                 f"Content-Type: application/json\r\n"
+                 f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+                 f"Content-Length: {len(body)}\r\n"
+                 f"Connection: close\r\n\r\n".encode('latin-1') + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    writer.close()
+    return int(status_line.split()[1])
+
+
+async def wait_for(condition, timeout: float):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        if loop.time() > deadline:
+            raise AssertionError("timed out")
+        await asyncio.sleep(0.05)
+
+
+def test_webhook_mode_answers_a_posted_update(tmp_path):
+    api = FakeBotApi()
+    replies = []
+    api.listeners.append(lambda method, params: method == 'sendMessage' and replies.append(params))
+    api_port, webhook_port = free_port(), free_port()
+
+    async def run():
+        server = FakeBotApiServer(api, port=api_port)
+        await server.start()
+        env = dict(os.environ,
+                   BOT_TOKEN='123:SMOKE',
+                   BOT_API_BASE_URL=f"http://127.0.0.1:{api_port}/bot",
+                   DB_PATH=str(tmp_path / 'webhook.db'),
+                   REFERRAL_CODE_SECRET='smoke')
+        bot = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, 'bot.py'), '--mode', 'webhook',
+            '--webhook-url', f"http://127.0.0.1:{webhook_port}", '--listen', '127.0.0.1',
+            '--port', str(webhook_port), '--path', 'telegram', '--secret-token', SECRET,
+            '--health-port', '0', env=env, cwd=str(tmp_path),
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+        try:
+            # setWebhook comes right before the webhook server starts listening
+            await wait_for(lambda: api.webhook_url or bot.returncode is not None, STARTUP_TIMEOUT)
+            assert api.webhook_url == f"http://127.0.0.1:{webhook_port}/telegram"
+            assert api.webhook_secret == SECRET
+            await asyncio.sleep(0.5)
+
+            assert await post(webhook_port, 'telegram', command_update(1, USER_ID, '/start'), 'wrong') == 403
+            assert await post(webhook_port, 'telegram', command_update(2, USER_ID, '/start'), SECRET) == 200
+            await wait_for(lambda: any(int(reply['chat_id']) == USER_ID for reply in replies), 10)
+        finally:
+            if bot.returncode is None:
+                bot.send_signal(signal.SIGINT)
+            stderr = (await asyncio.wait_for(bot.communicate(), 20))[1]
+            await server.stop()
+        return bot.returncode, stderr.decode('utf-8', 'replace')
+
+    returncode, stderr = asyncio.run(run())
+    assert returncode == 0, stderr
+    assert 'Traceback' not in stderr and 'Task was destroyed' not in stderr, stderr
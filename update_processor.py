@@ -0,0 +1,81 @@
+import logging
+from collections import deque
+from typing import Any, Awaitable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+UPDATE_WORKERS = 32
+MAX_PENDING_PER_USER = 20
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently while keeping each user's updates in order.
+
+    The first update from a user runs immediately (within the global worker
+    limit). Updates that arrive while it is still running are queued behind it
+    and drained by the same worker, so a user never occupies more than one
+    worker slot and, for example, a double-tapped "redeem" button is handled
+    strictly one tap after the other.
+    """
+
+    def __init__(self, max_concurrent_updates: int = UPDATE_WORKERS,
+                 max_pending_per_user: int = MAX_PENDING_PER_USER):
+        super().__init__(max_concurrent_updates)
+        self.max_pending_per_user = max_pending_per_user
+        self._pending: Dict[Hashable, deque] = {}
+        self.dropped = 0
+
+    @staticmethod
+    def ordering_key(update: object) -> Optional[Hashable]:
+        if isinstance(update, Update):
+            if update.effective_user:
+                return 'user', update.effective_user.id
+            if update.effective_chat:
+                return 'chat', update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.ordering_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            if len(pending) >= self.max_pending_per_user:
+                # Counted rather than logged so a flooding user can't flood the logs too
+                self.dropped += 1
+                coroutine.close()
+            else:
+                pending.append(coroutine)
+            return
+
+        self._pending[key] = pending = deque()
+        try:
+            await self._run(coroutine)
+            while pending:
+                await self._run(pending.popleft())
+        finally:
+            del self._pending[key]
+            for leftover in pending:
+                leftover.close()
+
+    @staticmethod
+    async def _run(coroutine: Awaitable[Any]):
+        try:
+            await coroutine
+        except Exception as e:
+            # Keep draining the user's queue even if one update blows up
+            logger.error(f"Update processing failed: {e!r}")
+
+    def pending_updates(self) -> int:
+        return sum(len(pending) for pending in self._pending.values())
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,95 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from records import UserRecord
+
+DEFAULT_MAX_ENTRIES = 50000
+
+
+class UserCache:
+    """Bounded LRU cache of UserRecords keyed by user_id.
+
+    Database writes go through it (``store`` with a row the write returned,
+    or ``invalidate``), so a cached record is never older than the last
+    local write. Loads race with writes on other threads, so a loader takes
+    ``generation`` before its SELECT and ``put`` drops the row if anything
+    was written since. Only users that exist are cached.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, user_id: int) -> Optional[UserRecord]:
+        with self._lock:
+            record = self._entries.get(user_id)
+            if record is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return record
+
+    def put(self, record: UserRecord, generation: int):
+        """Cache a loaded record, unless a write happened after ``generation``"""
+        with self._lock:
+            if generation == self.generation:
+                self._insert(record)
+
+    def store(self, record: UserRecord):
+        """Write-through: replace the cached record with the one just written"""
+        with self._lock:
+            self.generation += 1
+            self._insert(record)
+
+    def invalidate(self, user_ids: Optional[Iterable[int]] = None):
+        """Drop the given users, or everything when ``user_ids`` is None"""
+        with self._lock:
+            self.generation += 1
+            if user_ids is None:
+                self._entries.clear()
+                return
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def _insert(self, record: UserRecord):
+        if not self.enabled:
+            return
+        self._entries[record.user_id] = record
+        self._entries.move_to_end(record.user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def memory_usage(self) -> int:
+        """Rough size in bytes of the cache structure, its records and their values"""
+        with self._lock:
+            records = list(self._entries.values())
+            size = sys.getsizeof(self._entries)
+        for record in records:
+            size += sys.getsizeof(record) + sum(sys.getsizeof(value) for value in record)
+        return size
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
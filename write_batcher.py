@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Set, Tuple
+
+from database import BATCH_OPERATIONS
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH_SIZE = 64
+WRITE_BATCH_DELAY = 0.005
+
+# Applies [(name, args), ...] in one transaction and returns one result per op
+BatchRunner = Callable[[Sequence[Tuple[str, tuple]]], Awaitable[List[Any]]]
+
+
+class WriteBatcher:
+    """Group commit for registration and credit writes.
+
+    Callers still await their own result. Operations queue on the event loop
+    and are handed to the writer as one transaction once ``max_batch`` have
+    collected or ``max_delay`` seconds after the first one, whichever comes
+    first. Operations arriving while a batch commits go into the next batch,
+    so under load many callers share one commit (and one fsync).
+    """
+
+    def __init__(self, run_batch: BatchRunner, max_batch: int = WRITE_BATCH_SIZE,
+                 max_delay: float = WRITE_BATCH_DELAY):
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending: List[Tuple[str, tuple, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._commits: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.operations = 0
+        self.largest_batch = 0
+
+    async def submit(self, name: str, *args) -> Any:
+        if name not in BATCH_OPERATIONS:
+            raise ValueError(f"{name} cannot be batched")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((name, args, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+        return await future
+
+    async def flush(self):
+        """Commit everything queued so far and wait for in-flight batches"""
+        self._flush()
+        while self._commits:
+            await asyncio.gather(*self._commits, return_exceptions=True)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> dict:
+        return {
+            'pending': self.pending(),
+            'batches': self.batches,
+            'operations': self.operations,
+            'largest_batch': self.largest_batch,
+            'average_batch': round(self.operations / self.batches, 1) if self.batches else 0,
+        }
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._commit(batch))
+            self._commits.add(task)
+            task.add_done_callback(self._commits.discard)
+
+    async def _commit(self, batch: List[Tuple[str, tuple, asyncio.Future]]):
+        try:
+            results = await self.run_batch([(name, args) for name, args, _ in batch])
+        except Exception as e:
+            logger.error(f"Write batch of {len(batch)} failed: {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.operations += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for (_, _, future), result in zip(batch, results):
+            # A caller that was cancelled no longer wants its result; the
+            # write itself has already been committed
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)